@@ -1,24 +1,126 @@
+import coldstart
 from flask import (
     Flask, render_template, jsonify, request,
-    redirect, url_for, send_from_directory, make_response
+    redirect, url_for, send_from_directory, make_response, g,
+    get_template_attribute, Response
 )
+from markupsafe import Markup
 from itsdangerous import URLSafeSerializer
+from contextlib import contextmanager
+import functools
+import hashlib
 import json
 import random
 import os
+import time
 import uuid
+coldstart.mark('flask')
+
+from catalog import BASE_DIR, get_catalog
+from collection import OwnedCards, UnownedIndex
+from gacha import (
+    apply_pity, count_rarities, current_banners, get_banner, iter_pull,
+    pity_guarantees, pity_state, run_pull,
+)
+from cookie_codec import CodecError, UidMismatch, UserCodec, user_state
+from replay import ResponseCache, fingerprint, open_revisions
+from storage import normalize_user, open_store
+import metrics
+coldstart.mark('modules')
 
 # ======================================================
 # BASIC SETUP
 # ======================================================
 
-BASE_DIR = os.path.dirname(__file__)
-CARDS_FILE = os.path.join(BASE_DIR, 'cards.json')
-
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'nexoria-secret-key')
 
+# templates precompiled by scripts/build_snapshot.py, if it was run
+JINJA_CACHE_DIR = os.environ.get('NEXORIA_JINJA_CACHE', os.path.join(BASE_DIR, 'build', 'jinja'))
+if os.path.isdir(JINJA_CACHE_DIR):
+    app.jinja_env.bytecode_cache = coldstart.template_cache(JINJA_CACHE_DIR)
+
+# NEXORIA_PROFILE_DIR=<dir> + NEXORIA_PROFILE_SECRET let a request ask for a
+# flame graph of itself with an X-Nexoria-Profile header, see profiling.py
+profiler = None
+if os.environ.get('NEXORIA_PROFILE_DIR'):
+    from profiling import open_profiler
+    profiler = open_profiler(os.environ['NEXORIA_PROFILE_DIR'], BASE_DIR)
+
+# registered before every other hook (coldstart and metrics included) so the
+# profile covers them all; after_request hooks run in reverse, save_profile last
+@app.before_request
+def start_profile():
+    if profiler is not None and profiler.wants(request):
+        g.profile = (profiler, profiler.start())
+
+@app.after_request
+def save_profile(resp):
+    active = g.pop('profile', None)
+    if active is not None:
+        prof, sampler = active
+        prof.stop(sampler)
+        resp.headers['X-Nexoria-Profile'] = prof.save(
+            sampler, request.endpoint, '%s %s' % (request.method, request.path))
+    return resp
+
+@app.teardown_request
+def drop_profile(exc):
+    # the view raised, after_request never ran
+    active = g.pop('profile', None)
+    if active is not None:
+        active[0].stop(active[1])
+
+# NEXORIA_STARTUP_REPORT=1 prints startup phase times, see coldstart.py
+if coldstart.enabled:
+    coldstart.init_app(app)
+
+# NEXORIA_METRICS=1 adds /metrics and request timing, see metrics.py
+if metrics.enabled:
+    metrics.init_app(app)
+
+# NEXORIA_STATS_DB=<path> keeps global collection stats for /api/stats, see stats.py
+# (optional features are only imported when switched on)
+stats = None
+if os.environ.get('NEXORIA_STATS_DB'):
+    from stats import open_stats
+    stats = open_stats(os.environ['NEXORIA_STATS_DB'], BASE_DIR)
+
+# NEXORIA_RATELIMIT=memory|sqlite:<path> throttles pulls and buys, see ratelimit.py
+limiter = None
+if os.environ.get('NEXORIA_RATELIMIT'):
+    from ratelimit import open_limiter
+    limiter = open_limiter(os.environ['NEXORIA_RATELIMIT'], BASE_DIR)
+LIMITED_ENDPOINTS = frozenset(('pull', 'pull_stream', 'buy'))
+
+@app.before_request
+def admit():
+    # runs before any view touches the user cookie
+    if limiter is not None and request.endpoint in LIMITED_ENDPOINTS:
+        return limiter.admit(request)
+
+# legacy JSON cookies are still accepted, new ones use the binary codec
 serializer = URLSafeSerializer(app.secret_key, salt="user-data")
+codec = UserCodec(app.secret_key)
+
+# where user state lives, see storage.py (default: the cookie)
+store = open_store(os.environ.get('NEXORIA_STORE'), BASE_DIR)
+
+# Idempotency-Key responses and the newest cookie revision per uid, see replay.py
+responses = ResponseCache()
+revisions = open_revisions(os.environ.get('NEXORIA_REPLAY', 'memory'), BASE_DIR)
+
+# NEXORIA_LEDGER=<dir> keeps an append-only record of pulls and buys, see ledger.py
+ledger = None
+if os.environ.get('NEXORIA_LEDGER'):
+    from ledger import open_ledger
+    ledger = open_ledger(os.environ['NEXORIA_LEDGER'], BASE_DIR)
+coldstart.mark('setup')
+
+# parse cards.json once at startup instead of on every request
+# (or unpickle build/catalog.pickle, see scripts/build_snapshot.py)
+get_catalog()
+coldstart.mark('catalog')
 
 # ======================================================
 # USER (COOKIE BASED – VERCEL SAFE)
@@ -30,33 +132,179 @@ DEFAULT_USER = {
     "tickets": 0,
     "pity_sss": 0,
     "pity_ss": 0,
-    "pity_ur": 0
+    "pity_ur": 0,
+    "rev": 0
 }
 
-# ensure loaded users always have pity keys (for backward compatibility)
-# we will call setdefault in get_user after loading the user
+def new_user():
+    user = dict(DEFAULT_USER)
+    user['owned'] = OwnedCards()
+    return user
 
 
+def _load_legacy_user(data):
+    # cookies written before the binary codec: signed JSON with an id list
+    return normalize_user(serializer.loads(data))
+
+@metrics.timed('get_user')
 def get_user():
     uid = request.cookies.get('uid')
-    data = request.cookies.get('user_data')
 
+    if store.server_side:
+        user = store.load(uid)
+        if user is not None:
+            g.user_cookie = (uid, user_state(user))
+            g.owned_before = user['owned'].bits
+            return uid, user
+        return uuid.uuid4().hex, new_user()
+
+    data = request.cookies.get('user_data')
     if uid and data:
         try:
-            user = serializer.loads(data)
-            # backfill missing keys for older users
-            user.setdefault('pity_sss', 0)
-            user.setdefault('pity_ss', 0)
-            user.setdefault('pity_ur', 0)
+            user, bound = codec.load_for(data, uid)
+            # remember what the client already holds, see save_user_response
+            g.user_cookie = (uid, user_state(user))
+            g.owned_before = user['owned'].bits
+            if not bound:
+                unbound_cookie(data)
+            return uid, user
+        except UidMismatch:
+            # state copied under another uid: shown, but never spent or re-issued
+            user = codec.loads(data)
+            g.foreign_cookie = True
+            g.owned_before = user['owned'].bits
+            return uid, user
+        except CodecError:
+            pass
+        try:
+            user = _load_legacy_user(data)
+            g.owned_before = user['owned'].bits
+            unbound_cookie(data)
             return uid, user
         except Exception:
             pass
 
     # user baru
     uid = uuid.uuid4().hex
-    return uid, DEFAULT_USER.copy()
+    return uid, new_user()
+
+def presented_user():
+    """The state the request's cookie holds, or None; sets none of get_user()'s replay flags."""
+    data = request.cookies.get('user_data')
+    if not data:
+        return None
+    try:
+        return codec.loads(data)
+    except CodecError:
+        pass
+    try:
+        return _load_legacy_user(data)
+    except Exception:
+        return None
+
+def unbound_cookie(data):
+    # a cookie from before the uid tag can't tell which uid it belongs to, so
+    # it is honoured once: whichever request spends or upgrades it first
+    if revisions is not None and not store.server_side:
+        g.unbound_key = 'cookie:' + hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+def claim_unbound():
+    key = g.pop('unbound_key', None)
+    if key is None:
+        return True
+    if not revisions.claim(key, 0):
+        return False
+    g.claimed_unbound = key
+    return True
+
+@contextmanager
+def user_transaction():
+    # wrap get_user() .. save_user_response() for routes that spend coins/tickets
+    with store.atomic(request.cookies.get('uid')):
+        try:
+            yield
+        except BaseException:
+            # the new cookie never went out, the client still holds the old revision
+            claimed = g.pop('claimed_rev', None)
+            if claimed is not None:
+                revisions.release(*claimed)
+            key = g.pop('claimed_unbound', None)
+            if key is not None:
+                revisions.release(key, 0)
+            raise
+
+def claim_revision(uid, user):
+    """Bump the state revision for a spend; False if the cookie is outdated."""
+    if revisions is None or store.server_side:
+        # server-side state can't be replayed from an old cookie
+        return True
+    rev = user.get('rev', 0)
+    if g.get('foreign_cookie') or not claim_unbound() or not revisions.claim(uid, rev):
+        metrics.stale_rejected.inc(request.endpoint)
+        return False
+    user['rev'] = rev + 1
+    g.claimed_rev = (uid, rev)
+    return True
+
+def stale_state():
+    return jsonify({'ok': False, 'stale': True,
+                    'error': 'This session changed elsewhere, please retry'}), 409
+
+def idempotent(view):
+    """Run the view once per Idempotency-Key header; repeats get the first response."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'ok': False, 'error': 'Idempotency-Key too long'}), 400
+
+        cache_key = (request.cookies.get('uid'), request.endpoint, key)
+        state, cached = responses.begin(cache_key, fingerprint(request.get_data()))
+        if state == 'hit':
+            metrics.idempotent_replays.inc(request.endpoint)
+            status, headers, body = cached
+            resp = Response(body, status=status, headers=headers)
+            resp.headers['Idempotent-Replayed'] = 'true'
+            return resp
+        if state == 'mismatch':
+            return jsonify({'ok': False, 'error': 'Idempotency-Key reused for a different request'}), 422
+        if state == 'busy':
+            return jsonify({'ok': False, 'error': 'Request with this Idempotency-Key still running'}), 409
+        if state == 'gone':
+            return jsonify({'ok': False, 'error': 'Request with this Idempotency-Key already done, '
+                            'its response was too large to keep'}), 409
+
+        try:
+            resp = make_response(view(*args, **kwargs))
+        except BaseException:
+            responses.abandon(cache_key)
+            raise
+        # only successes are replayed, a failed request may be retried with the same key
+        if 200 <= resp.status_code < 300:
+            body = resp.get_data()
+            headers = list(resp.headers)
+            size = len(body) + sum(len(k) + len(v) for k, v in headers)
+            responses.finish(cache_key, (resp.status_code, headers, body), size)
+        else:
+            responses.abandon(cache_key)
+        return resp
+    return wrapper
 
+@metrics.timed('save_user')
 def save_user_response(resp, uid, user):
+    if stats is not None:
+        stats.record(get_catalog(), g.get('owned_before', 0), user['owned'].bits, g.pop('pulled', None))
+        g.owned_before = user['owned'].bits
+
+    # nothing changed since get_user(): the client's cookies are still valid
+    if g.get('user_cookie') == (uid, user_state(user)):
+        return resp
+    # someone else's state, or an old cookie already upgraded elsewhere
+    if g.get('foreign_cookie') or not claim_unbound():
+        return resp
+
     resp.set_cookie(
         'uid',
         uid,
@@ -64,9 +312,13 @@ def save_user_response(resp, uid, user):
         httponly=True,
         samesite='Lax'
     )
+    if store.server_side:
+        store.save(uid, user)
+        return resp
+
     resp.set_cookie(
         'user_data',
-        serializer.dumps(user),
+        codec.dumps(user, uid),
         max_age=60 * 60 * 24 * 365 * 5,
         httponly=True,
         samesite='Lax'
@@ -77,16 +329,16 @@ def save_user_response(resp, uid, user):
 # CONSTANTS
 # ======================================================
 
-TICKET_REWARDS = {
-    'D': 0,
-    'C': 0,
-    'B': 50,
-    'A': 100,
-    'S': 300,
-    'SS': 1000,
-    'SSS': 4000,
-    'UR': 10000,
-}
+# coins per single pull
+PULL_COST = 100
+
+# largest count accepted by /pull and /pull/stream (the stream never holds
+# the results in memory, so it can afford more)
+MAX_PULL_COUNT = int(os.environ.get('NEXORIA_MAX_PULL', 1000))
+MAX_STREAM_COUNT = int(os.environ.get('NEXORIA_MAX_STREAM_PULL', 100000))
+
+# most boxes one /buy may order
+MAX_BUY_COUNT = int(os.environ.get('NEXORIA_MAX_BUY', 1000))
 
 BOXES = {
     'UR': {'label': 'UR Box', 'cost': 10000},
@@ -100,71 +352,131 @@ BOXES = {
 }
 
 # ======================================================
-# LOAD CARDS (READ ONLY)
+# GACHA (RULES LIVE IN gacha.py)
 # ======================================================
 
-def load_cards():
-    with open(CARDS_FILE, 'r', encoding='utf-8') as f:
-        cards = json.load(f)
-
-    assigned = [c for c in cards if c.get('image')]
-    if len(assigned) < 10:
-        cards_dir = os.path.join(BASE_DIR, 'static', 'public', 'cards')
-        try:
-            imgs = [
-                fn for fn in os.listdir(cards_dir)
-                if os.path.isfile(os.path.join(cards_dir, fn))
-            ]
-        except Exception:
-            imgs = []
-
-        used_imgs = [
-            os.path.basename(c['image'])
-            for c in cards if c.get('image')
-        ]
-        available_imgs = [i for i in imgs if i not in used_imgs]
-        no_image_cards = [c for c in cards if not c.get('image')]
-
-        needed = 10 - len(assigned)
-        assign_count = min(needed, len(available_imgs), len(no_image_cards))
+def log_pull(uid, user, pity_before, ids, rarities, banner):
+    ledger.append({
+        'ts': time.time(), 'uid': uid, 'kind': 'pull', 'banner': banner.id, 'count': len(ids),
+        'ids': ids, 'rarities': rarities,
+        'pity_before': pity_before, 'pity_after': pity_state(user),
+        'coins': user['coins'], 'tickets': user['tickets'],
+    })
 
-        if assign_count > 0:
-            random.shuffle(available_imgs)
-            for c, img in zip(
-                random.sample(no_image_cards, assign_count),
-                random.sample(available_imgs, assign_count)
-            ):
-                c['image'] = f'public/cards/{img}'
+# ======================================================
+# DECK PAGE CACHE
+# ======================================================
 
-    return cards
+_deck_cache = (None, None)
+
+def deck_fragments(catalog):
+    """Owned/unowned markup for every card, rendered once per catalog version.
+
+    Returns [(rarity, [(card_id, front_html, back_html), ...]), ...] in deck
+    order; /deck only has to pick one of the two strings per card.
+    """
+    global _deck_cache
+    # image URLs come from the asset manifest, so a rebuild invalidates too
+    asset_manifest()
+    key = (catalog.version, _manifest[0])
+    version, groups = _deck_cache
+    if version == key:
+        return groups
+
+    card_front = get_template_attribute('_deck_card.html', 'card_front')
+    card_back = get_template_attribute('_deck_card.html', 'card_back')
+    groups = [
+        (rarity, [(c['id'], str(card_front(c)), str(card_back(c))) for c in cards])
+        for rarity, cards in catalog.grouped
+    ]
+    _deck_cache = (key, groups)
+    return groups
+
+def deck_etag(catalog, user):
+    # refresh first: a rebuilt manifest must change the tag before a 304 is sent
+    asset_manifest()
+    h = hashlib.sha1(catalog.version.encode())
+    h.update(repr(_manifest[0]).encode())
+    h.update(user['owned'].to_bytes())
+    h.update(b'|%d|%d' % (user['coins'], user['tickets']))
+    return h.hexdigest()
+
+# cards per page on /deck and /api/deck
+DECK_PAGE_SIZE = 40
+DECK_PAGE_MAX = 200
+
+def deck_cursor(catalog, pos):
+    # position in catalog.deck_order, only valid for this catalog version
+    return '%s.%d' % (catalog.version, pos)
+
+def parse_deck_cursor(catalog, cursor):
+    if not cursor:
+        return 0
+    version, _, pos = cursor.rpartition('.')
+    if version != catalog.version or not pos.isdigit():
+        return None
+    return int(pos)
+
+def deck_page(catalog, owned, start, limit, rarities=None, owned_filter=None):
+    """Up to `limit` (card, owned) pairs from deck position `start` on.
+
+    Returns (page, next_pos); next_pos is None once the deck is exhausted.
+    A rarity filter only walks the spans of those rarities.
+    """
+    order = catalog.deck_order
+    if rarities:
+        # a set: with ?rarity=UR,UR the cursor would wrap back into the first span forever
+        spans = sorted({catalog.deck_spans[r] for r in rarities})
+    else:
+        spans = [(0, len(order))]
+    page = []
+    for lo, hi in spans:
+        pos = max(start, lo)
+        while pos < hi:
+            if len(page) >= limit:
+                return page, pos
+            card = order[pos]
+            pos += 1
+            have = card['id'] in owned
+            if owned_filter is None or have == owned_filter:
+                page.append((card, have))
+    return page, None
+
+def deck_card_json(card, have):
+    if not have:
+        return {'id': card['id'], 'rarity': card['rarity'], 'owned': False}
+    data = {
+        'id': card['id'], 'rarity': card['rarity'], 'owned': True,
+        'name': card.get('name'), 'desc': card.get('desc'),
+    }
+    image = card.get('image')
+    if image and image.startswith('http'):
+        data['image'] = image
+    elif image:
+        data['image'] = asset_url(image)
+        data['thumb'] = asset_url(image, 'thumb')
+        data['thumb_webp'] = asset_url(image, 'thumb_webp')
+    return data
 
 # ======================================================
-# GACHA LOGIC
+# CATALOG DOCUMENT (CLIENT-CACHED)
 # ======================================================
 
-def choose_rarity(pulls=1):
-    probs = [
-        ('D', 0),
-        ('C', 0),
-        ('B', 65),
-        ('A', 25),
-        ('S', 5),
-        ('SS', 1),
-        ('SSS', 0.1),
-        ('UR', 0.01),
-    ]
-    labels = [r for r, _ in probs]
-    weights = [w for _, w in probs]
-    return random.choices(labels, weights=weights, k=pulls)
-
-def pick_cards_by_rarity(cards, rarity, owned_set=None, prefer_unowned=False):
-    pool = [c for c in cards if c['rarity'] == rarity]
-    # if this is a guaranteed pity slot, prefer giving an unowned card of that rarity
-    if prefer_unowned and owned_set is not None:
-        unowned = [c for c in pool if c['id'] not in owned_set]
-        if unowned:
-            return random.choice(unowned)
-    return random.choice(pool if pool else cards)
+_catalog_doc = (None, b'')
+
+def catalog_document(catalog):
+    # serialized once per catalog version
+    global _catalog_doc
+    if _catalog_doc[0] != catalog.content_hash:
+        body = json.dumps({
+            'version': catalog.content_hash,
+            'cards': catalog.public_cards,
+        }, separators=(',', ':')).encode('utf-8')
+        _catalog_doc = (catalog.content_hash, body)
+    return _catalog_doc[1]
+
+def compact_result(result):
+    return [result['id'], result['duplicate'], result['tickets_awarded']]
 
 # ======================================================
 # ROUTES
@@ -187,6 +499,7 @@ def gacha():
         'gacha.html',
         coins=user['coins'],
         tickets=user['tickets'],
+        banners=current_banners(),
         pity_sss=user.get('pity_sss', 0),
         pity_ss=user.get('pity_ss', 0),
         pity_ur=user.get('pity_ur', 0)
@@ -196,21 +509,114 @@ def gacha():
 @app.route('/deck')
 def deck():
     uid, user = get_user()
-    cards = load_cards()
-    owned = set(user['owned'])
+    catalog = get_catalog()
+    owned = user['owned']
+    # ?all=1 renders every card (no-JS fallback), otherwise the first page
+    # and static/app.js pulls the rest from /api/deck
+    full = request.args.get('all') == '1'
+
+    # the header shows coins/tickets, so they are part of the tag too
+    etag = deck_etag(catalog, user) + ('-all' if full else '')
+    if etag in request.if_none_match:
+        resp = make_response('', 304)
+    else:
+        collected = catalog.collected(owned)
+        budget = None if full else DECK_PAGE_SIZE
+        groups = []
+        for rarity, cards in deck_fragments(catalog):
+            if budget is not None:
+                cards = cards[:budget]
+                budget -= len(cards)
+            groups.append((
+                rarity, collected[rarity][0], collected[rarity][1],
+                Markup(''.join(front if card_id in owned else back
+                               for card_id, front, back in cards)),
+            ))
+        more = not full and DECK_PAGE_SIZE < len(catalog.deck_order)
+        resp = make_response(render_template(
+            'deck.html',
+            groups=groups,
+            next_cursor=deck_cursor(catalog, DECK_PAGE_SIZE) if more else None,
+            coins=user['coins'],
+            tickets=user['tickets']
+        ))
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return save_user_response(resp, uid, user)
 
-    rarity_order = ['UR', 'SSS', 'SS', 'S', 'A', 'B', 'C', 'D']
-    grouped = [(r, [c for c in cards if c['rarity'] == r]) for r in rarity_order]
+@app.route('/api/deck')
+def api_deck():
+    """One page of the deck as JSON.
 
-    resp = make_response(render_template(
-        'deck.html',
-        grouped_cards=grouped,
-        owned=owned,
-        coins=user['coins'],
-        tickets=user['tickets']
-    ))
+    Query: cursor (from the previous page's next_cursor), limit,
+    rarity (comma separated), owned (1 = only owned, 0 = only missing).
+    Missing cards only expose id and rarity, like the card backs on /deck.
+    """
+    uid, user = get_user()
+    catalog = get_catalog()
+    owned = user['owned']
+
+    start = parse_deck_cursor(catalog, request.args.get('cursor'))
+    if start is None:
+        # catalog changed since the cursor was handed out
+        return jsonify({'ok': False, 'error': 'Stale cursor', 'catalog_version': catalog.version}), 409
+    try:
+        limit = min(max(int(request.args.get('limit', DECK_PAGE_SIZE)), 1), DECK_PAGE_MAX)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'Invalid limit'}), 400
+    rarities = [r for r in request.args.get('rarity', '').upper().split(',') if r]
+    if any(r not in catalog.deck_spans for r in rarities):
+        return jsonify({'ok': False, 'error': 'Invalid rarity'}), 400
+    owned_filter = {'1': True, '0': False}.get(request.args.get('owned'))
+
+    etag = hashlib.sha1(('%s|%s' % (deck_etag(catalog, user), request.query_string.decode('latin-1'))).encode()).hexdigest()
+    if etag in request.if_none_match:
+        resp = make_response('', 304)
+    else:
+        cards, next_pos = deck_page(catalog, owned, start, limit, rarities, owned_filter)
+        resp = jsonify({
+            'ok': True,
+            'catalog_version': catalog.version,
+            'cards': [deck_card_json(c, have) for c, have in cards],
+            'next_cursor': deck_cursor(catalog, next_pos) if next_pos is not None else None,
+            'summary': {r: {'have': have, 'total': total}
+                        for r, (have, total) in catalog.collected(owned).items()},
+        })
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
     return save_user_response(resp, uid, user)
 
+@app.route('/api/catalog')
+def api_catalog():
+    """Every card once, keyed by content hash; compact /pull and /buy refer to it."""
+    catalog = get_catalog()
+    etag = catalog.content_hash
+    if etag in request.if_none_match:
+        resp = make_response('', 304)
+    else:
+        resp = Response(catalog_document(catalog), mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'public, no-cache'
+    return resp
+
+@app.route('/api/banners')
+def api_banners():
+    """Banners /pull accepts, with their rates, pity thresholds and rate-up cards."""
+    banners = current_banners()
+    return jsonify({
+        'default': banners.default,
+        'banners': [b.public() for b in banners.banners.values()],
+    })
+
+@app.route('/api/stats')
+def api_stats():
+    """Global collection stats, read straight from the aggregate tables."""
+    if stats is None:
+        return jsonify({'ok': False, 'error': 'Stats are disabled'}), 404
+    resp = jsonify({'ok': True, **stats.snapshot(get_catalog())})
+    resp.headers['Cache-Control'] = 'public, max-age=5'
+    return resp
+
 @app.route('/shop')
 def shop():
     uid, user = get_user()
@@ -218,160 +624,270 @@ def shop():
         'shop.html',
         coins=user['coins'],
         tickets=user['tickets'],
-        boxes=BOXES
+        boxes=BOXES,
+        max_buy=MAX_BUY_COUNT
     ))
     return save_user_response(resp, uid, user)
 
+def json_object():
+    """The JSON body as a dict ({} when empty), or None for any other JSON value."""
+    data = request.json
+    if data is None:
+        return {}
+    return data if isinstance(data, dict) else None
+
+def not_an_object():
+    return jsonify({'ok': False, 'error': 'Request body must be a JSON object'}), 400
+
+def parse_count(data, limit):
+    # whole numbers only, same as /buy quantities: 1.9 or true are not a count
+    count = data.get('count', 1)
+    if isinstance(count, bool) or not isinstance(count, int):
+        return None
+    return count if 1 <= count <= limit else None
+
+def bad_count(limit):
+    metrics.count_rejected.inc(request.endpoint)
+    return jsonify({'ok': False, 'error': 'count must be between 1 and %d' % limit}), 400
+
+def request_banner(data, catalog):
+    # {"banner": "<id>"}, the default banner when missing
+    banner_id = data.get('banner')
+    if banner_id is not None and not isinstance(banner_id, str):
+        return None
+    return get_banner(banner_id, catalog)
+
 @app.route('/pull', methods=['POST'])
+@idempotent
 def pull():
-    data = request.json or {}
-    count = int(data.get('count', 1))
-    total_cost = count * 100
-
-    uid, user = get_user()
-
-    if user['coins'] < total_cost:
-        return jsonify({'ok': False, 'error': 'Not enough coins'}), 400
-
-    cards = load_cards()
-
-    # Determine guaranteed rarities based on pity
-    guarantee_sss = user.get('pity_sss', 0) >= 200
-    guarantee_ss = user.get('pity_ss', 0) >= 100
-    guarantee_ur = user.get('pity_ur', 0) >= 500
-
-    guarantees = []
-    # priority: UR > SSS > SS
-    if guarantee_ur:
-        guarantees.append('UR')
-    if guarantee_sss:
-        guarantees.append('SSS')
-    if guarantee_ss:
-        guarantees.append('SS')
-
-    # Helper: generate a base list of rarities
-    rarities = choose_rarity(count)
-
-    # track which slots were imposed by guarantees so we can prefer unowned cards
-    guaranteed_flags = [False] * len(rarities)
-
-    # If we have guarantees, ensure each guaranteed rarity appears at least once
-    # If we can't fit all guarantees because count is small, use the priority order above
-    needed = list(guarantees)
-    if needed:
-        if len(needed) > count:
-            needed = needed[:count]
-        for g in needed:
-            if g not in rarities:
-                # try to replace a non-unique low-rarity slot
-                replaced = False
-                # prefer replacing from lowest rarities up
-                low_priorities = ['D','C','B','A','S','SS']
-                for lp in low_priorities:
-                    try:
-                        idx = rarities.index(lp)
-                        rarities[idx] = g
-                        guaranteed_flags[idx] = True
-                        replaced = True
-                        break
-                    except ValueError:
-                        continue
-                if not replaced:
-                    # fallback: replace random slot
-                    idx = random.randrange(0, len(rarities))
-                    rarities[idx] = g
-                    guaranteed_flags[idx] = True
-
-    results = []
-    obtained_sss = False
-    obtained_ss = False
-    obtained_ur = False
-
-    for i, r in enumerate(rarities):
-        prefer_unowned = guaranteed_flags[i]
-        card = pick_cards_by_rarity(cards, r, owned_set=set(user['owned']), prefer_unowned=prefer_unowned)
-        result = dict(card)
-
-        if card['id'] in user['owned']:
-            reward = TICKET_REWARDS.get(card['rarity'], 0)
-            user['tickets'] += reward
-            result['duplicate'] = True
-            result['tickets_awarded'] = reward
+    data = json_object()
+    if data is None:
+        return not_an_object()
+    count = parse_count(data, MAX_PULL_COUNT)
+    if count is None:
+        return bad_count(MAX_PULL_COUNT)
+    # {"compact": true}: [id, duplicate, tickets_awarded] per card, see /api/catalog
+    compact = data.get('compact') is True
+    total_cost = count * PULL_COST
+    catalog = get_catalog()
+    banner = request_banner(data, catalog)
+    if banner is None:
+        return jsonify({'ok': False, 'error': 'Unknown banner'}), 400
+
+    with user_transaction():
+        uid, user = get_user()
+
+        if user['coins'] < total_cost:
+            return jsonify({'ok': False, 'error': 'Not enough coins'}), 400
+        if not claim_revision(uid, user):
+            return stale_state()
+
+        # Deduct coins, then draw (pity counters are updated by run_pull)
+        pity_before = pity_state(user)
+        user['coins'] -= total_cost
+        results = run_pull(catalog, user, count, banner)
+        if stats is not None:
+            g.pulled = count_rarities(r['rarity'] for r in results)
+
+        if ledger is not None:
+            log_pull(uid, user, pity_before,
+                     [r['id'] for r in results], [r['rarity'] for r in results], banner)
+
+        if compact:
+            payload = {
+                'compact': True,
+                'catalog_version': catalog.content_hash,
+                'results': [compact_result(r) for r in results],
+            }
         else:
-            user['owned'].append(card['id'])
-            result['duplicate'] = False
-            result['tickets_awarded'] = 0
-
-        results.append(result)
-
-        # track obtained rarities to reset pity
-        if card['rarity'] == 'SSS':
-            obtained_sss = True
-        if card['rarity'] == 'SS':
-            obtained_ss = True
-        if card['rarity'] == 'UR':
-            obtained_ur = True
-
-    # Deduct coins after pull
-    user['coins'] -= total_cost
-
-    # Update pity counters: if obtained -> reset to 0, else increase by number of pulls
-    if obtained_sss:
-        user['pity_sss'] = 0
-    else:
-        user['pity_sss'] = min(200, user.get('pity_sss', 0) + count)
-
-    if obtained_ss:
-        user['pity_ss'] = 0
-    else:
-        user['pity_ss'] = min(100, user.get('pity_ss', 0) + count)
-
-    if obtained_ur:
-        user['pity_ur'] = 0
-    else:
-        user['pity_ur'] = min(500, user.get('pity_ur', 0) + count)
-
-    resp = jsonify({
-        'ok': True,
-        'results': results,
-        'coins': user['coins'],
-        'tickets': user['tickets'],
-        'pity_sss': user.get('pity_sss', 0),
-        'pity_ss': user.get('pity_ss', 0),
-        'pity_ur': user.get('pity_ur', 0)
-    })
-    return save_user_response(resp, uid, user)
+            payload = {'results': results}
+        resp = jsonify({
+            'ok': True,
+            'banner': banner.id,
+            **payload,
+            'coins': user['coins'],
+            'tickets': user['tickets'],
+            'pity_sss': user.get('pity_sss', 0),
+            'pity_ss': user.get('pity_ss', 0),
+            'pity_ur': user.get('pity_ur', 0)
+        })
+        return save_user_response(resp, uid, user)
+
+@app.route('/pull/stream', methods=['POST'])
+def pull_stream():
+    """Like /pull, but results come back as NDJSON, one card per line.
+
+    The last line is a trailer with the final coins/tickets/pity. The new
+    user state has to go out in the response headers, so the pull is first
+    run to completion without building any results, then replayed from the
+    same seed while streaming; neither pass keeps the results in memory.
+    """
+    data = json_object()
+    if data is None:
+        return not_an_object()
+    count = parse_count(data, MAX_STREAM_COUNT)
+    if count is None:
+        return bad_count(MAX_STREAM_COUNT)
+    compact = data.get('compact') is True
+    total_cost = count * PULL_COST
+    catalog = get_catalog()
+    banner = request_banner(data, catalog)
+    if banner is None:
+        return jsonify({'ok': False, 'error': 'Unknown banner'}), 400
+
+    with user_transaction():
+        uid, user = get_user()
+
+        if user['coins'] < total_cost:
+            return jsonify({'ok': False, 'error': 'Not enough coins'}), 400
+        if not claim_revision(uid, user):
+            return stale_state()
+
+        guarantees = pity_guarantees(user, banner)
+        seed = random.getrandbits(64)
+        replay = {'tickets': user['tickets'], 'owned': OwnedCards(user['owned'].bits)}
+
+        pity_before = pity_state(user)
+        user['coins'] -= total_cost
+        obtained = set()
+        # only kept when the ledger needs them
+        ids = [] if ledger is not None else None
+        pulled = {}
+        for card, duplicate, reward in iter_pull(catalog, user, count, guarantees, seed, banner):
+            obtained.add(card['rarity'])
+            pulled[card['rarity']] = pulled.get(card['rarity'], 0) + 1
+            if ids is not None:
+                ids.append(card['id'])
+            if metrics.enabled:
+                metrics.record_card(card['rarity'], duplicate, reward)
+        apply_pity(user, obtained, count, banner)
+        if metrics.enabled:
+            metrics.record_pull((), guarantees[:count])
+        if ids is not None:
+            log_pull(uid, user, pity_before, ids, [catalog.by_id[i]['rarity'] for i in ids], banner)
+        g.pulled = pulled
+
+        trailer = json.dumps({
+            'ok': True,
+            'done': True,
+            'banner': banner.id,
+            'count': count,
+            **({'compact': True, 'catalog_version': catalog.content_hash} if compact else {}),
+            'coins': user['coins'],
+            'tickets': user['tickets'],
+            'pity_sss': user.get('pity_sss', 0),
+            'pity_ss': user.get('pity_ss', 0),
+            'pity_ur': user.get('pity_ur', 0)
+        })
+
+        def generate():
+            lines = []
+            for card, duplicate, reward in iter_pull(catalog, replay, count, guarantees, seed, banner):
+                if compact:
+                    lines.append('[%d,%s,%d]' % (card['id'], 'true' if duplicate else 'false', reward))
+                else:
+                    lines.append(json.dumps(dict(card, duplicate=duplicate, tickets_awarded=reward)))
+                if len(lines) >= 256:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+            lines.append(trailer)
+            yield '\n'.join(lines) + '\n'
+
+        resp = Response(generate(), mimetype='application/x-ndjson')
+        return save_user_response(resp, uid, user)
+
+def parse_orders(data):
+    """([(rarity, quantity)], None) with repeated rarities merged, or (None, error).
+
+    {"rarity": "B"} is one box, {"orders": [{"rarity": "B", "quantity": 3}, ...]}
+    any number of them.
+    """
+    orders = data.get('orders')
+    if orders is None:
+        orders = [{'rarity': data.get('rarity')}]
+    if not isinstance(orders, list) or not orders:
+        return None, 'orders must be a non-empty list'
+    merged = {}
+    for order in orders:
+        rarity = order.get('rarity') if isinstance(order, dict) else None
+        if not isinstance(rarity, str) or rarity not in BOXES:
+            return None, 'Invalid rarity'
+        quantity = order.get('quantity', 1)
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            return None, 'Invalid quantity'
+        merged[rarity] = merged.get(rarity, 0) + quantity
+    if sum(merged.values()) > MAX_BUY_COUNT:
+        metrics.count_rejected.inc(request.endpoint)
+        return None, 'at most %d boxes per request' % MAX_BUY_COUNT
+    return list(merged.items()), None
 
 @app.route('/buy', methods=['POST'])
+@idempotent
 def buy():
-    data = request.json or {}
-    rarity = data.get('rarity')
-
-    if rarity not in BOXES:
-        return jsonify({'ok': False, 'error': 'Invalid rarity'}), 400
-
-    uid, user = get_user()
-    cost = BOXES[rarity]['cost']
-
-    if user['tickets'] < cost:
-        return jsonify({'ok': False, 'error': 'Not enough tickets'}), 400
-
-    cards = load_cards()
-    pool = [c for c in cards if c['rarity'] == rarity and c['id'] not in user['owned']]
-
-    if not pool:
-        return jsonify({'ok': False, 'error': 'No unowned cards left'}), 400
-
-    card = random.choice(pool)
-    user['tickets'] -= cost
-    user['owned'].append(card['id'])
-
-    resp = jsonify({
-        'ok': True,
-        'card': card,
-        'tickets': user['tickets']
-    })
-    return save_user_response(resp, uid, user)
+    data = json_object()
+    if data is None:
+        return not_an_object()
+    orders, error = parse_orders(data)
+    if error:
+        return jsonify({'ok': False, 'error': error}), 400
+    # a box whose pool runs out is filled as far as it goes, unless
+    # "partial": false asks for all or nothing
+    partial = data.get('partial', True) is not False
+
+    with user_transaction():
+        uid, user = get_user()
+        owned = user['owned']
+        catalog = get_catalog()
+        index = UnownedIndex(catalog.rarity_ids, owned)
+
+        # everything is checked before the first card is drawn
+        fills = [(rarity, quantity, min(quantity, index.count(rarity))) for rarity, quantity in orders]
+        if not any(n for _, _, n in fills):
+            return jsonify({'ok': False, 'error': 'No unowned cards left'}), 400
+        if not partial and any(n < quantity for _, quantity, n in fills):
+            return jsonify({'ok': False, 'error': 'Not enough unowned cards',
+                            'available': {rarity: n for rarity, _, n in fills}}), 400
+        cost = sum(BOXES[rarity]['cost'] * n for rarity, _, n in fills)
+        if user['tickets'] < cost:
+            return jsonify({'ok': False, 'error': 'Not enough tickets', 'cost': cost}), 400
+        if not claim_revision(uid, user):
+            return stale_state()
+
+        # drawn without replacement, one pass per rarity
+        cards = []
+        for rarity, _, n in fills:
+            for card_id in index.take(rarity, n):
+                owned.add(card_id)
+                cards.append(catalog.by_id[card_id])
+        user['tickets'] -= cost
+
+        if ledger is not None:
+            ledger.append({
+                'ts': time.time(), 'uid': uid, 'kind': 'buy',
+                'ids': [c['id'] for c in cards], 'rarities': [c['rarity'] for c in cards], 'cost': cost,
+                'coins': user['coins'], 'tickets': user['tickets'],
+            })
+
+        compact = data.get('compact') is True
+        if compact:
+            rows = [[c['id'], False, 0] for c in cards]
+            payload = {'compact': True, 'catalog_version': catalog.content_hash}
+        else:
+            rows = [dict(c) for c in cards]
+            payload = {}
+        if 'orders' in data:
+            payload['cards'] = rows
+            payload['orders'] = [{'rarity': rarity, 'requested': quantity, 'bought': n}
+                                 for rarity, quantity, n in fills]
+            payload['spent'] = cost
+        else:
+            payload['card'] = rows[0]
+        resp = jsonify({
+            'ok': True,
+            **payload,
+            'tickets': user['tickets']
+        })
+        return save_user_response(resp, uid, user)
 
 @app.route('/reset', methods=['POST'])
 def reset():
@@ -380,7 +896,19 @@ def reset():
         return jsonify({'ok': False}), 400
 
     uid = request.cookies.get('uid') or uuid.uuid4().hex
-    user = DEFAULT_USER.copy()
+    # what is being thrown away, read without get_user(): its replay flags
+    # would keep a foreign or already spent cookie from being reset
+    old = store.load(uid) if store.server_side else presented_user()
+    if stats is not None and old is not None:
+        g.owned_before = old['owned'].bits
+    user = new_user()
+    if revisions is not None and not store.server_side:
+        # the fresh state still has to outrank every cookie handed out before it;
+        # with per-worker revisions this worker may never have seen the uid, so
+        # the cookie's own revision counts too
+        rev = max(revisions.latest(uid) or 0, old['rev'] if old else 0)
+        revisions.claim(uid, rev)
+        user['rev'] = rev + 1
 
     resp = jsonify({'ok': True})
     return save_user_response(resp, uid, user)
@@ -389,14 +917,57 @@ def reset():
 # STATIC
 # ======================================================
 
+# fingerprinted files from scripts/build_assets.py never change under a name
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+DIST_DIR = os.path.join(BASE_DIR, 'static', 'dist')
+MANIFEST_FILE = os.path.join(DIST_DIR, 'manifest.json')
+
+_manifest = (None, {})
+
+def asset_manifest():
+    global _manifest
+    try:
+        st = os.stat(MANIFEST_FILE)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        # removed: back to the original files, and the stamp changes with it
+        _manifest = (None, {})
+        return {}
+    if _manifest[0] != stamp:
+        try:
+            with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+                _manifest = (stamp, json.load(f))
+        except (OSError, ValueError):
+            return _manifest[1]
+    return _manifest[1]
+
+@app.template_global()
+def asset_url(path, variant='full'):
+    # built variant if scripts/build_assets.py produced one, else the original file
+    entry = asset_manifest().get(path)
+    if entry and variant in entry:
+        return url_for('static', filename=entry[variant])
+    return url_for('static', filename=path)
+
+@app.route('/static/dist/<path:filename>')
+def dist_asset(filename):
+    resp = send_from_directory(DIST_DIR, filename, max_age=IMMUTABLE_MAX_AGE)
+    resp.headers['Cache-Control'] = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    return resp
+
 @app.route('/static/public/assets/<path:filename>')
 def public_asset(filename):
     assets_dir = os.path.join(BASE_DIR, 'static', 'public', 'assets')
-    return send_from_directory(assets_dir, filename)
+    # not fingerprinted, so only a short cache; asset_url() points at dist/ when built
+    return send_from_directory(assets_dir, filename, max_age=60 * 60)
+
+coldstart.mark('routes')
 
 # ======================================================
 # LOCAL DEV
 # ======================================================
 
+# production: python serve.py (preforked workers, see serve.py)
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,272 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from catalog import RARITY_ORDER
+
+# ======================================================
+# BANNERS (ALIAS-METHOD RATE TABLES, HOT RELOAD)
+# ======================================================
+#
+# banners.json (or NEXORIA_BANNERS=<path>) lists the banners /pull can use:
+#
+#   {"default": "standard",
+#    "banners": [
+#      {"id": "standard", "name": "Standard",
+#       "rates": {"B": 65, "A": 25, "S": 5, "SS": 1, "SSS": 0.1, "UR": 0.01},
+#       "pity": {"UR": 500, "SSS": 200, "SS": 100}},
+#      {"id": "lelouch-up", "name": "Rate up: Lelouch",
+#       "rates": {...},
+#       "rate_up": {"UR": {"ids": [1], "share": 0.5}}}]}
+#
+# rates are relative weights per rarity. pity overrides the thresholds of
+# the built-in pity counters (the counters themselves are shared by every
+# banner). rate_up gives the listed cards `share` of their rarity's
+# probability between them, the rest of the rarity splits what is left.
+#
+# Each banner is compiled once per catalog into Walker alias tables, so a
+# rarity or a rate-up card is drawn in O(1) with a single random number.
+# The file is stat'ed at most every CHECK_INTERVAL seconds; edits are picked
+# up by every worker without a restart. A file that fails to load keeps the
+# last good banners in service.
+
+BASE_DIR = os.path.dirname(__file__)
+BANNERS_FILE = os.environ.get('NEXORIA_BANNERS', os.path.join(BASE_DIR, 'banners.json'))
+
+CHECK_INTERVAL = 2.0
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class AliasTable:
+    """Walker's alias method: outcomes[i] is drawn with probability weights[i]."""
+
+    def __init__(self, weights, outcomes=None):
+        n = len(weights)
+        total = float(sum(weights))
+        if not n or total <= 0 or any(w < 0 for w in weights):
+            raise ValueError('weights must be non-negative with a positive sum')
+        scaled = [w * n / total for w in weights]
+        prob = [0.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large[-1]
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            if scaled[l] < 1.0:
+                small.append(large.pop())
+        # leftovers are 1.0 up to rounding
+        for i in small + large:
+            prob[i] = 1.0
+        self.n = n
+        self.prob = tuple(prob)
+        self.alias = tuple(alias)
+        outcomes = tuple(range(n) if outcomes is None else outcomes)
+        # one uniform u in [0, n): int(u) picks the column, u < cut keeps it,
+        # otherwise the column's alias wins
+        self._cut = tuple(i + p for i, p in enumerate(prob))
+        self._keep = outcomes
+        self._swap = tuple(outcomes[a] for a in alias)
+
+    def draw(self, rng):
+        u = rng.random() * self.n
+        i = int(u)
+        return self._keep[i] if u < self._cut[i] else self._swap[i]
+
+    def draw_many(self, k, rng):
+        rand, n, cut, keep, swap = rng.random, self.n, self._cut, self._keep, self._swap
+        out = []
+        for _ in range(k):
+            u = rand() * n
+            i = int(u)
+            out.append(keep[i] if u < cut[i] else swap[i])
+        return out
+
+    def sample_np(self, np, rng, size):
+        """Vectorized draw for the NumPy batch engine (indices, not outcomes)."""
+        col = rng.integers(0, self.n, size=size)
+        coin = rng.random(size)
+        return np.where(coin < np.asarray(self.prob)[col], col, np.asarray(self.alias)[col])
+
+
+class Banner:
+    def __init__(self, spec, catalog, pity_rules):
+        self.id = spec['id']
+        self.name = spec.get('name', self.id)
+        rates = spec.get('rates')
+        if not isinstance(rates, dict) or not rates:
+            raise ValueError('banner %r: rates must be a non-empty object' % self.id)
+        unknown = set(rates) - set(RARITY_ORDER)
+        if unknown:
+            raise ValueError('banner %r: unknown rarity %s' % (self.id, ', '.join(sorted(unknown))))
+        for r, w in rates.items():
+            if not _number(w) or w < 0:
+                raise ValueError('banner %r: rate for %s must be a non-negative number' % (self.id, r))
+        # drop zero-weight rarities: they can never be drawn anyway
+        self.rates = {r: float(w) for r, w in rates.items() if w}
+        self.labels = tuple(self.rates)
+        self.rarity_table = AliasTable(list(self.rates.values()), self.labels)
+
+        pity = spec.get('pity', {})
+        if not isinstance(pity, dict):
+            raise ValueError('banner %r: pity must be an object' % self.id)
+        unknown = set(pity) - {r for r, _, _ in pity_rules}
+        if unknown:
+            raise ValueError('banner %r: no pity counter for %s' % (self.id, ', '.join(sorted(unknown))))
+        for r, threshold in pity.items():
+            # 0 or less would guarantee the rarity on every single pull
+            if not isinstance(threshold, int) or isinstance(threshold, bool) or threshold < 1:
+                raise ValueError('banner %r: pity for %s must be a whole number >= 1' % (self.id, r))
+        self.pity_rules = tuple((r, key, int(pity.get(r, threshold))) for r, key, threshold in pity_rules)
+
+        # rarity -> (catalog positions, alias table drawing one of them)
+        self.card_tables = {}
+        self.featured = {}
+        positions = {}
+        for pos, c in enumerate(catalog.cards):
+            positions.setdefault(c['rarity'], []).append(pos)
+        rate_up = spec.get('rate_up') or {}
+        if not isinstance(rate_up, dict):
+            raise ValueError('banner %r: rate_up must be an object' % self.id)
+        for rarity, up in rate_up.items():
+            if not isinstance(up, dict):
+                raise ValueError('banner %r: rate_up %s must be an object' % (self.id, rarity))
+            ids = up.get('ids', ())
+            share = up.get('share', 0.5)
+            if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+                raise ValueError('banner %r: rate_up %s ids must be a list of card ids' % (self.id, rarity))
+            if not _number(share):
+                raise ValueError('banner %r: rate_up %s share must be a number' % (self.id, rarity))
+            ids = set(ids)
+            share = float(share)
+            if not ids or not 0 < share <= 1:
+                raise ValueError('banner %r: rate_up %s needs ids and 0 < share <= 1' % (self.id, rarity))
+            pool = positions.get(rarity, [])
+            hits = {p for p in pool if catalog.cards[p]['id'] in ids}
+            missing = ids - {catalog.cards[p]['id'] for p in hits}
+            if missing:
+                raise ValueError('banner %r: no %s card with id %s'
+                                 % (self.id, rarity, ', '.join(map(str, sorted(missing)))))
+            rest = len(pool) - len(hits)
+            if rest:
+                weights = [share / len(hits) if p in hits else (1 - share) / rest for p in pool]
+            else:
+                weights = [1.0] * len(pool)
+            self.card_tables[rarity] = (tuple(pool), AliasTable(weights, pool))
+            self.featured[rarity] = sorted(ids)
+
+    def choose_rarity(self, pulls, rng):
+        return self.rarity_table.draw_many(pulls, rng)
+
+    def pick(self, catalog, rarity, rng):
+        """A rate-up draw for `rarity`, or None when the rarity has no rate-up."""
+        table = self.card_tables.get(rarity)
+        if table is None:
+            return None
+        return catalog.cards[table[1].draw(rng)]
+
+    def public(self):
+        total = sum(self.rates.values())
+        return {
+            'id': self.id,
+            'name': self.name,
+            'rates': {r: round(w / total, 6) for r, w in self.rates.items()},
+            'pity': {r: t for r, _, t in self.pity_rules},
+            'rate_up': {r: ids for r, ids in self.featured.items()},
+        }
+
+
+class BannerSet:
+    def __init__(self, specs, default, catalog, pity_rules, stamp=None):
+        self.stamp = stamp
+        self.catalog = catalog
+        # kept to recompile against a reloaded catalog
+        self.specs = specs
+        self.default_id = default
+        self.pity_rules = pity_rules
+        self.banners = {}
+        for spec in specs:
+            if not isinstance(spec, dict) or not spec.get('id'):
+                raise ValueError('every banner needs an id')
+            if spec['id'] in self.banners:
+                raise ValueError('duplicate banner id %r' % spec['id'])
+            self.banners[spec['id']] = Banner(spec, catalog, pity_rules)
+        if not self.banners:
+            raise ValueError('no banners defined')
+        if default is not None and not isinstance(default, str):
+            raise ValueError('default must be a banner id')
+        self.default = default or next(iter(self.banners))
+        if self.default not in self.banners:
+            raise ValueError('default banner %r is not defined' % self.default)
+
+    def get(self, banner_id=None):
+        """The banner with this id (default banner for None), or None if unknown."""
+        return self.banners.get(banner_id or self.default)
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_banners(path, catalog, fallback, pity_rules):
+    """BannerSet from `path`, or from the `fallback` spec when the file is missing."""
+    stamp = _file_stamp(path)
+    if stamp is None:
+        return BannerSet([fallback], fallback['id'], catalog, pity_rules)
+    with open(path, 'r', encoding='utf-8') as f:
+        doc = json.load(f)
+    if not isinstance(doc, dict):
+        raise ValueError('%s: top level must be an object' % path)
+    return BannerSet(doc.get('banners', ()), doc.get('default'), catalog, pity_rules, stamp)
+
+
+# path -> (BannerSet, monotonic time of the last stat)
+_loaded = {}
+_lock = threading.Lock()
+
+
+def get_banners(catalog, fallback, pity_rules, path=None):
+    """Process-wide BannerSet for `catalog`, reloaded when the file changes.
+
+    Recompiled whenever the catalog is swapped too, since the rate-up
+    tables point at catalog positions.
+    """
+    path = path or BANNERS_FILE
+    now = time.monotonic()
+    current, checked_at = _loaded.get(path, (None, 0.0))
+    if current is not None and current.catalog is catalog and now - checked_at < CHECK_INTERVAL:
+        return current
+
+    with _lock:
+        current, checked_at = _loaded.get(path, (None, 0.0))
+        if current is not None and current.catalog is catalog and now - checked_at < CHECK_INTERVAL:
+            return current
+        stamp = _file_stamp(path)
+        if current is None or current.catalog is not catalog or stamp != current.stamp:
+            try:
+                current = load_banners(path, catalog, fallback, pity_rules)
+            except (OSError, ValueError) as e:
+                # keep the last good banners while the file is broken or mid-write
+                if current is None:
+                    raise
+                print('banners: keeping previous banners, %s' % e, file=sys.stderr)
+                if current.catalog is not catalog:
+                    # same banners, new card positions
+                    current = BannerSet(current.specs, current.default_id, catalog,
+                                        current.pity_rules, current.stamp)
+                # don't retry (and log) the same broken file every interval
+                current.stamp = stamp
+        _loaded[path] = (current, now)
+        return current
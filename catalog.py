@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from types import MappingProxyType
+
+import metrics
+
+# ======================================================
+# CARD CATALOG (LOADED ONCE, READ ONLY)
+# ======================================================
+
+BASE_DIR = os.path.dirname(__file__)
+CARDS_FILE = os.path.join(BASE_DIR, 'cards.json')
+CARDS_DIR = os.path.join(BASE_DIR, 'static', 'public', 'cards')
+
+RARITY_ORDER = ['UR', 'SSS', 'SS', 'S', 'A', 'B', 'C', 'D']
+
+# compiled by scripts/build_snapshot.py; used when it matches cards.json
+SNAPSHOT_FILE = os.environ.get(
+    'NEXORIA_CATALOG_SNAPSHOT', os.path.join(BASE_DIR, 'build', 'catalog.pickle'))
+SNAPSHOT_FORMAT = 1
+
+# card fields sent to clients by /api/catalog
+PUBLIC_FIELDS = ('id', 'name', 'rarity', 'desc', 'image')
+
+# how often (seconds) get_catalog() is allowed to stat cards.json
+CHECK_INTERVAL = 2.0
+
+
+class Catalog:
+    """Immutable view of cards.json with the indexes the routes need."""
+
+    def __init__(self, cards, stamp):
+        self.restamp(stamp)
+        self.cards = tuple(MappingProxyType(dict(c)) for c in cards)
+
+        by_id = {}
+        for c in self.cards:
+            # cards.json has had duplicate ids before; keep the first one
+            by_id.setdefault(c['id'], c)
+        self.by_id = MappingProxyType(by_id)
+
+        by_rarity = {r: [] for r in RARITY_ORDER}
+        for c in self.cards:
+            by_rarity.setdefault(c['rarity'], []).append(c)
+        self.by_rarity = MappingProxyType(
+            {r: tuple(pool) for r, pool in by_rarity.items()}
+        )
+
+        # deck view: (rarity, cards) in display order
+        self.grouped = tuple((r, self.by_rarity[r]) for r in RARITY_ORDER)
+        # the same order flattened, for /api/deck cursors; [start, end) per rarity
+        self.deck_order = tuple(c for _, pool in self.grouped for c in pool)
+        spans = {}
+        start = 0
+        for r, pool in self.grouped:
+            spans[r] = (start, start + len(pool))
+            start += len(pool)
+        self.deck_spans = MappingProxyType(spans)
+
+        # unique ids per rarity, for UnownedIndex
+        ids = {r: [] for r in self.by_rarity}
+        for card_id, c in by_id.items():
+            ids[c['rarity']].append(card_id)
+        self.rarity_ids = MappingProxyType({r: tuple(v) for r, v in ids.items()})
+
+        # bit masks over the id space, for OwnedCards.count()
+        masks = {r: 0 for r in self.by_rarity}
+        for card_id, c in by_id.items():
+            masks[c['rarity']] |= 1 << card_id
+        self.rarity_masks = MappingProxyType(masks)
+        self.rarity_totals = MappingProxyType(
+            {r: bin(m).count('1') for r, m in masks.items()}
+        )
+        self.max_id = max(by_id, default=0)
+
+        # what clients cache: one record per id, versioned by content, not mtime
+        self.public_cards = tuple(
+            {k: c.get(k) for k in PUBLIC_FIELDS} for c in by_id.values()
+        )
+        blob = json.dumps(self.public_cards, sort_keys=True, separators=(',', ':'))
+        self.content_hash = hashlib.sha256(blob.encode('utf-8')).hexdigest()[:16]
+
+    def restamp(self, stamp):
+        self.stamp = stamp
+        self.version = '%x-%x' % stamp
+
+    # pickled as plain data with card positions instead of card references,
+    # so loading a snapshot only re-wraps what was computed at build time
+    def __getstate__(self):
+        pos = {id(c): i for i, c in enumerate(self.cards)}
+        return {
+            'stamp': self.stamp,
+            'cards': [dict(c) for c in self.cards],
+            'by_id': {k: pos[id(c)] for k, c in self.by_id.items()},
+            'by_rarity': {r: [pos[id(c)] for c in p] for r, p in self.by_rarity.items()},
+            'rarity_ids': dict(self.rarity_ids),
+            'rarity_masks': dict(self.rarity_masks),
+            'rarity_totals': dict(self.rarity_totals),
+            'deck_spans': dict(self.deck_spans),
+            'max_id': self.max_id,
+            'public_cards': self.public_cards,
+            'content_hash': self.content_hash,
+        }
+
+    def __setstate__(self, state):
+        self.restamp(state['stamp'])
+        cards = self.cards = tuple(MappingProxyType(c) for c in state['cards'])
+        self.by_id = MappingProxyType({k: cards[i] for k, i in state['by_id'].items()})
+        by_rarity = {r: tuple(cards[i] for i in p) for r, p in state['by_rarity'].items()}
+        self.by_rarity = MappingProxyType(by_rarity)
+        self.grouped = tuple((r, by_rarity[r]) for r in RARITY_ORDER)
+        self.deck_order = tuple(c for _, pool in self.grouped for c in pool)
+        self.deck_spans = MappingProxyType(state['deck_spans'])
+        self.rarity_ids = MappingProxyType(state['rarity_ids'])
+        self.rarity_masks = MappingProxyType(state['rarity_masks'])
+        self.rarity_totals = MappingProxyType(state['rarity_totals'])
+        self.max_id = state['max_id']
+        self.public_cards = state['public_cards']
+        self.content_hash = state['content_hash']
+
+    def pool(self, rarity):
+        return self.by_rarity.get(rarity, ())
+
+    def collected(self, owned):
+        """Per-rarity (owned, total) counts for an OwnedCards."""
+        return {
+            r: (owned.count(mask), self.rarity_totals[r])
+            for r, mask in self.rarity_masks.items()
+        }
+
+    def __len__(self):
+        return len(self.cards)
+
+
+def _assign_placeholder_images(cards):
+    # kalau kartu yang punya gambar kurang dari 10, pinjam gambar lokal
+    assigned = [c for c in cards if c.get('image')]
+    if len(assigned) >= 10:
+        return
+
+    try:
+        imgs = [
+            fn for fn in os.listdir(CARDS_DIR)
+            if os.path.isfile(os.path.join(CARDS_DIR, fn))
+        ]
+    except Exception:
+        imgs = []
+
+    used_imgs = [os.path.basename(c['image']) for c in assigned]
+    available_imgs = [i for i in imgs if i not in used_imgs]
+    no_image_cards = [c for c in cards if not c.get('image')]
+
+    needed = 10 - len(assigned)
+    assign_count = min(needed, len(available_imgs), len(no_image_cards))
+
+    if assign_count > 0:
+        random.shuffle(available_imgs)
+        for c, img in zip(
+            random.sample(no_image_cards, assign_count),
+            random.sample(available_imgs, assign_count)
+        ):
+            c['image'] = f'public/cards/{img}'
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def validate_cards(cards):
+    """(errors, warnings) for a parsed cards.json."""
+    errors, warnings = [], []
+    if not isinstance(cards, list):
+        return ['top level must be a list'], warnings
+    seen = {}
+    for n, c in enumerate(cards):
+        where = 'card #%d' % n
+        if not isinstance(c, dict):
+            errors.append('%s: not an object' % where)
+            continue
+        card_id = c.get('id')
+        if not isinstance(card_id, int) or isinstance(card_id, bool) or card_id < 0:
+            errors.append('%s: id must be a non-negative int, got %r' % (where, card_id))
+            continue
+        where = 'card id %d' % card_id
+        if c.get('rarity') not in RARITY_ORDER:
+            errors.append('%s: unknown rarity %r' % (where, c.get('rarity')))
+        if not c.get('name'):
+            errors.append('%s: missing name' % where)
+        if card_id in seen:
+            warnings.append('%s: duplicate id (%r and %r), the first one wins'
+                            % (where, seen[card_id], c.get('name')))
+        else:
+            seen[card_id] = c.get('name')
+        image = c.get('image')
+        if image and not image.startswith('http') and \
+                not os.path.exists(os.path.join(BASE_DIR, 'static', *image.split('/'))):
+            warnings.append('%s: image %s not found' % (where, image))
+    return errors, warnings
+
+
+def source_hash(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def write_snapshot(catalog, raw, path=SNAPSHOT_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump((SNAPSHOT_FORMAT, source_hash(raw), catalog), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path, raw):
+    """The snapshot's Catalog if it was built from exactly these bytes, else None."""
+    try:
+        with open(path, 'rb') as f:
+            fmt, digest, catalog = pickle.load(f)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError, TypeError):
+        return None
+    if fmt != SNAPSHOT_FORMAT or digest != source_hash(raw):
+        return None
+    return catalog
+
+
+def build_catalog(path=CARDS_FILE, snapshot=None):
+    stamp = _file_stamp(path)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if snapshot:
+        catalog = load_snapshot(snapshot, raw)
+        if catalog is not None:
+            catalog.restamp(stamp)
+            return catalog
+    cards = json.loads(raw)
+    _assign_placeholder_images(cards)
+    return Catalog(cards, stamp)
+
+
+_catalog = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+@metrics.timed('catalog')
+def get_catalog():
+    """Return the process-wide catalog, reloading it if cards.json changed.
+
+    The file is stat'ed at most once every CHECK_INTERVAL seconds; a reload
+    builds a complete new Catalog and swaps the reference, so callers never
+    see a half-built catalog.
+    """
+    global _catalog, _checked_at
+
+    now = time.monotonic()
+    current = _catalog
+    if current is not None and now - _checked_at < CHECK_INTERVAL:
+        return current
+
+    with _lock:
+        if _catalog is not None and now - _checked_at < CHECK_INTERVAL:
+            return _catalog
+        try:
+            stamp = _file_stamp(CARDS_FILE)
+        except OSError:
+            stamp = None
+        if _catalog is None or (stamp is not None and stamp != _catalog.stamp):
+            try:
+                _catalog = build_catalog(CARDS_FILE, SNAPSHOT_FILE)
+            except (OSError, ValueError):
+                # keep serving the last good catalog while the file is mid-write
+                if _catalog is None:
+                    raise
+        _checked_at = now
+        return _catalog
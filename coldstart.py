@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+
+_start = _last = time.perf_counter()
+
+# ======================================================
+# COLD START (PHASE TIMES, TEMPLATE BYTECODE)
+# ======================================================
+#
+# Imported first by app.py so the phase clock starts before Flask is
+# imported. NEXORIA_STARTUP_REPORT=1 prints how long each startup phase
+# took, plus the first request (which is where templates get compiled),
+# to stderr once that request is done.
+
+enabled = os.environ.get('NEXORIA_STARTUP_REPORT', '').lower() in ('1', 'true', 'yes', 'on')
+
+phases = []
+
+
+def mark(phase):
+    """Close the phase that started at the previous mark."""
+    global _last
+    now = time.perf_counter()
+    phases.append((phase, now - _last))
+    _last = now
+
+
+def report(out=None):
+    out = out or sys.stderr
+    total = 0.0
+    for phase, seconds in phases:
+        total += seconds
+        out.write('%-16s %8.1f ms\n' % (phase, seconds * 1000))
+    out.write('%-16s %8.1f ms\n' % ('total', total * 1000))
+    out.flush()
+
+
+def init_app(app):
+    """Time the first request and print the report after it."""
+    from flask import g
+
+    state = {'pending': True}
+
+    @app.before_request
+    def _first_request_start():
+        if state['pending']:
+            g.coldstart_t = time.perf_counter()
+
+    @app.after_request
+    def _first_request_done(resp):
+        start = g.pop('coldstart_t', None)
+        if start is not None and state['pending']:
+            state['pending'] = False
+            phases.append(('first request', time.perf_counter() - start))
+            report()
+        return resp
+
+
+def template_cache(directory):
+    """Jinja bytecode cache for templates precompiled by scripts/build_snapshot.py."""
+    from jinja2 import FileSystemBytecodeCache
+
+    class TemplateBytecodeCache(FileSystemBytecodeCache):
+        # keyed by template name only: the absolute path differs between the
+        # build machine and the deployment, the source checksum still guards staleness
+        def get_cache_key(self, name, filename=None):
+            return super().get_cache_key(name)
+
+        def dump_bytecode(self, bucket):
+            # serverless file systems are read-only outside /tmp
+            try:
+                super().dump_bytecode(bucket)
+            except OSError:
+                pass
+
+    return TemplateBytecodeCache(directory)
@@ -0,0 +1,150 @@
+import base64
+import random
+
+# ======================================================
+# OWNED CARDS (BITSET)
+# ======================================================
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # python < 3.10
+    def _popcount(n):
+        return bin(n).count('1')
+
+
+class OwnedCards:
+    """Set of owned card ids stored as one int: bit N set = card id N owned.
+
+    Card ids are small dense ints, so the whole collection fits in
+    (max id + 1) bits. Membership and add are single bit operations and the
+    per-rarity counts are popcounts against the catalog's rarity masks.
+    """
+
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=0):
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, ids):
+        bits = 0
+        for card_id in ids:
+            if isinstance(card_id, int) and card_id >= 0:
+                bits |= 1 << card_id
+        return cls(bits)
+
+    @classmethod
+    def decode(cls, text):
+        raw = base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+        return cls(int.from_bytes(raw, 'little'))
+
+    @classmethod
+    def load(cls, value):
+        # accepts the old list form from cookies/JSON files as well as the encoded form
+        if isinstance(value, cls):
+            return cls(value.bits)
+        if isinstance(value, str):
+            return cls.decode(value)
+        return cls.from_ids(value or [])
+
+    def to_bytes(self):
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+
+    def encode(self):
+        return base64.urlsafe_b64encode(self.to_bytes()).rstrip(b'=').decode('ascii')
+
+    def __contains__(self, card_id):
+        return card_id >= 0 and (self.bits >> card_id) & 1 == 1
+
+    def add(self, card_id):
+        self.bits |= 1 << card_id
+
+    def update(self, ids):
+        for card_id in ids:
+            self.bits |= 1 << card_id
+
+    def count(self, mask):
+        return _popcount(self.bits & mask)
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __len__(self):
+        return _popcount(self.bits)
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __eq__(self, other):
+        return isinstance(other, OwnedCards) and other.bits == self.bits
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __repr__(self):
+        return 'OwnedCards(%r)' % list(self)
+
+
+# ======================================================
+# UNOWNED INDEX (PITY SLOTS / SHOP BOXES)
+# ======================================================
+
+class UnownedIndex:
+    """Ids a user is still missing, per rarity, with O(1) pick and remove.
+
+    Every rarity is a list plus an id -> position map; removing swaps the
+    id with the last element and pops. A rarity's list is built from the
+    catalog ids and the owned bitset the first time it is asked for. Call
+    discard() for every card added to `owned` afterwards so both stay in
+    step during a multi-pull.
+    """
+
+    __slots__ = ('_ids', '_owned', '_lists', '_pos')
+
+    def __init__(self, rarity_ids, owned):
+        self._ids = rarity_ids
+        self._owned = owned
+        self._lists = {}
+        self._pos = {}
+
+    def _list(self, rarity):
+        ids = self._lists.get(rarity)
+        if ids is None:
+            bits = self._owned.bits
+            ids = self._lists[rarity] = [i for i in self._ids.get(rarity, ()) if not (bits >> i) & 1]
+            for n, card_id in enumerate(ids):
+                self._pos[card_id] = n
+        return ids
+
+    def count(self, rarity):
+        return len(self._list(rarity))
+
+    def choice(self, rarity, rng=random):
+        """A random missing id of this rarity, or None if the user has them all."""
+        ids = self._list(rarity)
+        return rng.choice(ids) if ids else None
+
+    def take(self, rarity, k, rng=random):
+        """Up to k distinct missing ids of this rarity, removed from the index."""
+        ids = self._list(rarity)
+        picked = rng.sample(ids, min(k, len(ids)))
+        for card_id in picked:
+            self.discard(card_id, rarity)
+        return picked
+
+    def discard(self, card_id, rarity):
+        ids = self._lists.get(rarity)
+        if ids is None:
+            # not built yet, it will be built from `owned` later
+            return
+        n = self._pos.pop(card_id, None)
+        if n is None:
+            return
+        last = ids.pop()
+        if last != card_id:
+            ids[n] = last
+            self._pos[last] = n
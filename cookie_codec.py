@@ -0,0 +1,170 @@
+import base64
+import hashlib
+import zlib
+
+from itsdangerous import BadSignature, Signer
+
+from collection import OwnedCards
+
+# ======================================================
+# USER COOKIE CODEC (BINARY, VERSIONED)
+# ======================================================
+#
+# layout (before signing):
+#   u8      schema version
+#   varint  coins, tickets, pity_sss, pity_ss, pity_ur  (zigzag)
+#   varint  rev                                         (v2+, state revision)
+#   u8      uid tag length, 0 or UID_TAG_SIZE           (v3+)
+#   ...     uid tag: hash of the uid cookie the state belongs to
+#   u8      owned encoding: 0 = raw bitset bytes, 1 = zlib
+#   ...     owned bitset (little endian, see OwnedCards)
+#
+# the signed value is "<base64url payload>.<signature>"
+#
+# the uid cookie itself is not signed; the tag ties the state to it, so a
+# cookie copied under another uid is recognised (see get_user in app.py).
+# v1/v2 cookies and untagged v3 ones are "unbound".
+
+SCHEMA_VERSION = 3
+
+INT_FIELDS = ('coins', 'tickets', 'pity_sss', 'pity_ss', 'pity_ur', 'rev')
+
+# fields written by each schema version still accepted; v1 cookies have no
+# rev and decode as rev 0
+SCHEMA_FIELDS = {
+    1: INT_FIELDS[:5],
+    2: INT_FIELDS,
+    3: INT_FIELDS,
+}
+
+UID_TAG_SIZE = 8
+
+OWNED_RAW = 0
+OWNED_ZLIB = 1
+
+
+class CodecError(ValueError):
+    pass
+
+
+class UidMismatch(CodecError):
+    """Validly signed state that belongs to another uid."""
+
+
+def uid_tag(uid):
+    return hashlib.blake2b(uid.encode('utf-8'), digest_size=UID_TAG_SIZE).digest()
+
+
+def _put_varint(out, n):
+    n = (n << 1) ^ (n >> 63)  # zigzag so negative values stay short
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf, pos):
+    shift = n = 0
+    while True:
+        if pos >= len(buf) or shift > 63:
+            raise CodecError('truncated varint')
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if not b & 0x80:
+            break
+        shift += 7
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def pack_user(user, uid=None):
+    out = bytearray([SCHEMA_VERSION])
+    for key in INT_FIELDS:
+        _put_varint(out, int(user.get(key, 0)))
+    tag = uid_tag(uid) if uid is not None else b''
+    out.append(len(tag))
+    out += tag
+
+    raw = user['owned'].to_bytes()
+    packed = zlib.compress(raw, 9)
+    if len(packed) < len(raw):
+        out.append(OWNED_ZLIB)
+        out += packed
+    else:
+        out.append(OWNED_RAW)
+        out += raw
+    return bytes(out)
+
+
+def unpack_user(buf):
+    return _unpack(buf)[0]
+
+
+def _unpack(buf):
+    # (user, uid tag or None)
+    fields = SCHEMA_FIELDS.get(buf[0]) if buf else None
+    if fields is None:
+        raise CodecError('unknown schema version')
+
+    user = dict.fromkeys(INT_FIELDS, 0)
+    pos = 1
+    for key in fields:
+        user[key], pos = _get_varint(buf, pos)
+
+    tag = None
+    if buf[0] >= 3:
+        size = buf[pos] if pos < len(buf) else -1
+        if size not in (0, UID_TAG_SIZE) or pos + 1 + size > len(buf):
+            raise CodecError('bad uid tag')
+        tag = buf[pos + 1:pos + 1 + size] or None
+        pos += 1 + size
+
+    if pos >= len(buf):
+        raise CodecError('missing owned block')
+    mode, rest = buf[pos], buf[pos + 1:]
+    if mode == OWNED_ZLIB:
+        try:
+            rest = zlib.decompress(rest)
+        except zlib.error as e:
+            raise CodecError(str(e))
+    elif mode != OWNED_RAW:
+        raise CodecError('unknown owned encoding')
+    user['owned'] = OwnedCards(int.from_bytes(rest, 'little'))
+    return user, tag
+
+
+class UserCodec:
+    """Signs and verifies the packed user cookie."""
+
+    def __init__(self, secret_key, salt='user-data-bin'):
+        self.signer = Signer(secret_key, salt=salt)
+
+    def dumps(self, user, uid=None):
+        payload = base64.urlsafe_b64encode(pack_user(user, uid)).rstrip(b'=')
+        return self.signer.sign(payload).decode('ascii')
+
+    def loads(self, value, uid=None):
+        """The user; with `uid`, UidMismatch if the state is bound to another one."""
+        return self.load_for(value, uid)[0]
+
+    def load_for(self, value, uid):
+        """(user, bound): bound is False for cookies that carry no uid tag."""
+        try:
+            payload = self.signer.unsign(value)
+        except BadSignature as e:
+            raise CodecError(str(e))
+        try:
+            raw = base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4))
+        except ValueError as e:
+            raise CodecError(str(e))
+        user, tag = _unpack(raw)
+        if tag is None:
+            return user, False
+        if uid is not None and tag != uid_tag(uid):
+            raise UidMismatch('cookie belongs to another uid')
+        return user, True
+
+
+def user_state(user):
+    # everything the cookie carries, cheap to compare
+    return tuple(user.get(key, 0) for key in INT_FIELDS) + (user['owned'].bits,)
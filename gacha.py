@@ -0,0 +1,381 @@
+import random
+
+import metrics
+from banners import get_banners
+from catalog import get_catalog
+from collection import OwnedCards, UnownedIndex
+
+# ======================================================
+# GACHA ENGINE (NO REQUEST STATE)
+# ======================================================
+#
+# The pull rules: rarity and card draws per banner, pity guarantees (UR >
+# SSS > SS, placed over LOW_PRIORITIES slots first), duplicates turned into
+# tickets and the pity counters with their caps. Everything works on a
+# catalog, a plain user dict and an RNG passed in by the caller, so the
+# rules can be driven in-process by tests and scripts; app.py only adds
+# coins, cookies and HTTP around it.
+
+TICKET_REWARDS = {
+    'D': 0,
+    'C': 0,
+    'B': 50,
+    'A': 100,
+    'S': 300,
+    'SS': 1000,
+    'SSS': 4000,
+    'UR': 10000,
+}
+
+# built-in rates and pity thresholds: the 'standard' banner when
+# banners.json is missing. Every banner shares the PITY_RULES counters.
+RARITY_WEIGHTS = [
+    ('D', 0),
+    ('C', 0),
+    ('B', 65),
+    ('A', 25),
+    ('S', 5),
+    ('SS', 1),
+    ('SSS', 0.1),
+    ('UR', 0.01),
+]
+
+# (rarity, user key, threshold) in guarantee priority order: UR > SSS > SS
+PITY_RULES = [
+    ('UR', 'pity_ur', 500),
+    ('SSS', 'pity_sss', 200),
+    ('SS', 'pity_ss', 100),
+]
+
+# slots a guarantee may overwrite, lowest rarity first
+LOW_PRIORITIES = ['D', 'C', 'B', 'A', 'S', 'SS']
+
+# pulls at or above this size go through the NumPy batch engine
+BATCH_PULL_THRESHOLD = 500
+
+
+def standard_banner():
+    return {
+        'id': 'standard', 'name': 'Standard',
+        'rates': dict(RARITY_WEIGHTS),
+        'pity': {r: threshold for r, _, threshold in PITY_RULES},
+    }
+
+def current_banners(catalog=None):
+    # banners.json is re-checked every few seconds, see banners.py
+    return get_banners(catalog or get_catalog(), standard_banner(), PITY_RULES)
+
+def get_banner(banner_id=None, catalog=None):
+    """Compiled banner (the default one for None), or None if there is no such id."""
+    return current_banners(catalog).get(banner_id)
+
+def choose_rarity(pulls=1, rng=random, banner=None):
+    # alias table: O(1) per draw whatever the number of rarities
+    return (banner or get_banner()).choose_rarity(pulls, rng)
+
+def pick_cards_by_rarity(catalog, rarity, owned_set=None, prefer_unowned=False, rng=random, unowned=None,
+                         banner=None):
+    pool = catalog.pool(rarity)
+    # if this is a guaranteed pity slot, prefer giving an unowned card of that rarity
+    if prefer_unowned and owned_set is not None:
+        if unowned is None:
+            unowned = UnownedIndex(catalog.rarity_ids, owned_set)
+        card_id = unowned.choice(rarity, rng)
+        if card_id is not None:
+            return catalog.by_id[card_id]
+    # rate-up cards of the banner, if this rarity has any
+    if banner is not None:
+        card = banner.pick(catalog, rarity, rng)
+        if card is not None:
+            return card
+    return rng.choice(pool if pool else catalog.cards)
+
+def pity_rules(banner=None):
+    return (banner or get_banner()).pity_rules
+
+def pity_guarantees(user, banner=None):
+    return [r for r, key, threshold in pity_rules(banner) if user.get(key, 0) >= threshold]
+
+def place_guarantees(rarities, guarantees, rng=random):
+    """Make sure every guaranteed rarity shows up at least once.
+
+    Returns the slot indices that were overwritten; those slots prefer an
+    unowned card. If the pull is smaller than the number of guarantees, the
+    PITY_RULES priority order decides which ones fit.
+    """
+    guarantees = guarantees[:len(rarities)]
+    guaranteed = []
+    for g in guarantees:
+        if g in rarities:
+            continue
+        # try to replace a low-rarity slot, lowest rarities first
+        for lp in LOW_PRIORITIES:
+            if lp in rarities:
+                idx = rarities.index(lp)
+                break
+        else:
+            # fallback: a random slot no other guarantee depends on
+            idx = rng.randrange(0, len(rarities))
+            while idx in guaranteed or (rarities[idx] in guarantees and rarities.count(rarities[idx]) == 1):
+                idx = rng.randrange(0, len(rarities))
+        rarities[idx] = g
+        guaranteed.append(idx)
+    return guaranteed
+
+def apply_pity(user, obtained, count, banner=None):
+    # obtained -> reset to 0, else increase by number of pulls (capped at the threshold)
+    for rarity, key, threshold in pity_rules(banner):
+        if rarity in obtained:
+            user[key] = 0
+        else:
+            user[key] = min(threshold, user.get(key, 0) + count)
+
+def run_pull_loop(catalog, user, count, guarantees, banner=None, rng=random):
+    banner = banner or get_banner(catalog=catalog)
+    rarities = choose_rarity(count, rng, banner)
+    guaranteed = set(place_guarantees(rarities, guarantees, rng))
+
+    owned = user['owned']
+    # kept in step with owned below, so guaranteed slots pick in O(1)
+    unowned = UnownedIndex(catalog.rarity_ids, owned)
+    results = []
+    obtained = set()
+
+    for i, r in enumerate(rarities):
+        card = pick_cards_by_rarity(catalog, r, owned_set=owned, prefer_unowned=i in guaranteed,
+                                    rng=rng, unowned=unowned, banner=banner)
+        result = dict(card)
+
+        if card['id'] in owned:
+            reward = TICKET_REWARDS.get(card['rarity'], 0)
+            user['tickets'] += reward
+            result['duplicate'] = True
+            result['tickets_awarded'] = reward
+        else:
+            owned.add(card['id'])
+            unowned.discard(card['id'], card['rarity'])
+            result['duplicate'] = False
+            result['tickets_awarded'] = 0
+
+        results.append(result)
+        obtained.add(card['rarity'])
+
+    return results, obtained
+
+def _numpy():
+    # numpy is only needed for big pulls, keep it out of the import path
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _rarity_positions(catalog):
+    positions = {}
+    for pos, c in enumerate(catalog.cards):
+        positions.setdefault(c['rarity'], []).append(pos)
+    return positions
+
+def _draw_positions(catalog, banner, labels, slot_rarity, np, rng):
+    # a catalog position for every slot, rarity by rarity
+    cards = catalog.cards
+    positions = _rarity_positions(catalog)
+    slot_pos = np.empty(len(slot_rarity), dtype=np.int64)
+    for ri, r in enumerate(labels):
+        mask = slot_rarity == ri
+        n = int(mask.sum())
+        if not n:
+            continue
+        if r in banner.card_tables:
+            pool, table = banner.card_tables[r]
+            slot_pos[mask] = np.array(pool, dtype=np.int64)[table.sample_np(np, rng, n)]
+            continue
+        pool = np.array(positions.get(r) or range(len(cards)), dtype=np.int64)
+        slot_pos[mask] = pool[rng.integers(0, len(pool), size=n)]
+    return slot_pos
+
+def sample_cards(catalog, count, np, banner=None, rng=None):
+    """Raw banner draws: (rarity index into banner.labels, catalog position) arrays.
+
+    No pity and no user, just the banner's rates at a few million draws per
+    second; what the statistical tests compare against the configuration.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    banner = banner or get_banner(catalog=catalog)
+    slot_rarity = banner.rarity_table.sample_np(np, rng, count)
+    return slot_rarity, _draw_positions(catalog, banner, list(banner.labels), slot_rarity, np, rng)
+
+def run_pull_batch(catalog, user, count, guarantees, np, banner=None, rng=None):
+    """Same rules as run_pull_loop, drawn for the whole request at once.
+
+    `rng` is a NumPy Generator (a fresh one by default).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    banner = banner or get_banner(catalog=catalog)
+    # rarities the banner never draws still need an index for the guarantee rules
+    labels = list(banner.labels)
+    labels += [r for r in LOW_PRIORITIES + list(guarantees) if r not in labels]
+    slot_rarity = banner.rarity_table.sample_np(np, rng, count)
+
+    # guarantees, same order and replacement rule as place_guarantees()
+    guarantees = guarantees[:count]
+    guaranteed = []
+    for g in guarantees:
+        gi = labels.index(g)
+        if (slot_rarity == gi).any():
+            continue
+        for lp in LOW_PRIORITIES:
+            hits = np.flatnonzero(slot_rarity == labels.index(lp))
+            if hits.size:
+                idx = int(hits[0])
+                break
+        else:
+            idx = int(rng.integers(0, count))
+            while idx in guaranteed or (labels[slot_rarity[idx]] in guarantees
+                                        and (slot_rarity == slot_rarity[idx]).sum() == 1):
+                idx = int(rng.integers(0, count))
+        slot_rarity[idx] = gi
+        guaranteed.append(idx)
+
+    cards = catalog.cards
+    positions = _rarity_positions(catalog)
+    slot_pos = _draw_positions(catalog, banner, labels, slot_rarity, np, rng)
+
+    ids = np.array([c['id'] for c in cards], dtype=np.int64)
+    owned = user['owned']
+
+    # guaranteed slots prefer a card the user doesn't have *at that slot*
+    for idx in sorted(set(guaranteed)):
+        r = labels[slot_rarity[idx]]
+        seen = OwnedCards(owned.bits)
+        seen.update(ids[slot_pos[:idx]].tolist())
+        unowned = [p for p in positions.get(r, ()) if cards[p]['id'] not in seen]
+        if unowned:
+            slot_pos[idx] = unowned[int(rng.integers(0, len(unowned)))]
+
+    # first occurrence of an id not already owned is new, everything else is a duplicate
+    slot_ids = ids[slot_pos]
+    first = np.zeros(count, dtype=bool)
+    first[np.unique(slot_ids, return_index=True)[1]] = True
+    owned_before = np.zeros(catalog.max_id + 1, dtype=bool)
+    owned_before[[i for i in owned if i <= catalog.max_id]] = True
+    new = first & ~owned_before[slot_ids]
+
+    rewards = np.array([TICKET_REWARDS.get(c['rarity'], 0) for c in cards], dtype=np.int64)
+    awarded = np.where(new, 0, rewards[slot_pos])
+
+    user['tickets'] += int(awarded.sum())
+    owned.update(slot_ids[new].tolist())
+    obtained = {cards[p]['rarity'] for p in np.unique(slot_pos).tolist()}
+
+    plain = [dict(c) for c in cards]
+    results = [
+        {**plain[p], 'duplicate': not n, 'tickets_awarded': a}
+        for p, n, a in zip(slot_pos.tolist(), new.tolist(), awarded.tolist())
+    ]
+    return results, obtained
+
+# rarities are drawn this many at a time by the streaming engine
+STREAM_CHUNK = 1024
+
+def _scan_guarantees(count, guarantees, rng, banner):
+    """First pass over a seeded rarity stream for iter_pull().
+
+    Works out where place_guarantees() would put each guarantee without
+    keeping the whole rarity list: it only remembers how often each rarity
+    occurs, the first few slots of every LOW_PRIORITIES rarity and the
+    (rare) slots outside LOW_PRIORITIES. Returns ({slot: rarity}, slots).
+    """
+    guarantees = guarantees[:count]
+    counts = {}
+    first = {lp: [] for lp in LOW_PRIORITIES}
+    rare = {}
+    for start in range(0, count, STREAM_CHUNK):
+        for j, r in enumerate(choose_rarity(min(STREAM_CHUNK, count - start), rng, banner)):
+            counts[r] = counts.get(r, 0) + 1
+            if r in first:
+                if len(first[r]) < len(guarantees):
+                    first[r].append(start + j)
+            else:
+                rare[start + j] = r
+
+    overrides = {}
+    for g in guarantees:
+        if counts.get(g):
+            continue
+        for lp in LOW_PRIORITIES:
+            if first[lp]:
+                idx = first[lp].pop(0)
+                old = lp
+                break
+        else:
+            # no low slot left: every slot is rare or already overridden
+            idx = rng.randrange(0, count)
+            while idx in overrides or (rare.get(idx) in guarantees and counts[rare[idx]] == 1):
+                idx = rng.randrange(0, count)
+            old = overrides.get(idx, rare.get(idx))
+        counts[old] -= 1
+        counts[g] = counts.get(g, 0) + 1
+        overrides[idx] = g
+    return overrides, set(overrides)
+
+def iter_pull(catalog, user, count, guarantees, seed, banner=None):
+    """Same rules as run_pull_loop(), one slot at a time in constant memory.
+
+    Yields (card, duplicate, tickets_awarded) and updates user['tickets'] and
+    user['owned'] as it goes. Everything is drawn from RNGs derived from
+    `seed`, so running it again from the same starting state replays the
+    exact same pull.
+    """
+    banner = banner or get_banner(catalog=catalog)
+    overrides, guaranteed = _scan_guarantees(count, guarantees, random.Random(seed), banner)
+    rarity_rng = random.Random(seed)
+    card_rng = random.Random(seed + 1)
+    owned = user['owned']
+    unowned = UnownedIndex(catalog.rarity_ids, owned)
+
+    for start in range(0, count, STREAM_CHUNK):
+        for j, r in enumerate(choose_rarity(min(STREAM_CHUNK, count - start), rarity_rng, banner)):
+            i = start + j
+            r = overrides.get(i, r)
+            card = pick_cards_by_rarity(catalog, r, owned_set=owned, prefer_unowned=i in guaranteed,
+                                        rng=card_rng, unowned=unowned, banner=banner)
+            if card['id'] in owned:
+                reward = TICKET_REWARDS.get(card['rarity'], 0)
+                user['tickets'] += reward
+                yield card, True, reward
+            else:
+                owned.add(card['id'])
+                unowned.discard(card['id'], card['rarity'])
+                yield card, False, 0
+
+def count_rarities(rarities):
+    counts = {}
+    for r in rarities:
+        counts[r] = counts.get(r, 0) + 1
+    return counts
+
+def pity_state(user):
+    return [user.get(key, 0) for _, key, _ in PITY_RULES]
+
+@metrics.timed('pull')
+def run_pull(catalog, user, count, banner=None, rng=None):
+    """Draw `count` cards for `user` and apply every rule to it in place.
+
+    Coins are the caller's business. Pass a seeded random.Random as `rng`
+    for a reproducible pull (big pulls derive their NumPy generator from it).
+    """
+    banner = banner or get_banner(catalog=catalog)
+    guarantees = pity_guarantees(user, banner)
+    np = _numpy() if count >= BATCH_PULL_THRESHOLD else None
+    if np is not None:
+        np_rng = np.random.default_rng(rng.getrandbits(64)) if rng is not None else None
+        results, obtained = run_pull_batch(catalog, user, count, guarantees, np, banner, np_rng)
+    else:
+        results, obtained = run_pull_loop(catalog, user, count, guarantees, banner, rng or random)
+    apply_pity(user, obtained, count, banner)
+    if metrics.enabled:
+        metrics.record_pull(results, guarantees[:count])
+    return results
@@ -0,0 +1,230 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# ======================================================
+# PULL LEDGER (APPEND-ONLY, GROUP COMMIT)
+# ======================================================
+#
+# NEXORIA_LEDGER=<dir> records every /pull and /buy as one JSON line:
+#
+#   {"ts": 1760000000.123, "uid": "...", "kind": "pull", "count": 10,
+#    "ids": [...], "rarities": [...], "pity_before": [ur, sss, ss],
+#    "pity_after": [ur, sss, ss], "coins": ..., "tickets": ...}
+#
+# Requests only append to an in-memory queue. A background thread writes
+# whatever queued up as one write() and fsyncs once per batch, so a burst of
+# requests costs one fsync instead of one each. Entries still queued when
+# the process dies hard (at most ~COMMIT_INTERVAL worth) are lost.
+#
+# Segments are named ledger-<start ms>-<pid>.ndjson and rotated by size;
+# every process writes its own, so preforked workers never interleave.
+#
+# A batch that fails to write (disk full, I/O error) is reported on stderr
+# and retried in a fresh segment, WRITE_RETRIES times at most, then dropped.
+# While the disk is failing, at most MAX_QUEUE entries wait in memory; later
+# ones are dropped and counted in `dropped`.
+
+COMMIT_INTERVAL = 0.05
+WRITE_RETRIES = 3
+RETRY_INTERVAL = 1.0
+MAX_QUEUE = 100000
+SEGMENT_BYTES = 64 * 1024 * 1024
+SEGMENT_PREFIX = 'ledger-'
+SEGMENT_SUFFIX = '.ndjson'
+
+
+class Ledger:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, commit_interval=COMMIT_INTERVAL,
+                 max_queue=MAX_QUEUE, retry_interval=RETRY_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_interval = commit_interval
+        self.max_queue = max_queue
+        self.retry_interval = retry_interval
+        os.makedirs(directory, exist_ok=True)
+        self._reset()
+        atexit.register(self.close)
+
+    def _reset(self):
+        # also called in a forked child: the parent's thread and file don't exist here
+        self._pid = os.getpid()
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = False
+        self._file = None
+        self._written = 0
+        self._busy = False
+        self.batches = 0
+        self.dropped = 0
+
+    def append(self, entry):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ledger-writer', daemon=True)
+                self._thread.start()
+            if len(self._queue) >= self.max_queue:
+                # the writer is stuck on a failing disk, don't grow without bound
+                self._drop(1)
+                return
+            self._queue.append(entry)
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """Block until everything appended so far is written or dropped.
+
+        Returns False if the writer is gone or `timeout` seconds passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._busy:
+                if self._thread is None or not self._thread.is_alive():
+                    return False
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                self._cond.wait(0.01)
+        return True
+
+    def close(self):
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    # --------------------------------------------------
+    # writer thread
+    # --------------------------------------------------
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue:
+                    break
+                closing = self._closing
+            # group commit: let concurrent requests join the batch
+            if not closing:
+                time.sleep(self.commit_interval)
+            with self._cond:
+                batch = list(self._queue)
+                self._queue.clear()
+                self._busy = True
+            try:
+                self._commit(batch)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _commit(self, batch):
+        # never raises: an exception here would end the writer thread for good
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                self._write(batch)
+                return
+            except Exception as e:
+                print('ledger: writing %d entries failed (%s), attempt %d of %d'
+                      % (len(batch), e, attempt + 1, WRITE_RETRIES + 1), file=sys.stderr)
+                self._abandon_segment()
+            if attempt < WRITE_RETRIES and not self._closing:
+                time.sleep(self.retry_interval)
+        with self._cond:
+            self._drop(len(batch))
+
+    def _drop(self, n):
+        # caller holds self._cond
+        if not self.dropped:
+            print('ledger: dropping entries, see Ledger.dropped', file=sys.stderr)
+        self.dropped += n
+
+    def _abandon_segment(self):
+        # cut a half-written batch off and retry in a new segment
+        f, self._file = self._file, None
+        if f is None:
+            return
+        try:
+            os.ftruncate(f.fileno(), self._written)
+        except OSError:
+            pass
+        try:
+            f.close()
+        except OSError:
+            pass
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in batch).encode('utf-8')
+        if self._file is None or (self._written and self._written + len(data) > self.segment_bytes):
+            self._rotate()
+        # unbuffered: nothing half-written is left behind in a Python buffer
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]
+        os.fsync(self._file.fileno())
+        self._written += len(data)
+        self.batches += 1
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        name = '%s%013d-%d%s' % (SEGMENT_PREFIX, int(time.time() * 1000), self._pid, SEGMENT_SUFFIX)
+        path = os.path.join(self.directory, name)
+        self._file = open(path, 'ab', buffering=0)
+        self._written = self._file.tell()
+        # make the new directory entry durable too
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+def open_ledger(spec, base_dir='.'):
+    if not spec:
+        return None
+    return Ledger(os.path.join(base_dir, spec))
+
+
+# ======================================================
+# READER
+# ======================================================
+
+def segments(directory):
+    """Segment paths in write order (oldest first)."""
+    names = [n for n in os.listdir(directory)
+             if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)]
+    return [os.path.join(directory, n) for n in sorted(names)]
+
+
+def read_segment(path):
+    """Yield the entries of one segment, one at a time.
+
+    A torn last line (crash in the middle of a write) is skipped.
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def read_ledger(directory):
+    for path in segments(directory):
+        yield from read_segment(path)
@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from functools import wraps
+
+# ======================================================
+# METRICS (OPT-IN, PROMETHEUS TEXT FORMAT)
+# ======================================================
+#
+# NEXORIA_METRICS=1 turns this on. When it is off no function gets wrapped
+# and no request hooks are installed, so the hot path pays nothing.
+
+enabled = os.environ.get('NEXORIA_METRICS', '').lower() in ('1', 'true', 'yes', 'on')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BYTES_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_registry = []
+
+
+def _label_str(names, values):
+    if not names:
+        return ''
+    pairs = ('%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+             for n, v in zip(names, values))
+    return '{%s}' % ','.join(pairs)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        for values, n in sorted(self._values.items()):
+            yield '%s%s %s' % (self.name, _label_str(self.labels, values), n)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # per-bucket counts (+Inf last), sum
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def count(self, *labelvalues):
+        series = self._series.get(labelvalues)
+        return sum(series[0]) if series else 0
+
+    def render(self):
+        names = self.labels + ('le',)
+        for values, (counts, total) in sorted(self._series.items()):
+            running = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                running += n
+                yield '%s_bucket%s %d' % (self.name, _label_str(names, values + (bound,)), running)
+            yield '%s_sum%s %r' % (self.name, _label_str(self.labels, values), total)
+            yield '%s_count%s %d' % (self.name, _label_str(self.labels, values), running)
+
+
+request_seconds = Histogram(
+    'nexoria_request_seconds', 'Request latency by route.', ('route', 'method', 'status'))
+stage_seconds = Histogram(
+    'nexoria_stage_seconds', 'Time spent in hot-path stages.', ('stage',))
+cookie_bytes = Histogram(
+    'nexoria_cookie_bytes', 'Cookie header size.', ('direction',), BYTES_BUCKETS)
+cards_pulled = Counter(
+    'nexoria_cards_pulled_total', 'Cards drawn by /pull, by rarity.', ('rarity',))
+pity_fired = Counter(
+    'nexoria_pity_guarantees_total', 'Pity guarantees applied, by rarity.', ('rarity',))
+duplicates = Counter(
+    'nexoria_duplicates_total', 'Duplicate pulls converted to tickets, by rarity.', ('rarity',))
+tickets_awarded = Counter(
+    'nexoria_tickets_awarded_total', 'Tickets awarded for duplicates.')
+rate_limited = Counter(
+    'nexoria_rate_limited_total', 'Requests rejected by the rate limiter.', ('endpoint', 'scope'))
+count_rejected = Counter(
+    'nexoria_pull_count_rejected_total', 'Pulls rejected for a missing or too large count.', ('endpoint',))
+idempotent_replays = Counter(
+    'nexoria_idempotent_replays_total', 'Repeated Idempotency-Keys answered from the response cache.', ('endpoint',))
+stale_rejected = Counter(
+    'nexoria_stale_state_rejected_total', 'Spends rejected for an outdated user cookie.', ('endpoint',))
+
+
+def timed(stage):
+    """Decorator timing a function into nexoria_stage_seconds.
+
+    Returns the function untouched when metrics are disabled.
+    """
+    def decorate(fn):
+        if not enabled:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stage_seconds.observe(time.perf_counter() - start, stage)
+        return wrapper
+    return decorate
+
+
+def record_card(rarity, duplicate, reward):
+    cards_pulled.inc(rarity)
+    if duplicate:
+        duplicates.inc(rarity)
+        tickets_awarded.inc(amount=reward)
+
+
+def record_pull(results, guarantees):
+    for rarity in guarantees:
+        pity_fired.inc(rarity)
+    for r in results:
+        record_card(r['rarity'], r['duplicate'], r['tickets_awarded'])
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Register request timing, template timing and the /metrics route."""
+    from flask import g, request, Response, before_render_template, template_rendered
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        cookie = request.headers.get('Cookie')
+        if cookie:
+            cookie_bytes.observe(len(cookie), 'request')
+
+    @app.after_request
+    def _stop_timer(resp):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            rule = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_seconds.observe(time.perf_counter() - start, rule, request.method, resp.status_code)
+        set_cookie = resp.headers.getlist('Set-Cookie')
+        if set_cookie:
+            cookie_bytes.observe(sum(len(c) for c in set_cookie), 'response')
+        return resp
+
+    def _render_start(sender, template, context, **extra):
+        g.metrics_render_start = time.perf_counter()
+
+    def _render_done(sender, template, context, **extra):
+        start = g.pop('metrics_render_start', None)
+        if start is not None:
+            stage_seconds.observe(time.perf_counter() - start, 'render')
+
+    # local functions: keep strong refs or blinker drops them
+    before_render_template.connect(_render_start, app, weak=False)
+    template_rendered.connect(_render_done, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,207 @@
+import hmac
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+# ======================================================
+# ON-DEMAND REQUEST PROFILING (SAMPLING, FLAME GRAPHS)
+# ======================================================
+#
+# NEXORIA_PROFILE_DIR=<dir> plus NEXORIA_PROFILE_SECRET=<secret> arm it;
+# nothing is profiled until a request carries
+#
+#   X-Nexoria-Profile: <secret>
+#
+# That one request is sampled by a background thread every
+# NEXORIA_PROFILE_INTERVAL ms (default 1) and written to <dir> as
+#
+#   profile-<ms>-<pid>-<n>-<endpoint>.collapsed        flamegraph.pl / speedscope
+#   profile-<ms>-<pid>-<n>-<endpoint>.speedscope.json  https://www.speedscope.app
+#
+# Only the newest NEXORIA_PROFILE_KEEP (default 50) profiles are kept. The
+# response names the file in its X-Nexoria-Profile header. Streamed bodies
+# are produced after the view returns and are not part of the profile.
+# scripts/profile_report.py sums the hot spots over everything captured.
+
+PREFIX = 'profile-'
+COLLAPSED = '.collapsed'
+SPEEDSCOPE = '.speedscope.json'
+HEADER = 'X-Nexoria-Profile'
+
+DEFAULT_INTERVAL = 0.001
+DEFAULT_KEEP = 50
+
+
+def frame_name(code, base_dir):
+    path = code.co_filename
+    if path.startswith(base_dir):
+        path = os.path.relpath(path, base_dir)
+    else:
+        # library frames: keep the package-relative tail
+        parts = path.replace('\\', '/').split('/')
+        path = '/'.join(parts[-2:])
+    # ';' separates frames in the collapsed format
+    return ('%s (%s:%d)' % (code.co_name, path, code.co_firstlineno)).replace(';', ':')
+
+
+class Sampler:
+    """Samples one thread's stack until stop(); stacks are counted, root first."""
+
+    def __init__(self, thread_id, interval, base_dir):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.base_dir = base_dir
+        self.stacks = {}
+        self.samples = 0
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        frames = sys._current_frames
+        names = self._names
+        me = self.thread_id
+        while not self._stop.wait(self.interval):
+            frame = frames().get(me)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = frame_name(code, self.base_dir)
+                stack.append(name)
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                key = tuple(stack)
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+
+def collapsed(stacks):
+    return ''.join('%s %d\n' % (';'.join(stack), n) for stack, n in
+                   sorted(stacks.items(), key=lambda x: -x[1]))
+
+
+def speedscope(stacks, name, interval):
+    frames = []
+    index = {}
+    samples = []
+    weights = []
+    for stack, n in stacks.items():
+        row = []
+        for f in stack:
+            if f not in index:
+                index[f] = len(frames)
+                func, _, where = f.partition(' (')
+                file, _, line = where.rstrip(')').rpartition(':')
+                frames.append({'name': func, 'file': file, 'line': int(line or 0)})
+            row.append(index[f])
+        samples.append(row)
+        weights.append(round(n * interval * 1000, 3))
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'nexoria profiling.py',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled', 'name': name, 'unit': 'milliseconds',
+            'startValue': 0, 'endValue': round(sum(weights), 3),
+            'samples': samples, 'weights': weights,
+        }],
+    }
+
+
+def profiles(directory):
+    """Collapsed profile paths, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, n) for n in sorted(names)
+            if n.startswith(PREFIX) and n.endswith(COLLAPSED)]
+
+
+class Profiler:
+    def __init__(self, directory, secret, interval=DEFAULT_INTERVAL, keep=DEFAULT_KEEP, base_dir='.'):
+        if not secret:
+            raise ValueError('NEXORIA_PROFILE_SECRET is required to enable profiling')
+        self.directory = directory
+        self.secret = secret.encode('utf-8')
+        self.interval = interval
+        self.keep = keep
+        self.base_dir = os.path.abspath(base_dir)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._switch = None
+        self._seq = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def wants(self, request):
+        given = request.headers.get(HEADER)
+        return bool(given) and hmac.compare_digest(given.encode('utf-8'), self.secret)
+
+    def start(self):
+        # the sampler needs the GIL at least once per interval
+        with self._lock:
+            if not self._active:
+                self._switch = sys.getswitchinterval()
+                sys.setswitchinterval(min(self._switch, self.interval / 2))
+            self._active += 1
+        sampler = Sampler(threading.get_ident(), self.interval, self.base_dir)
+        sampler.start()
+        return sampler
+
+    def stop(self, sampler):
+        sampler.stop()
+        with self._lock:
+            self._active -= 1
+            if not self._active:
+                sys.setswitchinterval(self._switch)
+
+    def save(self, sampler, endpoint, title):
+        stem = '%s%013d-%d-%06d-%s' % (PREFIX, int(time.time() * 1000), os.getpid(), next(self._seq),
+                                     re.sub(r'[^A-Za-z0-9_]', '_', endpoint or 'none'))
+        path = os.path.join(self.directory, stem)
+        with open(path + COLLAPSED + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(collapsed(sampler.stacks))
+        with open(path + SPEEDSCOPE, 'w', encoding='utf-8') as f:
+            json.dump(speedscope(sampler.stacks, '%s (%.1f ms)' % (title, sampler.duration * 1000),
+                                 self.interval), f)
+        # the .collapsed file appears last, readers only look for those
+        os.replace(path + COLLAPSED + '.tmp', path + COLLAPSED)
+        self._trim()
+        return stem
+
+    def _trim(self):
+        for old in profiles(self.directory)[:-self.keep]:
+            for path in (old, old[:-len(COLLAPSED)] + SPEEDSCOPE):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def open_profiler(directory, base_dir='.'):
+    if not directory:
+        return None
+    return Profiler(
+        os.path.join(base_dir, directory),
+        os.environ.get('NEXORIA_PROFILE_SECRET'),
+        interval=float(os.environ.get('NEXORIA_PROFILE_INTERVAL', DEFAULT_INTERVAL * 1000)) / 1000,
+        keep=int(os.environ.get('NEXORIA_PROFILE_KEEP', DEFAULT_KEEP)),
+        base_dir=base_dir,
+    )
@@ -0,0 +1,170 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# ======================================================
+# ADMISSION CONTROL (TOKEN BUCKETS)
+# ======================================================
+#
+# NEXORIA_RATELIMIT turns it on for /pull, /pull/stream and /buy:
+#   memory            buckets in this process (one set per worker)
+#   sqlite:<path>     buckets shared by every process using the file
+#
+# Every request takes one token from its client IP bucket and, when it has
+# a uid cookie, one from the uid bucket. Rates are "<tokens per second>/<burst>":
+#   NEXORIA_RATE_UID   default 5/20
+#   NEXORIA_RATE_IP    default 20/60
+#
+# The check runs in before_request and only looks at the raw uid cookie,
+# so a rejected request never deserializes or loads the user.
+
+DEFAULT_RATES = {'uid': '5/20', 'ip': '20/60'}
+
+# in-memory buckets kept before the least recently used are dropped
+# (a dropped bucket just starts full again)
+MAX_BUCKETS = 100000
+
+
+def parse_rate(spec):
+    rate, _, burst = spec.partition('/')
+    rate = float(rate)
+    burst = float(burst or rate)
+    if rate <= 0 or burst < 1:
+        raise ValueError('bad rate %r' % spec)
+    return rate, burst
+
+
+class MemoryBuckets:
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1.0, now=None):
+        """Take `cost` tokens; returns 0 if allowed, else seconds until it would be."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+                if len(self._buckets) >= self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                self._buckets.move_to_end(key)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+
+class SqliteBuckets:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            ts REAL NOT NULL
+        )
+    '''
+    # refill + take in one statement; no row changes when there aren't enough tokens
+    TAKE = '''
+        INSERT INTO buckets (key, tokens, ts) VALUES (:key, :burst - :cost, :now)
+        ON CONFLICT(key) DO UPDATE SET
+            tokens = min(:burst, tokens + (:now - ts) * :rate) - :cost,
+            ts = :now
+        WHERE min(:burst, tokens + (:now - ts) * :rate) >= :cost
+    '''
+    PEEK = 'SELECT min(:burst, tokens + (:now - ts) * :rate) FROM buckets WHERE key = :key'
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connect().execute(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False, cached_statements=16)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # losing a few token updates on power loss is fine
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def take(self, key, rate, burst, cost=1.0, now=None):
+        # wall clock: the timestamps are shared between processes
+        params = {'key': key, 'rate': rate, 'burst': burst, 'cost': cost,
+                  'now': time.time() if now is None else now}
+        conn = self._connect()
+        if conn.execute(self.TAKE, params).rowcount:
+            return 0.0
+        row = conn.execute(self.PEEK, params).fetchone()
+        tokens = row[0] if row else burst
+        return max(cost - tokens, 0.0) / rate
+
+
+class Limiter:
+    def __init__(self, buckets, rates=None):
+        self.buckets = buckets
+        self.rates = {scope: parse_rate(spec) for scope, spec in (rates or DEFAULT_RATES).items()}
+        # (endpoint, scope) -> rejected requests, also exported as a metric
+        self.rejected = {}
+
+    def check(self, uid, ip):
+        """(scope, retry_after) of the first bucket that says no, or None."""
+        for scope, key in (('ip', ip), ('uid', uid)):
+            if not key or scope not in self.rates:
+                continue
+            wait = self.buckets.take('%s:%s' % (scope, key), *self.rates[scope])
+            if wait:
+                return scope, wait
+        return None
+
+    def close(self):
+        close = getattr(self.buckets, 'close', None)
+        if close is not None:
+            close()
+
+    def admit(self, request):
+        """None to let the request through, or a 429 response."""
+        from flask import jsonify
+
+        denied = self.check(request.cookies.get('uid'), request.remote_addr)
+        if denied is None:
+            return None
+        scope, wait = denied
+        retry_after = max(1, math.ceil(wait))
+        key = (request.endpoint, scope)
+        self.rejected[key] = self.rejected.get(key, 0) + 1
+        metrics.rate_limited.inc(request.endpoint, scope)
+        resp = jsonify({'ok': False, 'error': 'Too many requests', 'retry_after': retry_after})
+        resp.status_code = 429
+        resp.headers['Retry-After'] = str(retry_after)
+        return resp
+
+
+def open_limiter(spec, base_dir='.'):
+    if not spec or spec == 'off':
+        return None
+    kind, _, arg = spec.partition(':')
+    rates = {scope: os.environ.get('NEXORIA_RATE_' + scope.upper(), default)
+             for scope, default in DEFAULT_RATES.items()}
+    if kind == 'memory':
+        return Limiter(MemoryBuckets(), rates)
+    if kind == 'sqlite':
+        return Limiter(SqliteBuckets(os.path.join(base_dir, arg or 'ratelimit.db')), rates)
+    raise ValueError('unknown NEXORIA_RATELIMIT %r' % spec)
@@ -0,0 +1,246 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ======================================================
+# REPLAY PROTECTION (IDEMPOTENCY KEYS, STATE REVISIONS)
+# ======================================================
+#
+# Two separate guards for the routes that spend coins or tickets:
+#
+# Idempotency-Key header: the first response for (uid, endpoint, key) is
+# kept in a ResponseCache and sent again for every repeat, so a
+# double-clicked or retried request is only run once. A repeat that arrives
+# while the first one is still running waits for it. The cache is an LRU
+# bounded in entries and in bytes whose entries expire after IDEMPOTENCY_TTL
+# seconds. A response bigger than MAX_RESPONSE_SIZE isn't kept: its key is
+# remembered as done, and repeats are refused instead of run again.
+#
+# State revisions: the user cookie carries `rev`, bumped on every spend. The
+# server remembers the newest revision it handed out per uid and refuses a
+# cookie older than that, so re-sending an old cookie can't re-spend coins
+# that were already spent. NEXORIA_REPLAY picks where that is remembered:
+#   memory            this process only (default)
+#   sqlite:<path>     shared by every worker using the file
+#   off               no revision checks
+# A uid the tracker has never seen (or has evicted) is trusted, which is why
+# the cookie is bound to its uid (cookie_codec.py): under any other uid it
+# can't spend at all. Cookies from before that binding are honoured once.
+
+IDEMPOTENCY_TTL = 600.0
+MAX_RESPONSES = 10000
+# a non-compact 1000-pull is ~180 KB
+MAX_RESPONSE_BYTES = 32 * 1024 * 1024
+MAX_RESPONSE_SIZE = 1024 * 1024
+# how long a repeat waits for the original request before giving up
+INFLIGHT_WAIT = 10.0
+
+MAX_REVISIONS = 100000
+
+
+# stored in place of a response that was too big to keep
+TOO_LARGE = object()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_RESPONSES, ttl=IDEMPOTENCY_TTL,
+                 max_bytes=MAX_RESPONSE_BYTES, max_size=MAX_RESPONSE_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_size = min(max_size, max_bytes)
+        # key -> [expires, fingerprint, response or None while running, Event, size]
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[4]
+
+    def _expire(self, now):
+        # from the least recently used end; expired entries further in are
+        # caught when they are looked up
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry[0] > now:
+                break
+            self._drop(key)
+
+    def begin(self, key, fingerprint, now=None):
+        """('new', None), ('hit', response), ('mismatch', None), ('busy', None)
+        or ('gone', None) for a finished request whose response was too big to keep.
+
+        'new' reserves the key: the caller must finish() or abandon() it.
+        """
+        deadline = time.monotonic() + INFLIGHT_WAIT
+        while True:
+            with self._lock:
+                t = time.monotonic() if now is None else now
+                self._expire(t)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] <= t:
+                    self._drop(key)
+                    entry = None
+                if entry is None:
+                    while len(self._entries) >= self.max_entries:
+                        self._drop(next(iter(self._entries)))
+                    self._entries[key] = [t + self.ttl, fingerprint, None, threading.Event(), 0]
+                    return 'new', None
+                if entry[1] != fingerprint:
+                    return 'mismatch', None
+                if entry[2] is TOO_LARGE:
+                    return 'gone', None
+                if entry[2] is not None:
+                    self._entries.move_to_end(key)
+                    return 'hit', entry[2]
+                done = entry[3]
+            # the original is still running: wait for it, then look again
+            left = deadline - time.monotonic()
+            if left <= 0 or not done.wait(left):
+                return 'busy', None
+
+    def finish(self, key, response, size=0, now=None):
+        """Keep `response` (about `size` bytes) for repeats of `key`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None:
+                t = time.monotonic() if now is None else now
+                if size > self.max_size:
+                    response, size = TOO_LARGE, 0
+                entry[0] = t + self.ttl
+                entry[2] = response
+                entry[4] = size
+                self._bytes += size
+                self._entries.move_to_end(key)
+                entry[3].set()
+                self._shrink(key)
+
+    def _shrink(self, keep):
+        # least recently used finished responses go first; running requests
+        # hold no bytes and are left alone
+        if self._bytes <= self.max_bytes:
+            return
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if key != keep and entry[2] is not None:
+                self._drop(key)
+                if self._bytes <= self.max_bytes:
+                    return
+
+    def abandon(self, key):
+        """Forget a reservation whose request failed, so a retry runs again."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None:
+                self._drop(key)
+                entry[3].set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._bytes
+
+
+def fingerprint(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+# --------------------------------------------------
+# state revisions
+# --------------------------------------------------
+
+class MemoryRevisions:
+    def __init__(self, max_entries=MAX_REVISIONS):
+        self.max_entries = max_entries
+        self._latest = OrderedDict()
+        self._lock = threading.Lock()
+
+    def latest(self, uid):
+        with self._lock:
+            return self._latest.get(uid)
+
+    def claim(self, uid, rev):
+        """Move uid from `rev` to rev + 1; False if a newer revision was issued."""
+        with self._lock:
+            latest = self._latest.get(uid)
+            if latest is not None and rev < latest:
+                return False
+            if latest is None and len(self._latest) >= self.max_entries:
+                self._latest.popitem(last=False)
+            self._latest[uid] = rev + 1
+            self._latest.move_to_end(uid)
+            return True
+
+    def release(self, uid, rev):
+        """Undo claim(uid, rev) for a request that failed halfway."""
+        with self._lock:
+            if self._latest.get(uid) == rev + 1:
+                self._latest[uid] = rev
+
+
+class SqliteRevisions:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS revisions (
+            uid TEXT PRIMARY KEY,
+            rev INTEGER NOT NULL,
+            ts REAL NOT NULL
+        )
+    '''
+    # compare-and-set in one statement: no row changes when the cookie is stale
+    CLAIM = '''
+        INSERT INTO revisions (uid, rev, ts) VALUES (:uid, :rev + 1, :now)
+        ON CONFLICT(uid) DO UPDATE SET rev = :rev + 1, ts = :now
+        WHERE rev <= :rev
+    '''
+    RELEASE = 'UPDATE revisions SET rev = :rev WHERE uid = :uid AND rev = :rev + 1'
+    LATEST = 'SELECT rev FROM revisions WHERE uid = ?'
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connect().execute(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def latest(self, uid):
+        row = self._connect().execute(self.LATEST, (uid,)).fetchone()
+        return row[0] if row else None
+
+    def claim(self, uid, rev):
+        params = {'uid': uid, 'rev': rev, 'now': time.time()}
+        return self._connect().execute(self.CLAIM, params).rowcount == 1
+
+    def release(self, uid, rev):
+        self._connect().execute(self.RELEASE, {'uid': uid, 'rev': rev})
+
+
+def open_revisions(spec, base_dir='.'):
+    if not spec or spec == 'off':
+        return None
+    kind, _, arg = spec.partition(':')
+    if kind == 'memory':
+        return MemoryRevisions()
+    if kind == 'sqlite':
+        return SqliteRevisions(os.path.join(base_dir, arg or 'revisions.db'))
+    raise ValueError('unknown NEXORIA_REPLAY %r' % spec)
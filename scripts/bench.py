@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Latency / throughput benchmark for the Flask routes.
+
+Drives /, /deck, /pull (1, 10, 100), /buy and /reset with prebuilt cookie
+states (empty, half and full collection), either in-process through the
+Flask test client or over HTTP against a locally spawned server with
+concurrent workers. Every request replays the same cookie, so runs are
+repeatable. That is exactly what the cookie revision check (replay.py)
+refuses, so the bench runs with NEXORIA_REPLAY=off unless told otherwise.
+
+    python scripts/bench.py                             # test client
+    python scripts/bench.py --server --concurrency 8    # real sockets
+    python scripts/bench.py --save bench/baseline.json
+    python scripts/bench.py --compare bench/baseline.json --tolerance 0.25
+
+--compare exits with status 1 when any scenario's p95 latency or response
+size got worse than the baseline by more than the tolerance. A run where
+any response was not 2xx exits with status 3 and saves no baseline, since
+error responses say nothing about the route's cost.
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# before app is imported; the --server child inherits it
+os.environ.setdefault('NEXORIA_REPLAY', 'off')
+import argparse
+import http.client
+import json
+import socket
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, codec, new_user
+from catalog import get_catalog
+from collection import OwnedCards
+
+STATES = ('empty', 'half', 'full')
+
+SCENARIOS = [
+    ('GET', '/', None),
+    ('GET', '/deck', None),
+    ('POST', '/pull', {'count': 1}),
+    ('POST', '/pull', {'count': 10}),
+    ('POST', '/pull', {'count': 100}),
+    ('POST', '/buy', {'rarity': 'B'}),
+    ('POST', '/reset', {'confirm': True}),
+]
+
+# combinations that can only fail: a full collection has nothing left to buy
+SKIP = {('/buy', 'full')}
+
+
+def make_cookie(state):
+    ids = sorted(get_catalog().by_id)
+    user = new_user()
+    # enough to never run out during a run
+    user['coins'] = 10 ** 9
+    user['tickets'] = 10 ** 9
+    if state == 'half':
+        user['owned'] = OwnedCards.from_ids(ids[::2])
+    elif state == 'full':
+        user['owned'] = OwnedCards.from_ids(ids)
+    uid = 'bench' + state
+    return 'uid=%s; user_data=%s' % (uid, codec.dumps(user, uid))
+
+
+def scenario_name(method, path, body, state):
+    extra = ''
+    if body and 'count' in body:
+        extra = ' x%d' % body['count']
+    return '%s %s%s [%s]' % (method, path, extra, state)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies, sizes, statuses, elapsed):
+    lat = sorted(latencies)
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return {
+        'requests': len(lat),
+        'p50_ms': round(percentile(lat, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(lat, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(lat, 0.99) * 1000, 3),
+        'rps': round(len(lat) / elapsed, 1) if elapsed else None,
+        'bytes': round(sum(sizes) / len(sizes)) if sizes else 0,
+        'status': counts,
+        'errors': sum(1 for status in statuses if not 200 <= status < 300),
+    }
+
+
+# ------------------------------------------------------
+# in-process (Flask test client)
+# ------------------------------------------------------
+
+def run_client(method, path, body, cookie, n, warmup):
+    client = app.test_client(use_cookies=False)
+    headers = {'Cookie': cookie}
+
+    def once():
+        t = time.perf_counter()
+        r = client.open(path, method=method, json=body, headers=headers)
+        data = r.get_data()
+        dt = time.perf_counter() - t
+        head = sum(len(k) + len(v) + 4 for k, v in r.headers.items())
+        return dt, len(data) + head, r.status_code
+
+    for _ in range(warmup):
+        once()
+    start = time.perf_counter()
+    out = [once() for _ in range(n)]
+    elapsed = time.perf_counter() - start
+    return summarize([o[0] for o in out], [o[1] for o in out], [o[2] for o in out], elapsed)
+
+
+# ------------------------------------------------------
+# over HTTP (spawned server, concurrent workers)
+# ------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(port):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('server did not start on port %d' % port)
+
+
+def http_request(port, method, path, body, cookie):
+    payload = json.dumps(body).encode() if body is not None else None
+    headers = {'Cookie': cookie}
+    if payload is not None:
+        headers['Content-Type'] = 'application/json'
+    t = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request(method, path, body=payload, headers=headers)
+        r = conn.getresponse()
+        data = r.read()
+        head = sum(len(k) + len(v) + 4 for k, v in r.getheaders())
+    finally:
+        conn.close()
+    return time.perf_counter() - t, len(data) + head, r.status
+
+
+def run_server(port, method, path, body, cookie, n, warmup, concurrency):
+    for _ in range(warmup):
+        http_request(port, method, path, body, cookie)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        out = list(pool.map(lambda _: http_request(port, method, path, body, cookie), range(n)))
+    elapsed = time.perf_counter() - start
+    return summarize([o[0] for o in out], [o[1] for o in out], [o[2] for o in out], elapsed)
+
+
+# ------------------------------------------------------
+# baseline comparison
+# ------------------------------------------------------
+
+def compare(results, baseline, tolerance):
+    failures = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('p95_ms', 'bytes'):
+            if base[metric] and cur[metric] > base[metric] * (1 + tolerance):
+                failures.append('%s: %s %.3f -> %.3f' % (name, metric, base[metric], cur[metric]))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', action='store_true', help='benchmark a spawned HTTP server')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('-n', '--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--filter', help='only scenarios whose name contains this')
+    parser.add_argument('--save', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        from werkzeug.serving import run_simple
+        run_simple('127.0.0.1', args.serve, app, threaded=True)
+        return 0
+
+    cookies = {state: make_cookie(state) for state in STATES}
+    proc = port = None
+    if args.server:
+        port = free_port()
+        proc = spawn_server(port)
+
+    results = {}
+    try:
+        print('%-32s %8s %8s %8s %9s %8s %7s' % ('scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'bytes', 'errors'))
+        for method, path, body in SCENARIOS:
+            for state in STATES:
+                name = scenario_name(method, path, body, state)
+                if (args.filter and args.filter not in name) or (path, state) in SKIP:
+                    continue
+                if args.server:
+                    r = run_server(port, method, path, body, cookies[state],
+                                   args.requests, args.warmup, args.concurrency)
+                else:
+                    r = run_client(method, path, body, cookies[state], args.requests, args.warmup)
+                results[name] = r
+                print('%-32s %8.2f %8.2f %8.2f %9.1f %8d %7d' % (
+                    name, r['p50_ms'], r['p95_ms'], r['p99_ms'], r['rps'], r['bytes'], r['errors']))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    failed = [(name, r['status']) for name, r in results.items() if r['errors']]
+    if failed:
+        print('\nnon-2xx responses, results not saved or compared:')
+        for name, status in failed:
+            print('  %s: %s' % (name, ', '.join('%s x%d' % kv for kv in sorted(status.items()))))
+        return 3
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'mode': 'server' if args.server else 'client',
+                'results': results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        mode = 'server' if args.server else 'client'
+        if baseline.get('mode') != mode:
+            print('\nbaseline was recorded in %s mode, this run is %s mode' % (baseline.get('mode'), mode))
+            return 2
+        failures = compare(results, baseline['results'], args.tolerance)
+        if failures:
+            print('\nregressions (tolerance %d%%):' % (args.tolerance * 100))
+            for line in failures:
+                print('  ' + line)
+            return 1
+        print('\nno regressions against %s' % args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
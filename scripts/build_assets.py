@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Build fingerprinted images, thumbnails and WebP variants.
+
+Reads every image under static/public/{cards,box,assets} and writes into
+static/dist/ (needs Pillow: python -m pip install Pillow):
+
+    <name>.<hash>.<ext>           full-size copy
+    <name>.<hash>.webp            full-size WebP
+    <name>.<hash>.thumb.<ext>     bounded thumbnail
+    <name>.<hash>.thumb.webp      bounded thumbnail, WebP
+
+plus static/dist/manifest.json mapping the original path (relative to
+static/, e.g. "public/cards/S/s-armin.jpg") to its variants. Templates
+resolve images through asset_url(), so files missing from the manifest
+keep working from their original location. The hash is taken from the
+source bytes, so unchanged images are skipped on rebuilds.
+
+    python scripts/build_assets.py
+    python scripts/build_assets.py --thumb-size 240x336 --clean
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import hashlib
+import json
+import shutil
+
+from catalog import BASE_DIR
+
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+SOURCES = ('public/cards', 'public/box', 'public/assets')
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+def iter_images():
+    for src in SOURCES:
+        for root, _, files in os.walk(os.path.join(STATIC_DIR, src)):
+            for fn in sorted(files):
+                if fn.lower().endswith(IMAGE_EXTS):
+                    path = os.path.join(root, fn)
+                    yield os.path.relpath(path, STATIC_DIR).replace(os.sep, '/'), path
+
+
+def content_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def build_one(Image, rel, path, thumb_size, quality):
+    digest = content_hash(path)
+    stem, ext = os.path.splitext(rel)
+    ext = ext.lower()
+    names = {
+        'full': '%s.%s%s' % (stem, digest, ext),
+        'webp': '%s.%s.webp' % (stem, digest),
+        'thumb': '%s.%s.thumb%s' % (stem, digest, ext),
+        'thumb_webp': '%s.%s.thumb.webp' % (stem, digest),
+    }
+    entry = {k: 'dist/' + v for k, v in names.items()}
+    targets = {k: os.path.join(DIST_DIR, *v.split('/')) for k, v in names.items()}
+    if all(os.path.exists(t) for t in targets.values()):
+        return entry, False
+
+    os.makedirs(os.path.dirname(targets['full']), exist_ok=True)
+    shutil.copyfile(path, targets['full'])
+
+    with Image.open(path) as im:
+        im.load()
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'transparency' in im.info or im.mode in ('LA', 'P') else 'RGB')
+        im.save(targets['webp'], 'WEBP', quality=quality, method=6)
+
+        thumb = im.copy()
+        thumb.thumbnail(thumb_size, Image.LANCZOS)
+        save_kw = {'optimize': True}
+        if ext in ('.jpg', '.jpeg'):
+            thumb = thumb.convert('RGB')
+            save_kw['quality'] = quality
+        thumb.save(targets['thumb'], **save_kw)
+        thumb.save(targets['thumb_webp'], 'WEBP', quality=quality, method=6)
+    return entry, True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--thumb-size', default='320x448', help='max WxH of thumbnails')
+    parser.add_argument('--quality', type=int, default=82)
+    parser.add_argument('--clean', action='store_true', help='remove static/dist first')
+    args = parser.parse_args(argv)
+
+    try:
+        from PIL import Image
+    except ImportError:
+        print('Pillow is required: python -m pip install Pillow', file=sys.stderr)
+        return 2
+
+    w, h = (int(x) for x in args.thumb_size.lower().split('x'))
+    if args.clean and os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR, exist_ok=True)
+
+    manifest = {}
+    built = 0
+    src_bytes = thumb_bytes = 0
+    for rel, path in iter_images():
+        entry, fresh = build_one(Image, rel, path, (w, h), args.quality)
+        manifest[rel] = entry
+        built += fresh
+        src_bytes += os.path.getsize(path)
+        thumb_bytes += os.path.getsize(os.path.join(STATIC_DIR, *entry['thumb_webp'].split('/')))
+
+    tmp = os.path.join(DIST_DIR, 'manifest.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(DIST_DIR, 'manifest.json'))
+
+    print('%d images (%d rebuilt), sources %.1f MB, webp thumbnails %.1f MB' % (
+        len(manifest), built, src_bytes / 1e6, thumb_bytes / 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
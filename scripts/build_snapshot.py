@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Precompile what a cold start would otherwise build (for serverless deploys).
+
+    build/catalog.pickle   cards.json validated and turned into a Catalog
+                           with all indexes precomputed; loaded with one
+                           unpickle while its source hash matches cards.json
+    build/jinja/           Jinja bytecode for every template
+
+Ship build/ with the deployment. Both are optional: a stale or missing
+snapshot falls back to parsing cards.json, a missing cache to compiling.
+
+    python scripts/build_snapshot.py
+    python scripts/build_snapshot.py --report     # cold start, cached vs not
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import shutil
+import subprocess
+
+import catalog as catalog_mod
+from catalog import BASE_DIR, CARDS_FILE, SNAPSHOT_FILE
+
+JINJA_DIR = os.path.join(BASE_DIR, 'build', 'jinja')
+
+COLD_START = "import app; app.app.test_client().get('/deck')"
+
+
+def build_catalog_snapshot(path):
+    with open(CARDS_FILE, 'rb') as f:
+        raw = f.read()
+    import json
+    cards = json.loads(raw)
+    errors, warnings = catalog_mod.validate_cards(cards)
+    for w in warnings:
+        print('warning: ' + w)
+    if errors:
+        for e in errors:
+            print('error: ' + e, file=sys.stderr)
+        return None
+    # same path as a runtime load, minus the snapshot
+    catalog = catalog_mod.build_catalog(CARDS_FILE)
+    catalog_mod.write_snapshot(catalog, raw, path)
+    return catalog
+
+
+def build_templates(directory):
+    os.makedirs(directory, exist_ok=True)
+    from coldstart import template_cache
+    from app import app
+    env = app.jinja_env
+    env.bytecode_cache = template_cache(directory)
+    names = env.list_templates(extensions=('html',))
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def cold_start(env):
+    out = subprocess.run(
+        [sys.executable, '-c', COLD_START], cwd=BASE_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True,
+    ).stderr
+    phases = {}
+    for line in out.splitlines():
+        name, _, rest = line.rpartition('  ')
+        if rest.endswith(' ms'):
+            phases[name.strip()] = float(rest[:-3])
+    return phases
+
+
+def report():
+    base = dict(os.environ, NEXORIA_STARTUP_REPORT='1')
+    cold = dict(base, NEXORIA_CATALOG_SNAPSHOT=os.devnull, NEXORIA_JINJA_CACHE=os.devnull)
+    # best of a few runs, the first one also pays for the disk cache
+    runs = {}
+    for label, env in (('no build', cold), ('build/', base)):
+        samples = [cold_start(env) for _ in range(3)]
+        runs[label] = {k: min(s.get(k, 0.0) for s in samples) for k in samples[0]}
+    print('%-16s %10s %10s' % ('phase', 'no build', 'build/'))
+    for phase in runs['no build']:
+        print('%-16s %7.1f ms %7.1f ms' % (phase, runs['no build'][phase], runs['build/'].get(phase, 0.0)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clean', action='store_true', help='remove old bytecode first')
+    parser.add_argument('--report', action='store_true', help='measure a cold start afterwards')
+    args = parser.parse_args(argv)
+
+    catalog = build_catalog_snapshot(SNAPSHOT_FILE)
+    if catalog is None:
+        return 1
+    print('catalog: %d cards, content %s -> %s' % (
+        len(catalog), catalog.content_hash, os.path.relpath(SNAPSHOT_FILE, BASE_DIR)))
+
+    if args.clean and os.path.isdir(JINJA_DIR):
+        shutil.rmtree(JINJA_DIR)
+    names = build_templates(JINJA_DIR)
+    print('templates: %d compiled -> %s' % (len(names), os.path.relpath(JINJA_DIR, BASE_DIR)))
+
+    if args.report:
+        print()
+        report()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
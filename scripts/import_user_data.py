@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""One-shot import of user_data/*.json into a server-side user store.
+
+    python scripts/import_user_data.py sqlite:nexoria.db
+    python scripts/import_user_data.py sqlite:nexoria.db --src user_data --overwrite
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import json
+
+from catalog import BASE_DIR
+from storage import normalize_user, open_store
+
+
+def iter_user_files(src):
+    for entry in os.scandir(src):
+        if entry.is_file() and entry.name.endswith('.json'):
+            yield entry.name[:-len('.json')], entry.path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('store', help="target store, e.g. sqlite:nexoria.db")
+    parser.add_argument('--src', default=os.path.join(BASE_DIR, 'user_data'))
+    parser.add_argument('--overwrite', action='store_true',
+                        help='replace users that already exist in the target')
+    args = parser.parse_args(argv)
+
+    store = open_store(args.store, BASE_DIR)
+    if not store.server_side:
+        parser.error('target must be a server-side store')
+
+    imported = skipped = failed = 0
+    for uid, path in iter_user_files(args.src):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                user = normalize_user(json.load(f))
+        except (OSError, ValueError) as e:
+            print('skip %s: %s' % (path, e), file=sys.stderr)
+            failed += 1
+            continue
+
+        with store.atomic(uid):
+            if not args.overwrite and store.load(uid) is not None:
+                skipped += 1
+                continue
+            store.save(uid, user)
+        imported += 1
+
+    print('imported %d, skipped %d existing, %d unreadable' % (imported, skipped, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Sum the hot spots over the request profiles in a NEXORIA_PROFILE_DIR.
+
+Self time is where the sampled stack ended, total time counts a function
+once per sample it was anywhere on the stack. Percentages are of all
+samples read.
+
+    python scripts/profile_report.py profiles/                  # every profile
+    python scripts/profile_report.py profiles/ --endpoint pull --top 30
+    python scripts/profile_report.py profiles/ --merge all.collapsed
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+
+from profiling import COLLAPSED, profiles
+
+
+def read_collapsed(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, _, n = line.rstrip('\n').rpartition(' ')
+            if stack and n.isdigit():
+                yield stack, int(n)
+
+
+def endpoint_of(path):
+    # profile-<ms>-<pid>-<n>-<endpoint>.collapsed
+    return os.path.basename(path)[:-len(COLLAPSED)].split('-', 4)[-1]
+
+
+def summarize(paths):
+    stacks = {}
+    for path in paths:
+        for stack, n in read_collapsed(path):
+            stacks[stack] = stacks.get(stack, 0) + n
+    own = {}
+    total = {}
+    samples = 0
+    for stack, n in stacks.items():
+        frames = stack.split(';')
+        samples += n
+        own[frames[-1]] = own.get(frames[-1], 0) + n
+        # recursion must not count a sample twice
+        for f in set(frames):
+            total[f] = total.get(f, 0) + n
+    return {'profiles': len(paths), 'samples': samples, 'self': own, 'total': total, 'stacks': stacks}
+
+
+def table(counts, samples, top):
+    rows = sorted(counts.items(), key=lambda x: (-x[1], x[0]))[:top]
+    return ['%7d %6.1f%%  %s' % (n, 100.0 * n / samples, f) for f, n in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--endpoint', help='only profiles of this Flask endpoint')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--merge', metavar='PATH', help='also write the summed stacks (collapsed format)')
+    args = parser.parse_args(argv)
+
+    paths = [p for p in profiles(args.directory)
+             if args.endpoint is None or endpoint_of(p) == args.endpoint]
+    if not paths:
+        print('no profiles in %s' % args.directory, file=sys.stderr)
+        return 1
+    s = summarize(paths)
+    if not s['samples']:
+        print('%d profiles, no samples (requests shorter than the interval?)' % s['profiles'])
+        return 0
+
+    print('%d profiles, %d samples' % (s['profiles'], s['samples']))
+    print('\nself')
+    print('\n'.join(table(s['self'], s['samples'], args.top)))
+    print('\ntotal')
+    print('\n'.join(table(s['total'], s['samples'], args.top)))
+    if args.merge:
+        with open(args.merge, 'w', encoding='utf-8') as f:
+            for stack, n in sorted(s['stacks'].items(), key=lambda x: -x[1]):
+                f.write('%s %d\n' % (stack, n))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Stream the pull ledger back for analysis.
+
+Prints entries as JSON lines (optionally filtered), or with --summary the
+observed rarity rates, pity counts and buys per rarity. Reads one entry at
+a time, so segments of any size are fine.
+
+    python scripts/read_ledger.py ledger/                      # every segment
+    python scripts/read_ledger.py ledger/ledger-...ndjson --uid abc123
+    python scripts/read_ledger.py ledger/ --since 1760000000 --summary
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import json
+
+from gacha import PITY_RULES
+from ledger import read_ledger, read_segment
+
+
+def entries(path):
+    return read_ledger(path) if os.path.isdir(path) else read_segment(path)
+
+
+def summarize(stream):
+    pulled = {}
+    bought = {}
+    pulls = entries_seen = 0
+    pity_fired = {r: 0 for r, _, _ in PITY_RULES}
+    for e in stream:
+        entries_seen += 1
+        if e.get('kind') == 'buy':
+            for r in e['rarities']:
+                bought[r] = bought.get(r, 0) + 1
+            continue
+        pulls += e['count']
+        for r in e['rarities']:
+            pulled[r] = pulled.get(r, 0) + 1
+        # a counter at its threshold before the pull means the guarantee fired
+        for (r, _, threshold), before in zip(PITY_RULES, e.get('pity_before', ())):
+            if before >= threshold:
+                pity_fired[r] += 1
+    return {
+        'entries': entries_seen,
+        'pulls': pulls,
+        'rates': {r: round(n / pulls, 6) for r, n in sorted(pulled.items(), key=lambda x: -x[1])} if pulls else {},
+        'pity_fired': pity_fired,
+        'bought': bought,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='ledger directory or a single segment')
+    parser.add_argument('--uid')
+    parser.add_argument('--kind', choices=('pull', 'buy'))
+    parser.add_argument('--since', type=float, help='unix timestamp')
+    parser.add_argument('--until', type=float, help='unix timestamp')
+    parser.add_argument('--summary', action='store_true')
+    args = parser.parse_args(argv)
+
+    stream = (
+        e for e in entries(args.path)
+        if (args.uid is None or e.get('uid') == args.uid)
+        and (args.kind is None or e.get('kind') == args.kind)
+        and (args.since is None or e['ts'] >= args.since)
+        and (args.until is None or e['ts'] < args.until)
+    )
+    if args.summary:
+        print(json.dumps(summarize(stream), indent=2))
+        return 0
+    try:
+        for e in stream:
+            sys.stdout.write(json.dumps(e, separators=(',', ':')) + '\n')
+    except BrokenPipeError:
+        # piped into head & co.
+        sys.stderr.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Recompute the global stats tables (NEXORIA_STATS_DB) from stored users.
+
+Streams users one at a time, so memory depends on the catalog size, not
+on the number of players. Sources:
+
+    user_data/                  a directory of <uid>.json files (default)
+    sqlite:nexoria.db           the SQLite user store
+
+Pull counts per rarity are not part of the user state; pass --ledger to
+recount them from the pull ledger, otherwise the current counts are kept.
+
+    python scripts/rebuild_stats.py stats.db
+    python scripts/rebuild_stats.py stats.db --src sqlite:nexoria.db --ledger ledger
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import json
+import sqlite3
+
+from catalog import BASE_DIR, get_catalog
+from collection import OwnedCards
+from ledger import read_ledger
+from stats import rebuild
+
+
+def iter_json_users(directory, errors):
+    for entry in os.scandir(directory):
+        if not (entry.is_file() and entry.name.endswith('.json')):
+            continue
+        try:
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                yield OwnedCards.load(json.load(f).get('owned')).bits
+        except (OSError, ValueError, AttributeError) as e:
+            print('skip %s: %s' % (entry.path, e), file=sys.stderr)
+            errors.append(entry.path)
+
+
+def iter_sqlite_users(path):
+    conn = sqlite3.connect(path)
+    try:
+        # the cursor streams rows, nothing is fetched up front
+        for (blob,) in conn.execute('SELECT owned FROM users'):
+            yield int.from_bytes(blob, 'little')
+    finally:
+        conn.close()
+
+
+def count_pulls(directory):
+    pulls = {}
+    for e in read_ledger(directory):
+        if e.get('kind') == 'pull':
+            for r in e['rarities']:
+                pulls[r] = pulls.get(r, 0) + 1
+    return pulls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('stats_db', help='the NEXORIA_STATS_DB file')
+    parser.add_argument('--src', default=os.path.join(BASE_DIR, 'user_data'),
+                        help='user_data directory or sqlite:<path>')
+    parser.add_argument('--ledger', help='ledger directory to recount pulls from')
+    args = parser.parse_args(argv)
+
+    errors = []
+    if args.src.startswith('sqlite:'):
+        users = iter_sqlite_users(os.path.join(BASE_DIR, args.src[len('sqlite:'):]))
+    else:
+        users = iter_json_users(args.src, errors)
+    pulls = count_pulls(args.ledger) if args.ledger else None
+
+    players = rebuild(os.path.join(BASE_DIR, args.stats_db), get_catalog(), users, pulls)
+    print('%d players with cards%s, %d unreadable' % (
+        players, ', %d pulls' % sum(pulls.values()) if pulls is not None else '', len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""Monte Carlo economy simulator for the gacha rates and pity rules.
+
+Every simulated player does `--pull-size` pulls at a time (10, like the
+gacha page) until they own the whole catalog or hit `--max-pulls`. With
+`--shop` they also spend tickets on boxes for missing cards after each
+pull, most expensive box first.
+
+The rules (rates, rate-up cards and pity thresholds of the `--banner`
+from banners.json, guarantee placement, ticket rewards, box costs, pull
+cost) come from the same code the server uses, so the numbers always
+describe what /pull actually does. Players are simulated in vectorised
+batches, batches run in parallel worker processes.
+
+    python scripts/simulate.py --players 1000000 --shop
+    python scripts/simulate.py --players 20000 --banner lelouch-up --json sim.json
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+
+from app import BOXES, PULL_COST
+from catalog import RARITY_ORDER, get_catalog
+from gacha import LOW_PRIORITIES, TICKET_REWARDS, get_banner
+
+NOT_LOW = 1 << 30
+
+
+class Rules:
+    """A compiled banner turned into lookup arrays (rarities by `labels` index)."""
+
+    def __init__(self, catalog, banner):
+        self.banner_id = banner.id
+        # the banner's rarities first, the ones it never draws still need an index
+        self.labels = list(banner.labels) + [r for r in RARITY_ORDER if r not in banner.labels]
+        weights = np.array([banner.rates.get(r, 0) for r in self.labels], dtype=float)
+        self.p = weights / weights.sum()
+
+        cards = catalog.cards
+        self.pos_id = np.array([c['id'] for c in cards], dtype=np.int64)
+        self.pos_reward = np.array([TICKET_REWARDS.get(c['rarity'], 0) for c in cards], dtype=np.int64)
+        self.pos_rarity = np.array([self.labels.index(c['rarity']) for c in cards], dtype=np.int64)
+        self.id_space = int(self.pos_id.max()) + 1
+
+        # same fallback as pick_cards_by_rarity: an empty rarity draws from the whole catalog
+        self.pools = []
+        for ri in range(len(self.labels)):
+            pool = np.flatnonzero(self.pos_rarity == ri)
+            self.pools.append(pool if pool.size else np.arange(len(cards)))
+        self.pool_len = np.array([p.size for p in self.pools], dtype=np.int64)
+        self.pool_start = np.concatenate([[0], np.cumsum(self.pool_len)[:-1]])
+        self.pool_flat = np.concatenate(self.pools)
+
+        # rate-up rarities draw through the banner's alias table, like pick_cards_by_rarity
+        self.rate_up = [(self.labels.index(r), np.array(pool, dtype=np.int64), table)
+                        for r, (pool, table) in banner.card_tables.items()]
+
+        self.low_rank = np.full(len(self.labels), NOT_LOW, dtype=np.int64)
+        for i, lp in enumerate(LOW_PRIORITIES):
+            self.low_rank[self.labels.index(lp)] = i
+
+        self.pity = [(self.labels.index(r), r, key, threshold) for r, key, threshold in banner.pity_rules]
+
+        # rarities that actually have cards, for completion tracking
+        self.tracked = [r for r in RARITY_ORDER if catalog.pool(r)]
+        self.tracked_ids = [np.unique(self.pos_id[self.pos_rarity == self.labels.index(r)]) for r in self.tracked]
+
+        # box purchase order for --shop: most expensive first
+        shop = sorted(BOXES, key=lambda r: -BOXES[r]['cost'])
+        self.shop = [(r, BOXES[r]['cost'], self.tracked_ids[self.tracked.index(r)])
+                     for r in shop if r in self.tracked]
+
+
+def place_guarantees(rules, R, F, rng):
+    """gacha.place_guarantees() for a whole batch, R (players x slots) in place.
+
+    F[i, k] says pity rule k fires for player i. Returns the mask of
+    overwritten slots.
+    """
+    rows_n, pull_size = R.shape
+    G = np.zeros((rows_n, pull_size), dtype=bool)
+    for k, (gl, _, _, _) in enumerate(rules.pity):
+        rows = np.flatnonzero(F[:, k] & ~(R == gl).any(axis=1))
+        if not rows.size:
+            continue
+        ranks = rules.low_rank[R[rows]]
+        col = ranks.argmin(axis=1)
+        none = np.flatnonzero(ranks[np.arange(rows.size), col] == NOT_LOW)
+        if none.size:
+            # fallback: a random slot no other guarantee depends on, i.e. not
+            # placed already and not the only copy of a guaranteed rarity
+            nr = rows[none]
+            free = ~G[nr]
+            for k2, (gl2, _, _, _) in enumerate(rules.pity):
+                hit = R[nr] == gl2
+                free &= ~(hit & (hit.sum(axis=1) == 1)[:, None] & F[nr, k2][:, None])
+            keys = rng.random(free.shape) + ~free * 2.0
+            col[none] = keys.argmin(axis=1)
+        R[rows, col] = gl
+        G[rows, col] = True
+    return G
+
+
+def simulate_batch(args):
+    players, seed, pull_size, max_pulls, shop, banner_id = args
+    catalog = get_catalog()
+    rules = Rules(catalog, get_banner(banner_id, catalog))
+    rng = np.random.default_rng(seed)
+    L = len(rules.labels)
+    T = len(rules.tracked)
+
+    owned = np.zeros((players, rules.id_space), dtype=bool)
+    pity = {key: np.zeros(players, dtype=np.int64) for _, _, key, _ in rules.pity}
+    tickets = np.zeros(players, dtype=np.int64)
+    earned = np.zeros(players, dtype=np.int64)
+    spent = np.zeros(players, dtype=np.int64)
+    pulls = np.zeros(players, dtype=np.int64)
+    fires = np.zeros((players, len(rules.pity)), dtype=np.int64)
+    complete_at = np.full((players, T), -1, dtype=np.int64)
+    active = np.ones(players, dtype=bool)
+
+    while active.any():
+        idx = np.flatnonzero(active)
+        n = idx.size
+        rows_all = np.arange(n)
+
+        # 1. base rarities, then pity guarantees exactly like place_guarantees()
+        R = rng.choice(L, size=(n, pull_size), p=rules.p)
+        # the guarantees that fit in the pull, per player (guarantees[:len(rarities)])
+        F = np.zeros((n, len(rules.pity)), dtype=bool)
+        considered = np.zeros(n, dtype=np.int64)
+        for k, (_, _, key, threshold) in enumerate(rules.pity):
+            act = pity[key][idx] >= threshold
+            F[:, k] = act & (considered < pull_size)
+            considered += act
+        fires[idx] += F
+        G = place_guarantees(rules, R, F, rng)
+
+        # 2. cards slot by slot, so duplicates inside one pull behave like the loop
+        own = owned[idx]
+        got = np.zeros((n, L), dtype=bool)
+        step_tickets = np.zeros(n, dtype=np.int64)
+        for j in range(pull_size):
+            r = R[:, j]
+            offset = (rng.random(n) * rules.pool_len[r]).astype(np.int64)
+            pos = rules.pool_flat[rules.pool_start[r] + offset]
+            for ri, pool, table in rules.rate_up:
+                rows = np.flatnonzero(r == ri)
+                if rows.size:
+                    pos[rows] = pool[table.sample_np(np, rng, rows.size)]
+
+            g_rows = np.flatnonzero(G[:, j])
+            for gl in np.unique(r[g_rows]):
+                rows = g_rows[r[g_rows] == gl]
+                pool = rules.pools[gl]
+                # random key per card, owned cards pushed to the back: argmin is a
+                # uniform unowned card, or a uniform card when everything is owned
+                keys = rng.random((rows.size, pool.size)) + own[rows[:, None], rules.pos_id[pool][None, :]] * 2.0
+                pos[rows] = pool[keys.argmin(axis=1)]
+
+            cid = rules.pos_id[pos]
+            dup = own[rows_all, cid]
+            step_tickets += np.where(dup, rules.pos_reward[pos], 0)
+            own[rows_all, cid] = True
+            got[rows_all, rules.pos_rarity[pos]] = True
+
+        # 3. pity counters, same as apply_pity()
+        for gl, _, key, threshold in rules.pity:
+            p = pity[key][idx]
+            pity[key][idx] = np.where(got[:, gl], 0, np.minimum(threshold, p + pull_size))
+
+        tix = tickets[idx] + step_tickets
+        earned[idx] += step_tickets
+        pulls[idx] += pull_size
+
+        # 4. optional shop policy
+        if shop:
+            bought = True
+            step_spent = np.zeros(n, dtype=np.int64)
+            while bought:
+                bought = False
+                for _, cost, ids in rules.shop:
+                    missing = ~own[:, ids]
+                    rows = np.flatnonzero((tix >= cost) & missing.any(axis=1))
+                    if not rows.size:
+                        continue
+                    keys = rng.random((rows.size, ids.size)) + (~missing[rows]) * 2.0
+                    own[rows, ids[keys.argmin(axis=1)]] = True
+                    tix[rows] -= cost
+                    step_spent[rows] += cost
+                    bought = True
+            spent[idx] += step_spent
+
+        tickets[idx] = tix
+        owned[idx] = own
+
+        # 5. completion per rarity
+        for t, ids in enumerate(rules.tracked_ids):
+            newly = own[:, ids].all(axis=1) & (complete_at[idx, t] < 0)
+            complete_at[idx[newly], t] = pulls[idx[newly]]
+        done = (complete_at[idx] >= 0).all(axis=1) | (pulls[idx] >= max_pulls)
+        active[idx[done]] = False
+
+    return {
+        'complete_at': complete_at,
+        'pulls': pulls,
+        'earned': earned,
+        'spent': spent,
+        'fires': fires,
+    }
+
+
+def run(players, pull_size=10, max_pulls=20000, shop=False, workers=None, batch=5000, seed=None,
+        banner=None):
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).spawn((players + batch - 1) // batch)
+    jobs = []
+    left = players
+    for s in seeds:
+        size = min(batch, left)
+        left -= size
+        jobs.append((size, s, pull_size, max_pulls, shop, banner))
+
+    start = time.perf_counter()
+    if workers > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+            parts = pool.map(simulate_batch, jobs)
+    else:
+        parts = [simulate_batch(job) for job in jobs]
+    elapsed = time.perf_counter() - start
+
+    merged = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    return merged, elapsed
+
+
+def _dist(values):
+    if not values.size:
+        return None
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        'mean': round(float(values.mean()), 1),
+        'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+        'max': int(values.max()),
+    }
+
+
+def summarize(merged, elapsed, rules):
+    players = merged['pulls'].size
+    total_pulls = int(merged['pulls'].sum())
+    report = {
+        'banner': rules.banner_id,
+        'players': players,
+        'total_pulls': total_pulls,
+        'elapsed_s': round(elapsed, 3),
+        'pulls_per_s': round(total_pulls / elapsed) if elapsed else None,
+        'pulls_to_complete': {},
+        'coins_spent': _dist(merged['pulls'] * PULL_COST),
+        'tickets_earned': _dist(merged['earned']),
+        'tickets_spent': _dist(merged['spent']),
+        'pity_fired': {},
+    }
+    for t, r in enumerate(rules.tracked):
+        col = merged['complete_at'][:, t]
+        report['pulls_to_complete'][r] = dict(
+            completed=round(float((col >= 0).mean()), 4),
+            **(_dist(col[col >= 0]) or {}),
+        )
+    for k, (_, r, _, threshold) in enumerate(rules.pity):
+        fires = merged['fires'][:, k]
+        report['pity_fired'][r] = {
+            'threshold': threshold,
+            'per_player_mean': round(float(fires.mean()), 3),
+            'per_1000_pulls': round(1000.0 * fires.sum() / total_pulls, 3) if total_pulls else 0,
+        }
+    return report
+
+
+def print_report(report):
+    print('banner: %(banner)s  players: %(players)d  pulls: %(total_pulls)d  time: %(elapsed_s).2fs  '
+          'throughput: %(pulls_per_s)s pulls/s' % report)
+    print()
+    print('pulls to complete   done%     mean      p50      p90      p99')
+    for r, d in report['pulls_to_complete'].items():
+        if 'mean' not in d:
+            print('  %-4s %18.1f%%        -' % (r, 100 * d['completed']))
+            continue
+        print('  %-4s %18.1f%% %8.0f %8.0f %8.0f %8.0f' % (
+            r, 100 * d['completed'], d['mean'], d['p50'], d['p90'], d['p99']))
+    print()
+    for name in ('coins_spent', 'tickets_earned', 'tickets_spent'):
+        d = report[name]
+        print('%-15s mean %10.0f  p50 %10.0f  p90 %10.0f  p99 %10.0f' % (
+            name, d['mean'], d['p50'], d['p90'], d['p99']))
+    print()
+    print('pity fired        per player   per 1000 pulls')
+    for r, d in report['pity_fired'].items():
+        print('  %-4s (%3d)  %12.3f %16.3f' % (r, d['threshold'], d['per_player_mean'], d['per_1000_pulls']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--banner', default=None, help='banner id from banners.json (default: the default banner)')
+    parser.add_argument('--pull-size', type=int, default=10)
+    parser.add_argument('--max-pulls', type=int, default=20000)
+    parser.add_argument('--shop', action='store_true', help='spend tickets on boxes for missing cards')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: all cores)')
+    parser.add_argument('--batch', type=int, default=5000, help='players per vectorised batch')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    catalog = get_catalog()
+    banner = get_banner(args.banner, catalog)
+    if banner is None:
+        parser.error('unknown banner %r' % args.banner)
+    merged, elapsed = run(args.players, args.pull_size, args.max_pulls, args.shop,
+                          args.workers, args.batch, args.seed, banner.id)
+    report = summarize(merged, elapsed, Rules(catalog, banner))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
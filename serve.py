@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Preforked production server.
+
+The parent imports app.py, loads the card catalog, renders the deck
+fragments and compiles the templates once, then calls gc.freeze() and
+forks the workers. Everything loaded so far stays in copy-on-write pages
+shared by all workers (freezing keeps the collector from touching those
+objects and dirtying the pages). Each worker accepts on the shared
+listening socket and exits after --max-requests requests; the parent
+forks a fresh one in its place.
+
+    python serve.py                                 # 0.0.0.0:8000, one worker per core
+    python serve.py --bind 127.0.0.1:8080 --workers 4 --max-requests 5000
+    python serve.py --stats-interval 60             # memory report every minute
+
+With more than one worker the cookie revision check defaults to
+NEXORIA_REPLAY=sqlite:revisions.db, shared by all of them.
+
+Startup time and per-worker memory (RSS, PSS and shared, from /proc on
+Linux) are printed once the workers are up. POSIX only; elsewhere use
+`python app.py`.
+"""
+import time
+_T0 = time.perf_counter()
+
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+
+MB = 1024.0
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(':')
+    return (host or '0.0.0.0').strip('[]'), int(port)
+
+
+def default_workers():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def read_memory(pid):
+    """{'rss', 'pss', 'shared'} in kB for pid, or None where /proc is missing."""
+    fields = {}
+    try:
+        with open('/proc/%d/smaps_rollup' % pid, 'r') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if rest.strip().endswith('kB'):
+                    fields[key] = int(rest.split()[0])
+    except (OSError, ValueError):
+        return None
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+    }
+
+
+def preload():
+    """Import the app and warm everything workers would otherwise build."""
+    from app import app, deck_fragments, limiter, revisions, stats, store
+    from catalog import get_catalog
+
+    with app.app_context():
+        deck_fragments(get_catalog())
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+
+    # a connection must never cross fork(), workers open their own
+    for owner in (store, limiter, stats, revisions):
+        close = getattr(owner, 'close', None)
+        if close is not None:
+            close()
+
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+# ------------------------------------------------------
+# worker
+# ------------------------------------------------------
+
+def run_worker(app, sock, host, max_requests):
+    from werkzeug.serving import make_server
+    from app import ledger, stats
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    server = make_server(host, sock.getsockname()[1], app, fd=sock.fileno())
+    # wake up now and then to notice SIGTERM; idle wakeups aren't requests
+    server.timeout = 0.5
+    idle = [False]
+    server.handle_timeout = lambda: idle.__setitem__(0, True)
+
+    # spread recycling so workers don't all restart at once
+    limit = max_requests + random.randint(0, max_requests // 10) if max_requests else 0
+    handled = 0
+    try:
+        while not stopping and (not limit or handled < limit):
+            idle[0] = False
+            server.handle_request()
+            handled += not idle[0]
+    finally:
+        # os._exit() skips atexit, so flush the ledger and stats by hand
+        for owner in (ledger, stats):
+            if owner is not None:
+                owner.close()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(0)
+
+
+# ------------------------------------------------------
+# parent
+# ------------------------------------------------------
+
+class Arbiter:
+    def __init__(self, app, sock, host, workers, max_requests):
+        self.app = app
+        self.sock = sock
+        self.host = host
+        self.size = workers
+        self.max_requests = max_requests
+        self.workers = {}
+        self.recycled = 0
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.app, self.sock, self.host, self.max_requests)
+            finally:
+                os._exit(1)
+        self.workers[pid] = time.time()
+        return pid
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if self.workers.pop(pid, None) is not None and not self.stopping:
+                if os.waitstatus_to_exitcode(status) == 0:
+                    self.recycled += 1
+                else:
+                    print('worker %d died (status %d)' % (pid, status), file=sys.stderr)
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def report(self):
+        parent = read_memory(os.getpid())
+        if parent is None:
+            print('memory report needs /proc (Linux)')
+            return
+        print('%-8s %10s %10s %10s' % ('pid', 'rss MB', 'pss MB', 'shared MB'))
+        print('%-8s %10.1f %10.1f %10.1f' % (
+            'parent', parent['rss'] / MB, parent['pss'] / MB, parent['shared'] / MB))
+        rss = pss = 0
+        for pid in sorted(self.workers):
+            mem = read_memory(pid)
+            if mem is None:
+                continue
+            rss += mem['rss']
+            pss += mem['pss']
+            print('%-8d %10.1f %10.1f %10.1f' % (pid, mem['rss'] / MB, mem['pss'] / MB, mem['shared'] / MB))
+        # rss counts shared pages in every worker, pss splits them between sharers
+        print('workers: %d  rss sum %.1f MB  pss sum %.1f MB  shared saving ~%.1f MB  recycled: %d' % (
+            len(self.workers), rss / MB, pss / MB, (rss - pss) / MB, self.recycled))
+        sys.stdout.flush()
+
+    def run(self, stats_interval=0):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, lambda *_: self.report())
+
+        for _ in range(self.size):
+            self.spawn()
+        print('%d workers up in %.2fs' % (self.size, time.perf_counter() - _T0))
+        sys.stdout.flush()
+
+        report_at = time.time() + 1.0
+        while not self.stopping:
+            self.reap()
+            while not self.stopping and len(self.workers) < self.size:
+                self.spawn()
+            if report_at and time.time() >= report_at:
+                self.report()
+                report_at = time.time() + stats_interval if stats_interval else None
+            time.sleep(0.2)
+
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + 10
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in self.workers:
+            os.kill(pid, signal.SIGKILL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bind', default=os.environ.get('NEXORIA_BIND', '0.0.0.0:8000'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('NEXORIA_WORKERS', 0)),
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--max-requests', type=int, default=10000,
+                        help='recycle a worker after this many requests (0: never)')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='seconds between memory reports (default: only at startup, or on SIGUSR1)')
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, 'fork'):
+        print('serve.py needs fork(); use python app.py on this platform', file=sys.stderr)
+        return 2
+
+    host, port = parse_bind(args.bind)
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    workers = args.workers or default_workers()
+    if workers > 1:
+        # each worker would keep its own cookie revisions: an outdated cookie
+        # could still spend on a worker that never saw the newer one
+        replay = os.environ.setdefault('NEXORIA_REPLAY', 'sqlite:revisions.db')
+        if replay.partition(':')[0] == 'memory':
+            print('warning: NEXORIA_REPLAY=memory with %d workers, outdated cookies are only '
+                  'caught by the worker that issued the newer one; use sqlite:revisions.db' % workers,
+                  file=sys.stderr)
+
+    app = preload()
+    print('preloaded in %.2fs, listening on %s:%d' % (time.perf_counter() - _T0, host, sock.getsockname()[1]))
+
+    arbiter = Arbiter(app, sock, host, workers, args.max_requests)
+    arbiter.run(args.stats_interval)
+    sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,7 +26,7 @@ document.addEventListener('DOMContentLoaded', ()=>{
       'UR': 'https://kageherostudio.com/assets/filemanager/source/event/Class-UR%20Gear%20Box.png'
     }
 
-    return map[rarity] || '/static/public/box/a-box.png'
+    return map[rarity] || document.body.dataset.boxFallback || '/static/public/box/a-box.png'
   }
 
 
@@ -85,6 +85,71 @@ document.addEventListener('DOMContentLoaded', ()=>{
     // fungsi dibiarkan agar tidak merusak fitur lama
   }
 
+  /* =========================
+     CARD CATALOG (CACHED IN localStorage)
+  ========================= */
+  // /pull and /buy answer with [id, duplicate, tickets_awarded]; the card
+  // records come from /api/catalog, fetched again only when its version changes
+  const CATALOG_KEY = 'nexoria-catalog'
+  let catalogCache = null
+
+  async function getCatalog(version){
+    if(!catalogCache){
+      try{ catalogCache = JSON.parse(localStorage.getItem(CATALOG_KEY)) }catch(e){ catalogCache = null }
+    }
+    if(catalogCache && (!version || catalogCache.version === version)) return catalogCache
+
+    const res = await fetch('/api/catalog')
+    const j = await res.json()
+    const cards = {}
+    j.cards.forEach(c=>{ cards[c.id] = c })
+    catalogCache = {version: j.version, cards}
+    try{ localStorage.setItem(CATALOG_KEY, JSON.stringify(catalogCache)) }catch(e){}
+    return catalogCache
+  }
+
+  async function expandCards(j, rows){
+    if(!j.compact) return rows
+    const catalog = await getCatalog(j.catalog_version)
+    return rows.map(([id, duplicate, tickets_awarded])=>(
+      {...(catalog.cards[id] || {id, name:'#'+id, rarity:'?', desc:''}), duplicate, tickets_awarded}
+    ))
+  }
+
+  /* =========================
+     SPEND REQUESTS (IDEMPOTENT)
+  ========================= */
+  // one Idempotency-Key per click: if the request is sent again, the server
+  // answers from its cache instead of spending twice
+  function newKey(){
+    if(window.crypto && crypto.randomUUID) return crypto.randomUUID()
+    return Date.now().toString(36) + Math.random().toString(36).slice(2)
+  }
+
+  async function spend(url, body){
+    const key = newKey()
+    let res
+    for(let attempt = 0; attempt < 2; attempt++){
+      try{
+        res = await fetch(url,{
+          method:'POST',
+          headers:{'Content-Type':'application/json', 'Idempotency-Key':key},
+          body:JSON.stringify(body)
+        })
+      }catch(e){
+        // lost connection: it may have gone through, the key makes the retry safe
+        if(attempt) throw e
+        continue
+      }
+      // 409: another tab spent first and its cookie is ours now, try once more
+      if(res.status !== 409) break
+    }
+    return res
+  }
+
+  // warm the cache on pages that pull or buy
+  if(pull10 || buyBtns.length) getCatalog().catch(()=>{})
+
   /* =========================
      MODAL HELPER
   ========================= */
@@ -121,6 +186,104 @@ document.addEventListener('DOMContentLoaded', ()=>{
     document.body.appendChild(overlay)
   }
 
+  /* =========================
+     DECK (LAZY PAGES FROM /api/deck)
+  ========================= */
+  const deckGroups = document.getElementById('deckGroups')
+  const deckMore = document.getElementById('deckMore')
+
+  function deckCard(card){
+    // same markup as templates/_deck_card.html
+    const wrapper = document.createElement('div')
+    wrapper.className = 'card'
+    const rarity = card.rarity.toLowerCase()
+
+    if(!card.owned){
+      wrapper.innerHTML = `<div class="card-back rarity-${rarity}"><div class="back-content">?</div></div>`
+      return wrapper
+    }
+
+    const front = document.createElement('div')
+    front.className = 'card-front rarity-' + rarity
+    if(card.image){
+      const img = document.createElement('img')
+      img.className = 'card-image'
+      img.alt = card.name || ''
+      img.loading = 'lazy'
+      img.src = card.thumb || card.image
+      if(card.thumb_webp){
+        const picture = document.createElement('picture')
+        const source = document.createElement('source')
+        source.type = 'image/webp'
+        source.srcset = card.thumb_webp
+        picture.append(source, img)
+        front.appendChild(picture)
+      } else {
+        front.appendChild(img)
+      }
+    }
+    const overlay = document.createElement('div')
+    overlay.className = 'card-overlay'
+    for(const [cls, text] of [['card-name', card.name], ['card-rarity', card.rarity], ['card-desc', card.desc]]){
+      const el = document.createElement('div')
+      el.className = cls
+      el.textContent = text || ''
+      overlay.appendChild(el)
+    }
+    front.appendChild(overlay)
+    wrapper.appendChild(front)
+    return wrapper
+  }
+
+  if(deckGroups && deckMore && deckGroups.dataset.nextCursor){
+    let cursor = deckGroups.dataset.nextCursor
+    let loading = false
+
+    async function loadDeckPage(){
+      if(loading || !cursor) return
+      loading = true
+      let j
+      try {
+        const res = await fetch('/api/deck?limit=60&cursor=' + encodeURIComponent(cursor))
+        if(res.status === 409){
+          // catalog changed under us, start over
+          location.reload()
+          return
+        }
+        j = await res.json().catch(()=>({ok:false}))
+      } finally {
+        // also after a network error, so the next scroll can retry
+        loading = false
+      }
+      if(!j.ok){ cursor = null; return }
+
+      j.cards.forEach(card=>{
+        const group = deckGroups.querySelector(`.group-cards[data-rarity="${card.rarity}"]`)
+        if(group) group.appendChild(deckCard(card))
+      })
+      cursor = j.next_cursor
+      if(!cursor){
+        observer.disconnect()
+        deckMore.remove()
+      } else if(deckMore.getBoundingClientRect().top < window.innerHeight + 600){
+        loadDeckPage()
+      }
+    }
+
+    const observer = new IntersectionObserver(entries=>{
+      if(entries.some(e=>e.isIntersecting)) loadDeckPage()
+    }, {rootMargin: '600px'})
+    observer.observe(deckMore)
+  }
+
+  function tooFast(seconds){
+    showModal({
+      title: 'Terlalu cepat',
+      text: `Tunggu ${seconds || 1} detik lalu coba lagi.`,
+      actions: [{label:'OK', class:'btn-secondary'}]
+    })
+  }
+
   /* =========================
      RESET (CUSTOM MODAL)
   ========================= */
@@ -161,6 +324,14 @@ document.addEventListener('DOMContentLoaded', ()=>{
 })
 
 
+  // the banner picker is only rendered when there is more than one banner
+  function pullBody(count){
+    const body = {count, compact:true}
+    const banner = document.getElementById('bannerSelect')
+    if(banner) body.banner = banner.value
+    return body
+  }
+
   async function doPull(count){
     if(pull10) pull10.disabled = true
 
@@ -170,13 +341,17 @@ document.addEventListener('DOMContentLoaded', ()=>{
     resultArea.classList.remove('single')
     resultArea.innerHTML = 'Pulling...'
 
-    const res = await fetch('/pull',{
-      method:'POST',
-      headers:{'Content-Type':'application/json'},
-      body:JSON.stringify({count})
-    })
+    const res = await spend('/pull', pullBody(count))
 
     const j = await res.json().catch(()=>({ok:false,error:'server'}))
+    if(j.ok) j.results = await expandCards(j, j.results)
+
+    if(res.status === 429){
+      tooFast(j.retry_after)
+      resultArea.innerHTML = ''
+      setTimeout(()=>{ if(pull10) pull10.disabled = false }, (j.retry_after || 1) * 1000)
+      return
+    }
 
     if(!j.ok){
       if(j.error && j.error.toLowerCase().includes('not enough coin')){
@@ -282,13 +457,15 @@ document.addEventListener('DOMContentLoaded', ()=>{
       const rarity = btn.dataset.rarity
       shopResult.innerHTML = ''
 
-      const res = await fetch('/buy',{
-        method:'POST',
-        headers:{'Content-Type':'application/json'},
-        body:JSON.stringify({rarity})
-      })
+      const res = await spend('/buy', {rarity, compact:true})
 
       const j = await res.json()
+      if(j.ok && j.card) j.card = (await expandCards(j, [j.card]))[0]
+
+      if(res.status === 429){
+        tooFast(j.retry_after)
+        return
+      }
 
       if(!j.ok){
   if(j.error){
@@ -347,46 +524,133 @@ document.addEventListener('DOMContentLoaded', ()=>{
     })
   })
 
-  function showShopCard(card){
+  /* =========================
+     SHOP: SEVERAL BOXES AT ONCE
+  ========================= */
+  const buyQtys = document.querySelectorAll('.buyQty')
+  const buyCart = document.getElementById('buyCart')
+  const cartTotal = document.getElementById('cartTotal')
+
+  function cartOrders(){
+    const orders = []
+    buyQtys.forEach(input=>{
+      const quantity = parseInt(input.value || '0', 10)
+      if(quantity > 0) orders.push({rarity: input.dataset.rarity, quantity})
+    })
+    return orders
+  }
+
+  function updateCart(){
+    let total = 0
+    buyQtys.forEach(input=>{
+      total += (parseInt(input.value || '0', 10) || 0) * parseInt(input.dataset.cost, 10)
+    })
+    if(cartTotal) cartTotal.textContent = total
+    if(buyCart) buyCart.disabled = total <= 0
+  }
+
+  buyQtys.forEach(input=>input.addEventListener('input', updateCart))
+
+  if(buyCart){
+    buyCart.addEventListener('click', async ()=>{
+      const orders = cartOrders()
+      if(!orders.length) return
+      buyCart.disabled = true
+      shopResult.innerHTML = ''
+
+      try{
+        const res = await spend('/buy', {orders, compact:true})
+        const j = await res.json()
+
+        if(res.status === 429){
+          tooFast(j.retry_after)
+          return
+        }
+        if(!j.ok){
+          const error = (j.error || '').toLowerCase()
+          if(error.includes('ticket')){
+            showModal({
+              title:'Tiket Tidak Cukup',
+              text:`Pesanan ini butuh ${j.cost} tiket.`,
+              actions:[{label:'OK', class:'btn-secondary'}]
+            })
+          }
+          else if(error.includes('no unowned')){
+            showModal({
+              title:'Box Kosong',
+              text:'Semua kartu di box ini sudah kamu miliki.',
+              actions:[{label:'OK', class:'btn-secondary'}]
+            })
+          }
+          else{
+            showModal({title:'Gagal', text: j.error, actions:[{label:'OK'}]})
+          }
+          return
+        }
+
+        updateTickets(j.tickets)
+        buyQtys.forEach(input=>{ input.value = 0 })
+        showShopCards(await expandCards(j, j.cards))
+
+        // a box that ran out was only partly filled
+        const short = j.orders.filter(o=>o.bought < o.requested)
+        if(short.length){
+          showModal({
+            title:'Sebagian Terbeli',
+            text: short.map(o=>`${o.rarity}: ${o.bought}/${o.requested}`).join(', ') +
+              ' — sisa kartu di box sudah kamu miliki, tiket hanya dipotong untuk yang terbeli.',
+            actions:[{label:'OK', class:'btn-secondary'}]
+          })
+        }
+      }finally{
+        updateCart()
+      }
+    })
+  }
+
+  function showShopCards(cards){
     shopResult.innerHTML = ''
 
-    const wrapper = document.createElement('div')
-    wrapper.className = 'card flip-card rarity-'+card.rarity.toLowerCase()
+    cards.forEach((card, i)=>{
+      const wrapper = document.createElement('div')
+      wrapper.className = 'card flip-card rarity-'+card.rarity.toLowerCase()
 
-    const inner = document.createElement('div')
-    inner.className = 'card-inner'
+      const inner = document.createElement('div')
+      inner.className = 'card-inner'
 
-    const front = document.createElement('div')
-    front.className = 'card-front rarity-'+card.rarity.toLowerCase()
+      const front = document.createElement('div')
+      front.className = 'card-front rarity-'+card.rarity.toLowerCase()
 
-    if(card.image){
-      const img = document.createElement('img')
-      img.className = 'card-image'
-      img.src = card.image.startsWith('http')
-  ? card.image
-  : '/static/' + card.image;
+      if(card.image){
+        const img = document.createElement('img')
+        img.className = 'card-image'
+        img.src = card.image.startsWith('http')
+    ? card.image
+    : '/static/' + card.image;
 
-      front.appendChild(img)
-    }
+        front.appendChild(img)
+      }
 
-    const overlay = document.createElement('div')
-    overlay.className = 'card-overlay'
-    overlay.innerHTML = `
-      <div class="card-name">${card.name}</div>
-      <div class="card-rarity">${card.rarity}</div>
-      <div class="card-desc">${card.desc}</div>
-    `
-    front.appendChild(overlay)
+      const overlay = document.createElement('div')
+      overlay.className = 'card-overlay'
+      overlay.innerHTML = `
+        <div class="card-name">${card.name}</div>
+        <div class="card-rarity">${card.rarity}</div>
+        <div class="card-desc">${card.desc}</div>
+      `
+      front.appendChild(overlay)
 
-    const back = document.createElement('div')
-    back.className = 'card-back card-back-result'
-    back.innerHTML = `<div class="back-logo">NEXORIA</div><div class="ribbon">${card.rarity}</div>`
+      const back = document.createElement('div')
+      back.className = 'card-back card-back-result'
+      back.innerHTML = `<div class="back-logo">NEXORIA</div><div class="ribbon">${card.rarity}</div>`
 
-    inner.append(back, front)
-    wrapper.appendChild(inner)
-    shopResult.appendChild(wrapper)
+      inner.append(back, front)
+      wrapper.appendChild(inner)
+      shopResult.appendChild(wrapper)
 
-    setTimeout(()=>wrapper.classList.add('flipped'),600)
+      // big orders flip in one go instead of one by one
+      setTimeout(()=>wrapper.classList.add('flipped'), Math.min(i, 20)*100+600)
+    })
   }
 
   function removeOverlayAndCentered(){
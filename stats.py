@@ -0,0 +1,308 @@
+import atexit
+import os
+import sqlite3
+import sys
+import threading
+
+# ======================================================
+# GLOBAL COLLECTION STATS (INCREMENTAL AGGREGATE)
+# ======================================================
+#
+# NEXORIA_STATS_DB=<path> keeps a few small SQLite tables that always hold
+# the current totals across every player:
+#
+#   card_owners(card_id, owners)         players owning each card
+#   rarity_stats(rarity, pulls, completed)
+#                                        cards pulled per rarity, players
+#                                        owning every card of the rarity
+#   totals(key, value)                   'players' with a non-empty collection
+#
+# Requests never touch the database. They turn the before/after owned
+# bitsets into deltas which are summed in memory and written by a
+# background thread once per FLUSH_INTERVAL, one transaction per flush. A
+# flush that fails (database locked past the timeout) is reported on stderr
+# and its deltas go back in memory for the next one.
+# /api/stats only reads the tables. scripts/rebuild_stats.py recomputes
+# them from the stored users when they drift (cookie users can replay an
+# old cookie, and unflushed deltas die with the process).
+
+FLUSH_INTERVAL = 1.0
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS card_owners (
+        card_id INTEGER PRIMARY KEY,
+        owners INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rarity_stats (
+        rarity TEXT PRIMARY KEY,
+        pulls INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS totals (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+'''
+
+ADD_OWNERS = '''
+    INSERT INTO card_owners (card_id, owners) VALUES (?, ?)
+    ON CONFLICT(card_id) DO UPDATE SET owners = owners + excluded.owners
+'''
+ADD_RARITY = '''
+    INSERT INTO rarity_stats (rarity, pulls, completed) VALUES (?, ?, ?)
+    ON CONFLICT(rarity) DO UPDATE SET
+        pulls = pulls + excluded.pulls,
+        completed = completed + excluded.completed
+'''
+ADD_TOTAL = '''
+    INSERT INTO totals (key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = value + excluded.value
+'''
+
+
+def connect(path, timeout=10.0):
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def ownership_delta(catalog, before, after):
+    """(owner deltas by card id, completed deltas by rarity, players delta)."""
+    owners = {}
+    for bits, sign in ((after & ~before, 1), (before & ~after, -1)):
+        while bits:
+            low = bits & -bits
+            owners[low.bit_length() - 1] = sign
+            bits ^= low
+    completed = {}
+    for rarity, mask in catalog.rarity_masks.items():
+        if not mask:
+            continue
+        was = before & mask == mask
+        now = after & mask == mask
+        if was != now:
+            completed[rarity] = 1 if now else -1
+    players = (after != 0) - (before != 0)
+    return owners, completed, players
+
+
+class Stats:
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        conn = connect(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+        self._reset()
+        atexit.register(self.close)
+
+    def _reset(self):
+        # also after fork: the parent's thread and connections stay behind
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closing = False
+        self._local = threading.local()
+        self._clear()
+
+    def _clear(self):
+        self._owners = {}
+        self._pulls = {}
+        self._completed = {}
+        self._players = 0
+
+    def _pending(self):
+        return self._owners or self._pulls or self._completed or self._players
+
+    # --------------------------------------------------
+    # hot path
+    # --------------------------------------------------
+
+    def record(self, catalog, before, after, pulls=None):
+        """Owned bitsets before/after a request, plus {rarity: cards pulled}."""
+        if before == after and not pulls:
+            return
+        if self._pid != os.getpid():
+            self._reset()
+        owners, completed, players = ownership_delta(catalog, before, after)
+        with self._lock:
+            self._add(owners, pulls or {}, completed, players)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stats-writer', daemon=True)
+                self._thread.start()
+
+    def _add(self, owners, pulls, completed, players):
+        # caller holds self._lock
+        for card_id, d in owners.items():
+            self._owners[card_id] = self._owners.get(card_id, 0) + d
+        for rarity, d in completed.items():
+            self._completed[rarity] = self._completed.get(rarity, 0) + d
+        for rarity, n in pulls.items():
+            self._pulls[rarity] = self._pulls.get(rarity, 0) + n
+        self._players += players
+
+    # --------------------------------------------------
+    # writer thread
+    # --------------------------------------------------
+
+    def _run(self):
+        conn = None
+        try:
+            while not self._closing:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                conn = self._try_flush(conn)
+            conn = self._try_flush(conn)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _try_flush(self, conn):
+        # never raises: an exception would end the writer thread for good
+        try:
+            if conn is None:
+                conn = connect(self.path)
+            self._flush(conn)
+        except Exception as e:
+            print('stats: flush failed (%s), kept for the next one' % e, file=sys.stderr)
+        return conn
+
+    def _flush(self, conn):
+        with self._lock:
+            if not self._pending():
+                return
+            owners, pulls, completed, players = self._owners, self._pulls, self._completed, self._players
+            self._clear()
+        rarities = set(pulls) | set(completed)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(ADD_OWNERS, [(k, v) for k, v in owners.items() if v])
+            conn.executemany(ADD_RARITY, [(r, pulls.get(r, 0), completed.get(r, 0)) for r in rarities])
+            if players:
+                conn.execute(ADD_TOTAL, ('players', players))
+            conn.execute('COMMIT')
+        except BaseException:
+            # a failed COMMIT leaves the transaction open
+            if conn.in_transaction:
+                try:
+                    conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+            # put the batch back, the next flush writes it
+            with self._lock:
+                self._add(owners, pulls, completed, players)
+            raise
+
+    def flush(self):
+        """Write pending deltas now (tests, shutdown)."""
+        if self._pid != os.getpid():
+            return
+        conn = connect(self.path)
+        try:
+            self._flush(conn)
+        finally:
+            conn.close()
+
+    def close(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            self._closing = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+            self._closing = False
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    # --------------------------------------------------
+    # read side
+    # --------------------------------------------------
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._pid != os.getpid():
+            if self._pid != os.getpid():
+                self._reset()
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def snapshot(self, catalog):
+        conn = self._reader()
+        owners = dict(conn.execute('SELECT card_id, owners FROM card_owners'))
+        rarity_rows = {r: (p, c) for r, p, c in conn.execute('SELECT rarity, pulls, completed FROM rarity_stats')}
+        row = conn.execute("SELECT value FROM totals WHERE key = 'players'").fetchone()
+        players = row[0] if row else 0
+
+        rarities = {}
+        for rarity, ids in catalog.rarity_ids.items():
+            if not ids:
+                continue
+            pulls, completed = rarity_rows.get(rarity, (0, 0))
+            owned = sum(owners.get(i, 0) for i in ids)
+            rarities[rarity] = {
+                'cards': len(ids),
+                'pulls': pulls,
+                'completed_players': completed,
+                # average share of this rarity a player owns
+                'completion': round(owned / (players * len(ids)), 4) if players else 0.0,
+            }
+        return {
+            'players': players,
+            'total_pulls': sum(p for p, _ in rarity_rows.values()),
+            'rarities': rarities,
+            'owners': {str(i): owners.get(i, 0) for i in catalog.by_id},
+        }
+
+
+def open_stats(path, base_dir='.'):
+    if not path:
+        return None
+    return Stats(os.path.join(base_dir, path))
+
+
+def rebuild(path, catalog, owned_bitsets, pulls=None):
+    """Replace the aggregate with totals over `owned_bitsets` (any iterable).
+
+    Memory stays bounded by the catalog size, not the number of players.
+    Pull counts are replaced only when `pulls` is given, otherwise kept.
+    """
+    owners = dict.fromkeys(catalog.by_id, 0)
+    completed = dict.fromkeys(catalog.rarity_masks, 0)
+    masks = [(r, m) for r, m in catalog.rarity_masks.items() if m]
+    players = 0
+    for bits in owned_bitsets:
+        if not bits:
+            continue
+        players += 1
+        for card_id in owners:
+            if (bits >> card_id) & 1:
+                owners[card_id] += 1
+        for rarity, mask in masks:
+            if bits & mask == mask:
+                completed[rarity] += 1
+
+    conn = connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM card_owners')
+            conn.executemany('INSERT INTO card_owners (card_id, owners) VALUES (?, ?)', owners.items())
+            if pulls is not None:
+                conn.execute('DELETE FROM rarity_stats')
+            conn.execute('UPDATE rarity_stats SET completed = 0')
+            conn.executemany(ADD_RARITY, [
+                (r, (pulls or {}).get(r, 0), completed.get(r, 0))
+                for r in set(completed) | set(pulls or {})
+            ])
+            conn.execute("INSERT OR REPLACE INTO totals (key, value) VALUES ('players', ?)", (players,))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return players
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager, nullcontext
+
+from collection import OwnedCards
+
+# ======================================================
+# USER STORES
+# ======================================================
+#
+# NEXORIA_STORE picks where user state lives:
+#   cookie              everything in the signed cookie (default, vercel safe)
+#   json:<dir>          one JSON file per uid, like the old user_data/ folder
+#   sqlite:<path>       one row per uid in a WAL-mode SQLite database
+#
+# Server-side stores only keep the uid in the cookie.
+
+USER_KEYS = ('coins', 'tickets', 'pity_sss', 'pity_ss', 'pity_ur')
+
+
+def normalize_user(data):
+    user = dict(data)
+    user.setdefault('coins', 0)
+    user.setdefault('tickets', 0)
+    # backfill missing keys for older users
+    user.setdefault('pity_sss', 0)
+    user.setdefault('pity_ss', 0)
+    user.setdefault('pity_ur', 0)
+    # cookie state revision, see replay.py
+    user.setdefault('rev', 0)
+    user['owned'] = OwnedCards.load(user.get('owned'))
+    return user
+
+
+class CookieStore:
+    server_side = False
+
+    def atomic(self, uid):
+        # the cookie round trip is the only "transaction" we get
+        return nullcontext()
+
+
+class JsonFileStore:
+    server_side = True
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._locks = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+
+    def _path(self, uid):
+        # uid comes from a cookie, never let it pick a path
+        if not uid or not uid.isalnum():
+            return None
+        return os.path.join(self.directory, uid + '.json')
+
+    def load(self, uid):
+        path = self._path(uid)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return normalize_user(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save(self, uid, user):
+        path = self._path(uid)
+        if path is None:
+            raise ValueError('invalid uid')
+        data = {key: user.get(key, 0) for key in USER_KEYS}
+        data['owned'] = list(user['owned'])
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+    @contextmanager
+    def atomic(self, uid):
+        # per-uid lock, good enough for a single process
+        with self._locks_guard:
+            lock = self._locks.get(uid)
+            if lock is None:
+                lock = self._locks[uid] = threading.Lock()
+        with lock:
+            yield
+
+
+class SqliteStore:
+    server_side = True
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS users (
+            uid TEXT PRIMARY KEY,
+            coins INTEGER NOT NULL,
+            tickets INTEGER NOT NULL,
+            pity_sss INTEGER NOT NULL,
+            pity_ss INTEGER NOT NULL,
+            pity_ur INTEGER NOT NULL,
+            owned BLOB NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    '''
+    # kept as constants so sqlite's statement cache reuses the prepared form
+    SELECT = 'SELECT coins, tickets, pity_sss, pity_ss, pity_ur, owned FROM users WHERE uid = ?'
+    UPSERT = '''
+        INSERT INTO users (uid, coins, tickets, pity_sss, pity_ss, pity_ur, owned, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(uid) DO UPDATE SET
+            coins = excluded.coins,
+            tickets = excluded.tickets,
+            pity_sss = excluded.pity_sss,
+            pity_ss = excluded.pity_ss,
+            pity_ur = excluded.pity_ur,
+            owned = excluded.owned,
+            updated_at = excluded.updated_at
+    '''
+
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3  # only the sqlite store needs it
+            # one connection per thread, autocommit unless atomic() opens a transaction
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout,
+                isolation_level=None, check_same_thread=False,
+                cached_statements=64,
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        # closes this thread's connection; the next call reconnects
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def load(self, uid):
+        if not uid:
+            return None
+        row = self._connect().execute(self.SELECT, (uid,)).fetchone()
+        if row is None:
+            return None
+        user = dict(zip(USER_KEYS, row[:5]))
+        # the cookie revision only matters for cookie state, see replay.py
+        user['rev'] = 0
+        user['owned'] = OwnedCards(int.from_bytes(row[5], 'little'))
+        return user
+
+    def save(self, uid, user):
+        self._connect().execute(self.UPSERT, (
+            uid,
+            user['coins'], user['tickets'],
+            user.get('pity_sss', 0), user.get('pity_ss', 0), user.get('pity_ur', 0),
+            user['owned'].to_bytes(),
+            time.time(),
+        ))
+
+    @contextmanager
+    def atomic(self, uid):
+        """Read-modify-write of one user as a single write transaction.
+
+        BEGIN IMMEDIATE takes the write lock up front, so two concurrent
+        /pull requests for the same uid can't both read the old balance.
+        """
+        conn = self._connect()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def open_store(spec, base_dir='.'):
+    kind, _, arg = (spec or 'cookie').partition(':')
+    if kind == 'cookie':
+        return CookieStore()
+    if kind == 'json':
+        return JsonFileStore(os.path.join(base_dir, arg or 'user_data'))
+    if kind == 'sqlite':
+        return SqliteStore(os.path.join(base_dir, arg or 'nexoria.db'))
+    raise ValueError('unknown NEXORIA_STORE %r' % spec)
@@ -0,0 +1,60 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+
+import app as app_mod
+
+
+def use_dist(monkeypatch, tmp_path, manifest):
+    dist = tmp_path / 'dist'
+    dist.mkdir()
+    (dist / 'manifest.json').write_text(json.dumps(manifest))
+    monkeypatch.setattr(app_mod, 'DIST_DIR', str(dist))
+    monkeypatch.setattr(app_mod, 'MANIFEST_FILE', str(dist / 'manifest.json'))
+    monkeypatch.setattr(app_mod, '_manifest', (None, {}))
+    return dist
+
+
+def test_asset_url_falls_back_without_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_mod, 'MANIFEST_FILE', str(tmp_path / 'missing.json'))
+    with app_mod.app.test_request_context():
+        assert app_mod.asset_url('public/assets/logo.png') == '/static/public/assets/logo.png'
+
+
+def test_asset_url_uses_manifest(monkeypatch, tmp_path):
+    use_dist(monkeypatch, tmp_path, {
+        'public/assets/logo.png': {
+            'full': 'dist/public/assets/logo.abc123.png',
+            'thumb': 'dist/public/assets/logo.abc123.thumb.png',
+        },
+    })
+    with app_mod.app.test_request_context():
+        assert app_mod.asset_url('public/assets/logo.png') == '/static/dist/public/assets/logo.abc123.png'
+        assert app_mod.asset_url('public/assets/logo.png', 'thumb') == '/static/dist/public/assets/logo.abc123.thumb.png'
+        # unknown variant or path: original file
+        assert app_mod.asset_url('public/assets/logo.png', 'webp') == '/static/public/assets/logo.png'
+
+    html = app_mod.app.test_client().get('/').get_data(as_text=True)
+    assert '/static/dist/public/assets/logo.abc123.png' in html
+
+
+def test_dist_files_are_immutable(monkeypatch, tmp_path):
+    dist = use_dist(monkeypatch, tmp_path, {})
+    (dist / 'logo.abc123.png').write_bytes(b'\x89PNG fake')
+    r = app_mod.app.test_client().get('/static/dist/logo.abc123.png')
+    assert r.status_code == 200
+    assert 'immutable' in r.headers['Cache-Control']
+    assert 'max-age=31536000' in r.headers['Cache-Control']
+    assert r.expires is not None
+
+
+def test_manifest_rebuild_changes_the_deck_etag(monkeypatch, tmp_path):
+    dist = use_dist(monkeypatch, tmp_path, {})
+    client = app_mod.app.test_client()
+    for n, path in enumerate(('/deck', '/api/deck'), 1):
+        etag = client.get(path).headers['ETag'].strip('"')
+        assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+        # scripts/build_assets.py ran again; nothing has read the manifest since
+        (dist / 'manifest.json').write_text(json.dumps({'public/assets/logo.png': {'full': 'dist/%s.png' % ('x' * n)}}))
+        os.utime(dist / 'manifest.json', ns=(n, n))
+        assert client.get(path, headers={'If-None-Match': etag}).status_code == 200
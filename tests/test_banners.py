@@ -0,0 +1,117 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import random
+
+import pytest
+
+import banners
+from app import app, codec, new_user
+from catalog import get_catalog
+from gacha import PITY_RULES, standard_banner
+from banners import AliasTable, Banner, get_banners
+
+
+def implied(table):
+    """Exact outcome probabilities encoded by an alias table."""
+    p = [0.0] * table.n
+    for i in range(table.n):
+        p[i] += table.prob[i] / table.n
+        p[table.alias[i]] += (1 - table.prob[i]) / table.n
+    return p
+
+
+@pytest.mark.parametrize('weights', [[1], [3, 1], [65, 25, 5, 1, 0.1, 0.01], [0, 2, 0, 1], [1] * 7])
+def test_alias_table_encodes_the_weights_exactly(weights):
+    total = sum(weights)
+    assert implied(AliasTable(weights)) == pytest.approx([w / total for w in weights], abs=1e-12)
+
+
+def test_alias_draws_follow_the_weights():
+    table = AliasTable([3, 1])
+    draws = table.draw_many(20000, random.Random(0))
+    assert abs(draws.count(0) / 20000 - 0.75) < 0.015
+    assert table.draw(random.Random(1)) in (0, 1)
+
+
+def test_rate_up_share_and_validation():
+    catalog = get_catalog()
+    spec = {'id': 'up', 'rates': {'UR': 1}, 'rate_up': {'UR': {'ids': [1], 'share': 0.5}}}
+    banner = Banner(spec, catalog, PITY_RULES)
+    pool, table = banner.card_tables['UR']
+    by_id = dict(zip((catalog.cards[p]['id'] for p in pool), implied(table)))
+    assert by_id[1] == pytest.approx(0.5)
+    assert by_id[2] == pytest.approx(0.5 / (len(pool) - 1))
+    assert banner.pick(catalog, 'B', random) is None
+    assert Banner({'id': 'low', 'rates': {'B': 1}, 'pity': {'UR': 1}}, catalog, PITY_RULES).pity_rules[0][2] == 1
+
+    for bad in ({'rates': {'X': 1}},
+                {'rates': {'UR': 1}, 'rate_up': {'UR': {'ids': [11]}}},
+                {'rates': {'UR': 1}, 'pity': {'B': 10}},
+                # wrong types are ValueErrors too, so a reload keeps the last good file
+                {'rates': {'B': [1]}},
+                {'rates': {'B': '1'}},
+                {'rates': {'B': -1, 'A': 2}},
+                {'rates': {'B': 1}, 'pity': {'UR': None}},
+                {'rates': {'B': 1}, 'pity': {'UR': 1.5}},
+                {'rates': {'B': 1}, 'pity': {'UR': 0}},
+                {'rates': {'B': 1}, 'pity': {'SS': -5}},
+                {'rates': {'B': 1}, 'pity': [1]},
+                {'rates': {'UR': 1}, 'rate_up': [1]},
+                {'rates': {'UR': 1}, 'rate_up': {'UR': {'ids': 1}}},
+                {'rates': {'UR': 1}, 'rate_up': {'UR': {'ids': [[1]]}}},
+                {'rates': {'UR': 1}, 'rate_up': {'UR': {'ids': [1], 'share': None}}}):
+        with pytest.raises(ValueError):
+            Banner(dict(bad, id='bad'), catalog, PITY_RULES)
+
+
+def test_hot_reload_keeps_last_good_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(banners, 'CHECK_INTERVAL', 0)
+    catalog = get_catalog()
+    path = str(tmp_path / 'banners.json')
+    load = lambda: get_banners(catalog, standard_banner(), PITY_RULES, path)
+
+    # no file: the built-in standard banner
+    assert list(load().banners) == ['standard']
+
+    with open(path, 'w') as f:
+        json.dump({'default': 'a', 'banners': [{'id': 'a', 'rates': {'B': 1}}]}, f)
+    assert load().get().id == 'a'
+
+    with open(path, 'w') as f:
+        f.write('{"banners": [')
+    assert load().get().id == 'a'
+
+    for broken in ({'id': 'c', 'rates': {'B': 1}, 'pity': {'UR': None}},
+                   {'id': 'c', 'rates': {'B': [1]}},
+                   {'id': 'c', 'rates': {'B': 1}, 'rate_up': [1]}):
+        with open(path, 'w') as f:
+            json.dump({'banners': [broken]}, f)
+        assert load().get().id == 'a'
+    with open(path, 'w') as f:
+        json.dump({'default': ['a'], 'banners': [{'id': 'a', 'rates': {'B': 1}}]}, f)
+    assert load().get().id == 'a'
+
+    with open(path, 'w') as f:
+        json.dump({'banners': [{'id': 'b', 'rates': {'A': 1}}]}, f)
+    assert load().get().id == 'b' and load().get('a') is None
+
+
+def test_pull_with_banner():
+    client = app.test_client()
+    user = new_user()
+    user['coins'] = 10 ** 6
+    uid = 'bannerfan'
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+
+    listed = client.get('/api/banners').get_json()
+    assert listed['default'] == 'standard'
+    ids = [b['id'] for b in listed['banners']]
+    assert ids == list(banners.get_banners(get_catalog(), standard_banner(), PITY_RULES).banners)
+
+    r = client.post('/pull', json={'count': 10, 'banner': 'nope'})
+    assert r.status_code == 400
+    r = client.post('/pull', json={'count': 10, 'banner': ids[-1]})
+    assert r.get_json()['banner'] == ids[-1]
+    assert client.post('/pull', json={'count': 1}).get_json()['banner'] == 'standard'
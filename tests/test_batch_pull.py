@@ -0,0 +1,89 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import app as app_mod
+from collection import OwnedCards
+from catalog import get_catalog
+from gacha import PITY_RULES, TICKET_REWARDS, run_pull_batch, run_pull_loop, apply_pity
+from banners import Banner
+
+np = pytest.importorskip('numpy')
+
+
+def fresh_user(**kw):
+    user = {"coins": 100000, "owned": [], "tickets": 0, "pity_sss": 0, "pity_ss": 0, "pity_ur": 0}
+    user.update(kw)
+    user['owned'] = OwnedCards.load(user['owned'])
+    return user
+
+
+def check_pull(user_before, user, results, count):
+    catalog = get_catalog()
+    assert len(results) == count
+    assert set(results[0]) == {'id', 'name', 'rarity', 'desc', 'image', 'duplicate', 'tickets_awarded'}
+
+    owned = set(user_before['owned'])
+    tickets = user_before['tickets']
+    for r in results:
+        assert r['id'] in catalog.by_id
+        if r['id'] in owned:
+            assert r['duplicate'] is True
+            assert r['tickets_awarded'] == TICKET_REWARDS[r['rarity']]
+        else:
+            assert r['duplicate'] is False
+            assert r['tickets_awarded'] == 0
+            owned.add(r['id'])
+        tickets += r['tickets_awarded']
+
+    assert user['tickets'] == tickets
+    assert set(user['owned']) == owned
+
+
+@pytest.mark.parametrize('engine', ['loop', 'batch'])
+def test_engines_keep_the_same_result_shape(engine):
+    catalog = get_catalog()
+    start = fresh_user(owned=[c['id'] for c in catalog.pool('B')][:30], tickets=7)
+    user = fresh_user(owned=start['owned'], tickets=7)
+    if engine == 'loop':
+        results, _ = run_pull_loop(catalog, user, 500, [])
+    else:
+        results, _ = run_pull_batch(catalog, user, 500, [], np)
+    check_pull(start, user, results, 500)
+
+
+def test_batch_guarantees_are_unowned_and_reset_pity():
+    catalog = get_catalog()
+    owned = [c['id'] for c in catalog.pool('UR')][:9]
+    user = fresh_user(owned=owned, pity_ur=500, pity_sss=200, pity_ss=100)
+    start = fresh_user(owned=owned)
+
+    results, obtained = run_pull_batch(catalog, user, 60, ['UR', 'SSS', 'SS'], np)
+    check_pull(start, user, results, 60)
+    assert {'UR', 'SSS', 'SS'} <= obtained
+    # only one UR left unowned, the guaranteed slot must hand it out
+    last_ur = [c['id'] for c in catalog.pool('UR')][9]
+    assert any(r['id'] == last_ur and not r['duplicate'] for r in results)
+
+    apply_pity(user, obtained, 60)
+    assert user['pity_ur'] == user['pity_sss'] == user['pity_ss'] == 0
+
+
+def test_pity_counters_cap_when_nothing_rare_drops():
+    catalog = get_catalog()
+    only_b = Banner({'id': 'only-b', 'rates': {'B': 1}}, catalog, PITY_RULES)
+    user = fresh_user(pity_ss=90)
+    results, obtained = run_pull_batch(catalog, user, 50, [], np, only_b)
+    apply_pity(user, obtained, 50)
+    assert {r['rarity'] for r in results} == {'B'}
+    assert (user['pity_ss'], user['pity_sss'], user['pity_ur']) == (100, 50, 50)
+
+
+def test_large_pull_route_uses_batch_engine():
+    client = app_mod.app.test_client()
+    r = client.post('/pull', json={'count': 600})
+    j = r.get_json()
+    assert r.status_code == 200 and j['ok']
+    assert len(j['results']) == 600
+    assert j['coins'] == 100000 - 600 * 100
@@ -0,0 +1,115 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import uuid
+
+import pytest
+
+import app as app_mod
+from app import BOXES, app, codec, new_user
+from catalog import get_catalog
+from collection import OwnedCards
+
+
+def client_with(tickets, owned=()):
+    user = new_user()
+    user['tickets'] = tickets
+    user['owned'] = OwnedCards.from_ids(owned)
+    client = app.test_client()
+    uid = 'bulk' + uuid.uuid4().hex
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+    return client
+
+
+def cookie_user(client):
+    return codec.loads(client.get_cookie('user_data').value)
+
+
+def test_orders_are_merged_and_drawn_without_replacement():
+    catalog = get_catalog()
+    client = client_with(10 ** 6)
+    r = client.post('/buy', json={'orders': [
+        {'rarity': 'B', 'quantity': 20}, {'rarity': 'A', 'quantity': 3}, {'rarity': 'B', 'quantity': 5},
+    ]})
+    j = r.get_json()
+    assert r.status_code == 200 and j['ok']
+    assert j['orders'] == [{'rarity': 'B', 'requested': 25, 'bought': 25},
+                           {'rarity': 'A', 'requested': 3, 'bought': 3}]
+    ids = [c['id'] for c in j['cards']]
+    assert len(ids) == len(set(ids)) == 28
+    assert [catalog.by_id[i]['rarity'] for i in ids] == ['B'] * 25 + ['A'] * 3
+    assert j['spent'] == 25 * BOXES['B']['cost'] + 3 * BOXES['A']['cost']
+    assert j['tickets'] == 10 ** 6 - j['spent']
+
+    user = cookie_user(client)
+    assert set(user['owned']) == set(ids) and user['tickets'] == j['tickets']
+
+
+def test_partial_fill_charges_only_what_was_bought():
+    catalog = get_catalog()
+    ur = list(catalog.rarity_ids['UR'])
+    client = client_with(10 ** 6, ur[:-2])
+    j = client.post('/buy', json={'orders': [{'rarity': 'UR', 'quantity': 5}], 'compact': True}).get_json()
+    assert j['orders'] == [{'rarity': 'UR', 'requested': 5, 'bought': 2}]
+    assert sorted(row[0] for row in j['cards']) == sorted(ur[-2:])
+    assert j['spent'] == 2 * BOXES['UR']['cost']
+
+    # nothing left at all
+    r = client.post('/buy', json={'orders': [{'rarity': 'UR', 'quantity': 1}]})
+    assert r.status_code == 400 and r.get_json()['error'] == 'No unowned cards left'
+
+
+def test_all_or_nothing_and_tickets_are_atomic():
+    catalog = get_catalog()
+    ur = list(catalog.rarity_ids['UR'])
+    cost = BOXES['UR']['cost'] + 10 * BOXES['B']['cost']
+
+    client = client_with(10 ** 6, ur[:-1])
+    r = client.post('/buy', json={'orders': [{'rarity': 'B', 'quantity': 10}, {'rarity': 'UR', 'quantity': 2}],
+                                  'partial': False})
+    assert r.status_code == 400 and r.get_json()['available'] == {'B': 10, 'UR': 1}
+    assert 'user_data' not in r.headers.get('Set-Cookie', '')
+
+    # one ticket short of the whole batch: nothing is bought
+    client = client_with(cost - 1, ur[:-1])
+    r = client.post('/buy', json={'orders': [{'rarity': 'B', 'quantity': 10}, {'rarity': 'UR', 'quantity': 1}]})
+    assert r.status_code == 400 and r.get_json()['cost'] == cost
+    assert 'user_data' not in r.headers.get('Set-Cookie', '')
+
+    client = client_with(cost, ur[:-1])
+    j = client.post('/buy', json={'orders': [{'rarity': 'B', 'quantity': 10}, {'rarity': 'UR', 'quantity': 1}]}).get_json()
+    assert j['ok'] and j['tickets'] == 0 and len(j['cards']) == 11
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'orders': []}, 'orders must be a non-empty list'),
+    ({'orders': {'rarity': 'B'}}, 'orders must be a non-empty list'),
+    ({'orders': [{'rarity': 'X'}]}, 'Invalid rarity'),
+    ({'orders': [{'rarity': ['B']}]}, 'Invalid rarity'),
+    ({'orders': ['B']}, 'Invalid rarity'),
+    ({'orders': [{'rarity': 'B', 'quantity': 0}]}, 'Invalid quantity'),
+    ({'orders': [{'rarity': 'B', 'quantity': '3'}]}, 'Invalid quantity'),
+    ({'orders': [{'rarity': 'B', 'quantity': True}]}, 'Invalid quantity'),
+    ({'rarity': None}, 'Invalid rarity'),
+    ([{'rarity': 'B'}], 'Request body must be a JSON object'),
+    ('B', 'Request body must be a JSON object'),
+])
+def test_orders_are_validated_before_the_cookie_is_read(body, error, monkeypatch):
+    monkeypatch.setattr(app_mod, 'get_user', lambda: pytest.fail('user loaded'))
+    r = app.test_client().post('/buy', json=body)
+    assert r.status_code == 400 and r.get_json()['error'] == error
+
+
+def test_order_size_is_capped(monkeypatch):
+    monkeypatch.setattr(app_mod, 'MAX_BUY_COUNT', 30)
+    client = client_with(10 ** 6)
+    r = client.post('/buy', json={'orders': [{'rarity': 'B', 'quantity': 20}, {'rarity': 'A', 'quantity': 11}]})
+    assert r.status_code == 400 and r.get_json()['error'] == 'at most 30 boxes per request'
+    assert client.post('/buy', json={'orders': [{'rarity': 'B', 'quantity': 30}]}).get_json()['ok']
+
+
+def test_single_box_response_is_unchanged():
+    client = client_with(1000)
+    j = client.post('/buy', json={'rarity': 'B'}).get_json()
+    assert j['ok'] and j['card']['rarity'] == 'B' and 'cards' not in j
+    assert j['tickets'] == 1000 - BOXES['B']['cost']
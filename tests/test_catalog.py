@@ -0,0 +1,49 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+
+import catalog as catalog_mod
+from catalog import RARITY_ORDER, build_catalog, get_catalog
+
+
+def test_catalog_indexes_match_cards_json():
+    with open(catalog_mod.CARDS_FILE, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    cat = get_catalog()
+
+    assert len(cat) == len(raw)
+    assert [r for r, _ in cat.grouped] == RARITY_ORDER
+    for r in RARITY_ORDER:
+        assert [c['id'] for c in cat.pool(r)] == [c['id'] for c in raw if c['rarity'] == r]
+    for c in raw:
+        assert c['id'] in cat.by_id
+
+
+def test_catalog_is_read_only():
+    cat = get_catalog()
+    try:
+        cat.cards[0]['name'] = 'changed'
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('catalog cards should be immutable')
+
+
+def test_get_catalog_reloads_when_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / 'cards.json'
+    path.write_text(json.dumps([{'id': 1, 'name': 'a', 'rarity': 'B', 'desc': '', 'image': 'x'}]))
+    monkeypatch.setattr(catalog_mod, 'CARDS_FILE', str(path))
+    monkeypatch.setattr(catalog_mod, 'CHECK_INTERVAL', 0.0)
+    monkeypatch.setattr(catalog_mod, '_catalog', None)
+
+    first = get_catalog()
+    assert get_catalog() is first
+
+    path.write_text(json.dumps([
+        {'id': 1, 'name': 'a', 'rarity': 'B', 'desc': '', 'image': 'x'},
+        {'id': 2, 'name': 'b', 'rarity': 'UR', 'desc': '', 'image': 'y'},
+    ]))
+    second = get_catalog()
+    assert second is not first
+    assert len(second.pool('UR')) == 1
+    assert build_catalog(str(path)).version == second.version
@@ -0,0 +1,63 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import uuid
+
+from app import app, codec, new_user
+from catalog import Catalog, get_catalog
+
+
+def rich_client():
+    user = new_user()
+    user['tickets'] = 10 ** 6
+    client = app.test_client()
+    # a crafted cookie starts at rev 0, which is only current for a new uid
+    uid = 'compact' + uuid.uuid4().hex
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+    return client
+
+
+def test_catalog_document_and_etag():
+    catalog = get_catalog()
+    client = app.test_client()
+    r = client.get('/api/catalog')
+    doc = r.get_json()
+    assert doc['version'] == catalog.content_hash
+    assert r.headers['ETag'] == '"%s"' % catalog.content_hash
+    assert {c['id'] for c in doc['cards']} == set(catalog.by_id)
+    assert client.get('/api/catalog', headers={'If-None-Match': r.headers['ETag']}).status_code == 304
+
+
+def test_content_hash_ignores_mtime_but_not_content():
+    cards = [dict(c) for c in get_catalog().cards]
+    a = Catalog(cards, (1, 1))
+    b = Catalog(cards, (2, 2))
+    assert a.version != b.version and a.content_hash == b.content_hash
+    cards[0]['name'] = 'Renamed'
+    assert Catalog(cards, (1, 1)).content_hash != a.content_hash
+
+
+def test_compact_pull_and_buy():
+    catalog = get_catalog()
+    client = rich_client()
+    full = client.post('/pull', json={'count': 10}).get_data()
+    r = client.post('/pull', json={'count': 10, 'compact': True})
+    j = r.get_json()
+    assert j['compact'] and j['catalog_version'] == catalog.content_hash
+    assert len(j['results']) == 10
+    for card_id, duplicate, reward in j['results']:
+        assert card_id in catalog.by_id
+        assert isinstance(duplicate, bool) and reward >= 0
+    assert len(r.get_data()) * 3 < len(full)
+
+    b = client.post('/buy', json={'rarity': 'B', 'compact': True}).get_json()
+    assert b['ok'] and b['card'][0] in catalog.by_id and b['card'][1:] == [False, 0]
+
+
+def test_compact_stream():
+    client = rich_client()
+    body = client.post('/pull/stream', json={'count': 5, 'compact': True}).get_data(as_text=True)
+    lines = [json.loads(l) for l in body.splitlines()]
+    assert all(isinstance(l, list) and len(l) == 3 for l in lines[:-1])
+    assert lines[-1]['compact'] and lines[-1]['catalog_version'] == get_catalog().content_hash
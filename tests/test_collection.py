@@ -0,0 +1,102 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+
+from app import app, codec, serializer
+from gacha import pick_cards_by_rarity
+from catalog import get_catalog
+from collection import OwnedCards, UnownedIndex
+
+
+def test_bitset_set_operations():
+    owned = OwnedCards.from_ids([3, 1, 200])
+    assert 1 in owned and 3 in owned and 200 in owned
+    assert 2 not in owned and 0 not in owned
+    owned.add(2)
+    owned.update([2, 5])
+    assert list(owned) == [1, 2, 3, 5, 200]
+    assert len(owned) == 5
+
+
+def test_encode_roundtrip_and_legacy_list():
+    owned = OwnedCards.from_ids(range(1, 221, 3))
+    text = owned.encode()
+    assert OwnedCards.decode(text) == owned
+    assert OwnedCards.load(text) == owned
+    assert OwnedCards.load(list(owned)) == owned
+    assert OwnedCards.load(None) == OwnedCards()
+    # a full 220-card collection stays small
+    assert len(OwnedCards.from_ids(range(1, 221)).encode()) <= 40
+
+
+def test_collected_per_rarity():
+    catalog = get_catalog()
+    ur_ids = [c['id'] for c in catalog.pool('UR')]
+    owned = OwnedCards.from_ids(ur_ids[:4] + [c['id'] for c in catalog.pool('B')][:2])
+    collected = catalog.collected(owned)
+    assert collected['UR'] == (4, len(ur_ids))
+    assert collected['B'][0] == 2
+    assert collected['SSS'][0] == 0
+
+
+def test_unowned_index_tracks_acquisitions():
+    catalog = get_catalog()
+    ss = list(catalog.rarity_ids['SS'])
+    owned = OwnedCards.from_ids(ss[:5])
+    index = UnownedIndex(catalog.rarity_ids, owned)
+    assert index.count('SS') == len(ss) - 5
+
+    rng = random.Random(7)
+    taken = []
+    while True:
+        card_id = index.choice('SS', rng)
+        if card_id is None:
+            break
+        assert card_id not in owned
+        owned.add(card_id)
+        index.discard(card_id, 'SS')
+        taken.append(card_id)
+    assert sorted(taken) == sorted(ss[5:])
+    assert index.count('SS') == 0
+    # discarding something already gone is a no-op
+    index.discard(ss[0], 'SS')
+
+
+def test_pity_slot_prefers_unowned_through_the_index():
+    catalog = get_catalog()
+    ur = list(catalog.rarity_ids['UR'])
+    owned = OwnedCards.from_ids(ur[:-1])
+    card = pick_cards_by_rarity(catalog, 'UR', owned_set=owned, prefer_unowned=True)
+    assert card['id'] == ur[-1]
+    owned.add(ur[-1])
+    # everything owned: falls back to any card of the rarity
+    assert pick_cards_by_rarity(catalog, 'UR', owned_set=owned, prefer_unowned=True)['rarity'] == 'UR'
+
+
+def test_list_cookie_migrates_in_get_user():
+    with app.test_client() as client:
+        client.set_cookie('uid', 'legacy')
+        client.set_cookie('user_data', serializer.dumps(
+            {"coins": 500, "owned": [1, 2, 151], "tickets": 0}))
+        r = client.post('/buy', json={'rarity': 'D'})
+        assert r.status_code == 400
+
+        r = client.get('/deck')
+        assert r.status_code == 200
+        cookie = client.get_cookie('user_data')
+        user = codec.loads(cookie.value)
+        assert user['owned'] == OwnedCards.from_ids([1, 2, 151])
+
+
+def test_unowned_index_take_is_without_replacement():
+    catalog = get_catalog()
+    b = list(catalog.rarity_ids['B'])
+    owned = OwnedCards.from_ids(b[:3])
+    index = UnownedIndex(catalog.rarity_ids, owned)
+    first = index.take('B', 10, random.Random(1))
+    assert len(set(first)) == 10 and not set(first) & set(b[:3])
+    # asking for more than is left hands out the rest
+    rest = index.take('B', 10 ** 6, random.Random(2))
+    assert sorted(first + rest) == sorted(b[3:])
+    assert index.take('B', 5) == [] and index.count('B') == 0
@@ -0,0 +1,62 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from app import app, codec, new_user, serializer
+from collection import OwnedCards
+from cookie_codec import CodecError, pack_user, unpack_user
+
+
+def sample_user():
+    user = new_user()
+    user.update(coins=12345, tickets=4000, pity_sss=199, pity_ss=7, pity_ur=0)
+    user['owned'] = OwnedCards.from_ids(range(1, 221, 2))
+    return user
+
+
+def test_pack_roundtrip():
+    user = sample_user()
+    assert unpack_user(pack_user(user)) == user
+    assert codec.loads(codec.dumps(user)) == user
+
+
+def test_full_collection_cookie_is_compact():
+    user = sample_user()
+    user['owned'] = OwnedCards.from_ids(range(1, 221))
+    legacy = serializer.dumps(dict(user, owned=list(user['owned'])))
+    assert len(codec.dumps(user)) < 100 < len(legacy)
+
+
+def test_rejects_tampering_and_unknown_versions():
+    value = codec.dumps(sample_user())
+    with pytest.raises(CodecError):
+        codec.loads(value[:-1] + ('A' if value[-1] != 'A' else 'B'))
+    with pytest.raises(CodecError):
+        unpack_user(b'\x63' + pack_user(sample_user())[1:])
+
+
+def test_unchanged_requests_do_not_reissue_cookies():
+    with app.test_client() as client:
+        first = client.get('/')
+        assert 'user_data=' in ', '.join(first.headers.getlist('Set-Cookie'))
+
+        for path in ('/', '/gacha', '/deck', '/shop'):
+            r = client.get(path)
+            assert r.status_code == 200
+            assert not r.headers.getlist('Set-Cookie'), path
+
+        r = client.post('/pull', json={'count': 1})
+        assert r.get_json()['ok']
+        assert 'user_data=' in ', '.join(r.headers.getlist('Set-Cookie'))
+
+
+def test_legacy_cookie_is_upgraded():
+    with app.test_client() as client:
+        client.set_cookie('uid', 'legacy')
+        client.set_cookie('user_data', serializer.dumps(
+            {"coins": 900, "owned": [5], "tickets": 3}))
+        r = client.get('/')
+        assert r.headers.getlist('Set-Cookie')
+        user = codec.loads(client.get_cookie('user_data').value)
+        assert (user['coins'], user['tickets'], list(user['owned'])) == (900, 3, [5])
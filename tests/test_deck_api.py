@@ -0,0 +1,75 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app, codec, new_user
+from catalog import get_catalog
+from collection import OwnedCards
+
+
+def client_with(owned_ids):
+    user = new_user()
+    user['owned'] = OwnedCards.from_ids(owned_ids)
+    client = app.test_client()
+    uid = 'deckapi'
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+    return client
+
+
+def walk(client, query):
+    cards, cursor, pages = [], '', 0
+    while True:
+        j = client.get('/api/deck?%s&cursor=%s' % (query, cursor)).get_json()
+        assert j['ok']
+        cards.extend(j['cards'])
+        pages += 1
+        cursor = j['next_cursor']
+        if not cursor:
+            return cards, j, pages
+
+
+def test_pages_cover_the_deck_in_order():
+    catalog = get_catalog()
+    client = client_with([])
+    cards, last, pages = walk(client, 'limit=50')
+    assert [c['id'] for c in cards] == [c['id'] for c in catalog.deck_order]
+    assert pages == -(-len(catalog.deck_order) // 50)
+    assert last['summary']['UR'] == {'have': 0, 'total': len(catalog.pool('UR'))}
+    # missing cards don't leak their art or names
+    assert set(cards[0]) == {'id', 'rarity', 'owned'}
+
+
+def test_rarity_and_owned_filters():
+    catalog = get_catalog()
+    ss = [c['id'] for c in catalog.pool('SS')]
+    ur = [c['id'] for c in catalog.pool('UR')]
+    client = client_with(ss[:7] + ur[:2])
+
+    cards, last, _ = walk(client, 'limit=3&rarity=ss,ur&owned=1')
+    assert sorted(c['id'] for c in cards) == sorted(ss[:7] + ur[:2])
+    assert all(c['owned'] and c['name'] for c in cards)
+    assert last['summary']['SS']['have'] == 7
+
+    cards, _, _ = walk(client, 'limit=200&rarity=SS&owned=0')
+    assert [c['id'] for c in cards] == ss[7:]
+
+    # a repeated rarity is still one span
+    cards, _, _ = walk(client, 'limit=4&rarity=UR,ur,UR')
+    assert [c['id'] for c in cards] == ur
+
+
+def test_bad_input_and_stale_cursor():
+    client = client_with([])
+    assert client.get('/api/deck?rarity=ZZ').status_code == 400
+    assert client.get('/api/deck?limit=abc').status_code == 400
+    r = client.get('/api/deck?cursor=0-0.40')
+    assert r.status_code == 409 and r.get_json()['catalog_version'] == get_catalog().version
+
+
+def test_conditional_get():
+    client = client_with([1])
+    first = client.get('/api/deck?limit=10')
+    again = client.get('/api/deck?limit=10', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    other = client.get('/api/deck?limit=11', headers={'If-None-Match': first.headers['ETag']})
+    assert other.status_code == 200
@@ -0,0 +1,44 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import DECK_PAGE_SIZE, app, codec, new_user
+from catalog import get_catalog
+from collection import OwnedCards
+
+
+def test_deck_marks_owned_cards():
+    catalog = get_catalog()
+    user = new_user()
+    user['owned'] = OwnedCards.from_ids([c['id'] for c in catalog.pool('UR')][:3])
+    with app.test_client() as client:
+        uid = 'deckuser'
+        client.set_cookie('uid', uid)
+        client.set_cookie('user_data', codec.dumps(user, uid))
+        html = client.get('/deck?all=1').get_data(as_text=True)
+        first_page = client.get('/deck').get_data(as_text=True)
+    assert html.count('class="card-front') == 3
+    assert html.count('class="card-back') == len(catalog) - 3
+    assert '3/%d' % len(catalog.pool('UR')) in html
+
+    # the default page only renders the first DECK_PAGE_SIZE cards
+    assert first_page.count('class="card ') + first_page.count('class="card"') == DECK_PAGE_SIZE
+    assert 'data-next-cursor="%s.%d"' % (catalog.version, DECK_PAGE_SIZE) in first_page
+
+
+def test_deck_conditional_get():
+    with app.test_client() as client:
+        first = client.get('/deck')
+        etag = first.headers['ETag']
+        assert first.status_code == 200
+
+        again = client.get('/deck', headers={'If-None-Match': etag})
+        assert again.status_code == 304
+        assert again.get_data() == b''
+        assert again.headers['ETag'] == etag
+        assert not again.headers.getlist('Set-Cookie')
+
+        # owning something new changes the tag
+        assert client.post('/pull', json={'count': 1}).get_json()['ok']
+        after = client.get('/deck', headers={'If-None-Match': etag})
+        assert after.status_code == 200
+        assert after.headers['ETag'] != etag
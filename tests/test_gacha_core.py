@@ -0,0 +1,194 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import itertools
+import math
+import random
+
+import pytest
+
+import gacha
+from banners import Banner
+from catalog import get_catalog
+from collection import OwnedCards
+from gacha import (
+    LOW_PRIORITIES, PITY_RULES, TICKET_REWARDS, apply_pity, place_guarantees,
+    pity_guarantees, run_pull, run_pull_batch, sample_cards,
+)
+
+np = pytest.importorskip('numpy')
+
+# seeds are fixed, so these are deterministic; the level only says how far
+# off a distribution has to be before the suite notices
+Z_999 = 3.0902
+
+
+def chi2_critical(dof, z=Z_999):
+    # Wilson-Hilferty approximation of the chi-square quantile
+    return dof * (1 - 2 / (9 * dof) + z * math.sqrt(2 / (9 * dof))) ** 3
+
+
+def assert_fits(observed, probabilities):
+    n = sum(observed)
+    expected = [p * n for p in probabilities]
+    assert min(expected) >= 5, 'sample too small for a chi-square test'
+    stat = sum((o - e) ** 2 / e for o, e in zip(observed, expected))
+    assert stat < chi2_critical(len(observed) - 1), (stat, observed, expected)
+
+
+def new_user(**kw):
+    user = {'coins': 0, 'tickets': 0, 'owned': OwnedCards(), 'pity_ur': 0, 'pity_sss': 0, 'pity_ss': 0}
+    user.update(kw)
+    return user
+
+
+def rates(banner):
+    total = sum(banner.rates.values())
+    return [banner.rates[r] / total for r in banner.labels]
+
+
+def test_batch_rarity_frequencies_match_the_banner():
+    banner = gacha.get_banner()
+    slot_rarity, _ = sample_cards(get_catalog(), 3000000, np, banner, np.random.default_rng(1))
+    observed = np.bincount(slot_rarity, minlength=len(banner.labels)).tolist()
+    assert_fits(observed, rates(banner))
+
+
+def test_loop_rarity_frequencies_match_the_banner():
+    banner = gacha.get_banner()
+    draws = gacha.choose_rarity(1000000, random.Random(2), banner)
+    observed = [draws.count(r) for r in banner.labels]
+    # UR alone is ~1e-4 here, fold it into SSS to keep every cell above 5
+    probs = rates(banner)
+    i, j = banner.labels.index('SSS'), banner.labels.index('UR')
+    observed[i] += observed.pop(j)
+    probs[i] += probs.pop(j)
+    assert_fits(observed, probs)
+
+
+def test_cards_are_uniform_within_a_rarity():
+    catalog = get_catalog()
+    banner = gacha.get_banner()
+    slot_rarity, slot_pos = sample_cards(catalog, 1000000, np, banner, np.random.default_rng(3))
+    b = slot_pos[slot_rarity == banner.labels.index('B')]
+    pool = [p for p, c in enumerate(catalog.cards) if c['rarity'] == 'B']
+    counts = np.bincount(b, minlength=len(catalog.cards))
+    assert_fits([int(counts[p]) for p in pool], [1 / len(pool)] * len(pool))
+
+
+def test_rate_up_share():
+    catalog = get_catalog()
+    banner = Banner({'id': 'up', 'rates': {'SS': 1, 'UR': 1},
+                     'rate_up': {'UR': {'ids': [1, 2], 'share': 0.6}}}, catalog, PITY_RULES)
+    slot_rarity, slot_pos = sample_cards(catalog, 200000, np, banner, np.random.default_rng(4))
+    ids = [catalog.cards[p]['id'] for p in slot_pos[slot_rarity == banner.labels.index('UR')].tolist()]
+    featured = sum(i in (1, 2) for i in ids)
+    assert_fits([featured, len(ids) - featured], [0.6, 0.4])
+    # loop engine draws from the same table
+    rng = random.Random(5)
+    picks = [banner.pick(catalog, 'UR', rng)['id'] for _ in range(100000)]
+    featured = sum(i in (1, 2) for i in picks)
+    assert_fits([featured, len(picks) - featured], [0.6, 0.4])
+
+
+# ------------------------------------------------------
+# pity invariants (exact)
+# ------------------------------------------------------
+
+@pytest.mark.parametrize('count', [1, 2, 3, 10])
+def test_place_guarantees_priority_and_low_slots_first(count):
+    rng = random.Random(count)
+    pool = ['D', 'B', 'A', 'S', 'SS', 'SSS', 'UR']
+    priority = [r for r, _, _ in PITY_RULES]
+    for guarantees in itertools.chain.from_iterable(
+            itertools.combinations(priority, k) for k in range(4)):
+        guarantees = list(guarantees)
+        for _ in range(50):
+            rarities = [rng.choice(pool) for _ in range(count)]
+            before = list(rarities)
+            slots = place_guarantees(rarities, guarantees, rng)
+            # the highest priority guarantees that fit are all present
+            for g in guarantees[:count]:
+                assert g in rarities
+            # nothing but the overwritten slots changed
+            assert [i for i in range(count) if rarities[i] != before[i]] == sorted(
+                i for i in slots if rarities[i] != before[i])
+            # an overwritten slot was the lowest rarity available at the time
+            for i in slots:
+                if before[i] in LOW_PRIORITIES:
+                    lower = LOW_PRIORITIES[:LOW_PRIORITIES.index(before[i])]
+                    assert not any(r in lower for r in rarities if r not in guarantees)
+
+
+def test_apply_pity_resets_obtained_and_caps_the_rest():
+    for count in (1, 10, 700):
+        for obtained in ({'B'}, {'SS'}, {'UR', 'SSS'}):
+            user = new_user(pity_ur=499, pity_sss=5, pity_ss=100)
+            apply_pity(user, obtained, count)
+            for r, key, threshold in PITY_RULES:
+                before = {'pity_ur': 499, 'pity_sss': 5, 'pity_ss': 100}[key]
+                assert user[key] == (0 if r in obtained else min(threshold, before + count))
+
+
+@pytest.mark.parametrize('engine', ['loop', 'batch'])
+def test_long_run_invariants(engine):
+    catalog = get_catalog()
+    banner = gacha.get_banner()
+    thresholds = {r: t for r, _, t in banner.pity_rules}
+    user = new_user()
+    rng = random.Random(6)
+    np_rng = np.random.default_rng(6)
+    count = 10 if engine == 'loop' else 600
+    since = {r: 0 for r in thresholds}
+
+    for _ in range(3000 if engine == 'loop' else 40):
+        owned_before = set(user['owned'])
+        tickets_before = user['tickets']
+        guarantees = pity_guarantees(user, banner)
+        if engine == 'loop':
+            results = run_pull(catalog, user, count, banner, rng)
+        else:
+            results, obtained = run_pull_batch(catalog, user, count, guarantees, np, banner, np_rng)
+            apply_pity(user, obtained, count, banner)
+
+        got = [r['rarity'] for r in results]
+        for g in guarantees:
+            assert g in got
+
+        seen = set(owned_before)
+        for r in results:
+            assert r['duplicate'] == (r['id'] in seen)
+            assert r['tickets_awarded'] == (TICKET_REWARDS[r['rarity']] if r['duplicate'] else 0)
+            seen.add(r['id'])
+        assert set(user['owned']) == seen
+        assert user['tickets'] - tickets_before == sum(r['tickets_awarded'] for r in results)
+
+        for r, key, threshold in banner.pity_rules:
+            assert 0 <= user[key] <= threshold
+            assert (user[key] == 0) == (r in got)
+            # never more than threshold + one pull between two hits
+            since[r] = 0 if r in got else since[r] + count
+            assert since[r] <= threshold + count
+
+
+@pytest.mark.parametrize('engine', ['loop', 'batch'])
+def test_guaranteed_slot_prefers_an_unowned_card(engine):
+    catalog = get_catalog()
+    # nothing rare is ever drawn, so the guarantee has to overwrite a slot
+    only_b = Banner({'id': 'only-b', 'rates': {'B': 1}}, catalog, PITY_RULES)
+    ur = list(catalog.rarity_ids['UR'])
+    for seed in range(20):
+        user = new_user(pity_ur=500, owned=OwnedCards.from_ids(ur[1:]))
+        if engine == 'loop':
+            results = run_pull(catalog, user, 10, only_b, random.Random(seed))
+        else:
+            results, _ = run_pull_batch(catalog, user, 600, ['UR'], np, only_b, np.random.default_rng(seed))
+        assert [r['id'] for r in results if r['rarity'] == 'UR'] == [ur[0]]
+
+
+def test_seeded_pulls_are_reproducible():
+    catalog = get_catalog()
+    for count in (10, 600):
+        a, b = new_user(pity_ss=100), new_user(pity_ss=100)
+        ra = run_pull(catalog, a, count, rng=random.Random(7))
+        rb = run_pull(catalog, b, count, rng=random.Random(7))
+        assert ra == rb and a == b
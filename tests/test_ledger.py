@@ -0,0 +1,109 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
+
+import app as app_mod
+from app import app, codec, new_user
+from ledger import Ledger, read_ledger, read_segment, segments
+
+
+def test_group_commit_batches_concurrent_appends(tmp_path):
+    led = Ledger(str(tmp_path), commit_interval=0.05)
+
+    def worker(n):
+        for i in range(200):
+            led.append({'w': n, 'i': i})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    led.close()
+
+    got = list(read_ledger(str(tmp_path)))
+    assert len(got) == 1600
+    # far fewer fsyncs than entries
+    assert led.batches < 50
+    for n in range(8):
+        assert [e['i'] for e in got if e['w'] == n] == list(range(200))
+
+
+def test_segments_rotate_by_size_and_torn_tail_is_skipped(tmp_path):
+    led = Ledger(str(tmp_path), segment_bytes=2000, commit_interval=0)
+    for i in range(300):
+        led.append({'i': i, 'pad': 'x' * 20})
+        if i % 10 == 9:
+            led.flush()
+    led.close()
+    paths = segments(str(tmp_path))
+    assert len(paths) > 3
+    assert all(os.path.getsize(p) <= 2000 for p in paths)
+    assert [e['i'] for e in read_ledger(str(tmp_path))] == list(range(300))
+
+    with open(paths[-1], 'ab') as f:
+        f.write(b'{"i": 300, "pa')
+    assert list(read_segment(paths[-1]))[-1]['i'] == 299
+
+
+def test_failed_writes_are_retried_then_dropped(tmp_path, monkeypatch, capsys):
+    led = Ledger(str(tmp_path), commit_interval=0, max_queue=5, retry_interval=0)
+    write = led._write
+    failures = [1]
+
+    def flaky(batch):
+        if failures[0]:
+            failures[0] -= 1
+            raise OSError(28, 'No space left on device')
+        write(batch)
+    monkeypatch.setattr(led, '_write', flaky)
+    led.append({'i': 0})
+    assert led.flush(timeout=5)
+    assert [e['i'] for e in read_ledger(str(tmp_path))] == [0]
+    assert 'No space left' in capsys.readouterr().err
+
+    # a disk that stays broken: the writer survives, the batch is dropped
+    failures[0] = 10 ** 6
+    for i in range(1, 4):
+        led.append({'i': i})
+    assert led.flush(timeout=5)
+    assert led._thread.is_alive() and led.dropped == 3
+
+    # the queue is bounded while the writer is stuck
+    gate = threading.Event()
+    monkeypatch.setattr(led, '_write', lambda batch: gate.wait())
+    for i in range(20):
+        led.append({'i': i})
+    assert not led.flush(timeout=0.2)
+    assert len(led._queue) <= 5 and led.dropped >= 3 + 14
+    gate.set()
+    assert led.flush(timeout=5)
+    led.close()
+    # no writer left to wait for
+    led._queue.append({'i': 99})
+    assert not led.flush()
+
+
+def test_pull_and_buy_are_recorded(tmp_path, monkeypatch):
+    led = Ledger(str(tmp_path), commit_interval=0)
+    monkeypatch.setattr(app_mod, 'ledger', led)
+    client = app.test_client()
+    user = new_user()
+    user['tickets'] = 1000
+    uid = 'ledgeruser'
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+    r = client.post('/pull', json={'count': 10}).get_json()
+    s = client.post('/pull/stream', json={'count': 5})
+    s.get_data()
+    client.post('/buy', json={'rarity': 'B'})
+    led.close()
+
+    pull, stream, buy = read_ledger(str(tmp_path))
+    assert pull['uid'] == 'ledgeruser' and pull['kind'] == 'pull'
+    assert pull['ids'] == [c['id'] for c in r['results']]
+    assert pull['rarities'] == [c['rarity'] for c in r['results']]
+    assert pull['pity_before'] == [0, 0, 0]
+    assert pull['pity_after'] == [r['pity_ur'], r['pity_sss'], r['pity_ss']]
+    assert stream['count'] == 5 and stream['pity_before'] == pull['pity_after']
+    assert buy['kind'] == 'buy'
@@ -0,0 +1,60 @@
+import os, sys
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+import subprocess
+
+import metrics
+
+
+def test_histogram_and_counter_render():
+    h = metrics.Histogram('t_seconds', 'test', ('route',), buckets=(0.1, 1.0))
+    h.observe(0.05, '/a')
+    h.observe(0.5, '/a')
+    h.observe(3.0, '/a')
+    c = metrics.Counter('t_total', 'test', ('rarity',))
+    c.inc('UR')
+    c.inc('UR', amount=2)
+    metrics._registry.remove(h)
+    metrics._registry.remove(c)
+
+    lines = list(h.render())
+    assert 't_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 't_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 't_seconds_count{route="/a"} 3' in lines
+    assert list(c.render()) == ['t_total{rarity="UR"} 3']
+
+
+def test_timed_is_a_noop_when_disabled(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    fn = lambda: 1
+    assert metrics.timed('x')(fn) is fn
+
+
+SCRIPT = '''
+from app import app
+c = app.test_client()
+assert c.get('/deck').status_code == 200
+assert c.post('/pull', json={'count': 10}).get_json()['ok']
+print(c.get('/metrics').get_data(as_text=True))
+'''
+
+
+def test_metrics_endpoint_when_enabled():
+    env = dict(os.environ, NEXORIA_METRICS='1')
+    out = subprocess.run([sys.executable, '-c', SCRIPT], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    assert 'nexoria_request_seconds_count{route="/pull",method="POST",status="200"} 1' in out
+    assert 'nexoria_stage_seconds_count{stage="render"} 1' in out
+    assert 'nexoria_stage_seconds_count{stage="get_user"} 2' in out
+    assert 'nexoria_stage_seconds_count{stage="pull"} 1' in out
+    assert 'nexoria_cookie_bytes_count{direction="response"}' in out
+    pulled = sum(int(l.rsplit(' ', 1)[1]) for l in out.splitlines()
+                 if l.startswith('nexoria_cards_pulled_total{'))
+    assert pulled == 10
+
+
+def test_metrics_route_absent_by_default():
+    from app import app
+    if not metrics.enabled:
+        assert app.test_client().get('/metrics').status_code == 404
@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 import os, sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from app import app, serializer
+from app import app, codec
+from storage import normalize_user
 import json
+import uuid
 
 
 def make_user_cookie(client, data):
     # set uid and user_data cookies for test client via base environ (works in this test env)
-    uid = 'testuser'
-    ud = serializer.dumps(data)
+    # a new uid each time: a crafted cookie starts at rev 0, which is only
+    # current for a uid the server hasn't seen
+    uid = 'testuser' + uuid.uuid4().hex
+    ud = codec.dumps(normalize_user(data), uid)
     # attempt to use the test client's set_cookie API; fallback to environ if signature differs
     try:
         client.set_cookie('uid', uid)
@@ -100,8 +104,10 @@ if __name__ == '__main__':
 
         print('== test: increment pity when no SSS/UR obtained (deterministic)')
         # patch choose_rarity to always return low rarities so we won't accidentally hit SSS/UR
-        from app import choose_rarity as original_choose
-        app.choose_rarity = lambda pulls=1: ['A'] * pulls
+        # (the engine looks it up in gacha.py, patching the Flask app did nothing)
+        import gacha
+        original_choose = gacha.choose_rarity
+        gacha.choose_rarity = lambda pulls=1, rng=None, banner=None: ['A'] * pulls
 
         user = {"coins":100000, "owned":[], "tickets":0, "pity_sss":0, "pity_ur":0}
         make_user_cookie(client, user)
@@ -116,6 +122,6 @@ if __name__ == '__main__':
         assert j['pity_ur'] == 3
 
         # restore
-        app.choose_rarity = original_choose
+        gacha.choose_rarity = original_choose
 
         print('All pity tests passed.')
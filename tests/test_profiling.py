@@ -0,0 +1,100 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+import json
+import threading
+import time
+
+import pytest
+
+import app as app_mod
+import profile_report
+from app import app
+from profiling import COLLAPSED, SPEEDSCOPE, Profiler, Sampler, profiles
+
+
+def busy(ms):
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    prof = Profiler(str(tmp_path / 'profiles'), 's3cret', keep=3, base_dir=app_mod.BASE_DIR)
+    monkeypatch.setattr(app_mod, 'profiler', prof)
+    return prof
+
+
+def test_sampler_sees_the_running_function():
+    sampler = Sampler(threading.get_ident(), 0.001, os.path.dirname(__file__))
+    sampler.start()
+    busy(50)
+    sampler.stop()
+    assert sampler.samples > 5
+    leaves = {stack[-1].split(' (')[0] for stack in sampler.stacks}
+    assert 'busy' in leaves
+    # root first: the test function is above busy on every stack through it
+    for stack in sampler.stacks:
+        names = [f.split(' (')[0] for f in stack]
+        if 'busy' in names:
+            assert names.index('test_sampler_sees_the_running_function') < names.index('busy')
+
+
+def test_only_requests_with_the_secret_are_profiled(profiler):
+    client = app.test_client()
+    switch = sys.getswitchinterval()
+    assert 'X-Nexoria-Profile' not in client.get('/api/banners').headers
+    assert 'X-Nexoria-Profile' not in client.get('/api/banners', headers={'X-Nexoria-Profile': 'nope'}).headers
+    assert profiles(profiler.directory) == []
+
+    resp = client.post('/pull', json={'count': 10}, headers={'X-Nexoria-Profile': 's3cret'})
+    assert resp.status_code == 200
+    stem = resp.headers['X-Nexoria-Profile']
+    assert stem.endswith('-pull')
+    path = os.path.join(profiler.directory, stem)
+    assert profiles(profiler.directory) == [path + COLLAPSED]
+    with open(path + SPEEDSCOPE) as f:
+        doc = json.load(f)
+    prof = doc['profiles'][0]
+    assert prof['type'] == 'sampled' and len(prof['samples']) == len(prof['weights'])
+    assert all(0 <= i < len(doc['shared']['frames']) for s in prof['samples'] for i in s)
+    # the switch interval is restored once nothing is profiled
+    assert sys.getswitchinterval() == switch
+
+
+def test_ring_buffer_keeps_the_newest(profiler):
+    client = app.test_client()
+    stems = []
+    for _ in range(5):
+        stems.append(client.get('/api/banners', headers={'X-Nexoria-Profile': 's3cret'}).headers['X-Nexoria-Profile'])
+    kept = profiles(profiler.directory)
+    assert kept == [os.path.join(profiler.directory, s + COLLAPSED) for s in stems[-3:]]
+    assert len(os.listdir(profiler.directory)) == 6
+
+
+def test_failed_request_stops_the_sampler(profiler, monkeypatch):
+    def boom(*a, **kw):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(app_mod, 'run_pull', boom)
+    resp = app.test_client().post('/pull', json={'count': 1}, headers={'X-Nexoria-Profile': 's3cret'})
+    assert resp.status_code == 500
+    assert profiler._active == 0
+    assert not any(t.name == 'profile-sampler' for t in threading.enumerate())
+
+
+def test_report_sums_self_and_total(tmp_path, capsys):
+    d = tmp_path / 'p'
+    d.mkdir()
+    (d / ('profile-0000000000001-1-000000-pull' + COLLAPSED)).write_text('a;b;c 3\na;b 1\n')
+    (d / ('profile-0000000000002-1-000001-deck' + COLLAPSED)).write_text('a;d;a 2\n')
+    s = profile_report.summarize(profiles(str(d)))
+    assert s['samples'] == 6
+    assert s['self'] == {'c': 3, 'b': 1, 'a': 2}
+    assert s['total'] == {'a': 6, 'b': 4, 'c': 3, 'd': 2}
+
+    assert profile_report.main([str(d), '--endpoint', 'pull', '--merge', str(tmp_path / 'm')]) == 0
+    out = capsys.readouterr().out
+    assert out.startswith('1 profiles, 4 samples')
+    assert (tmp_path / 'm').read_text() == 'a;b;c 3\na;b 1\n'
+    assert profile_report.main([str(tmp_path / 'empty')]) == 1
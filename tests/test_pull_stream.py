@@ -0,0 +1,83 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import random
+import tracemalloc
+import uuid
+
+import app as app_mod
+import gacha
+from app import app, codec, new_user
+from catalog import get_catalog
+from gacha import PITY_RULES, iter_pull, place_guarantees
+from banners import Banner
+from collection import OwnedCards
+
+
+def rich_client(**kw):
+    user = new_user()
+    user['coins'] = 10 ** 9
+    user.update(kw)
+    client = app.test_client()
+    # a crafted cookie starts at rev 0, which is only current for a new uid
+    uid = 'streamer' + uuid.uuid4().hex
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+    return client, user
+
+
+def test_stream_lines_and_trailer_match_saved_state():
+    client, start = rich_client(pity_ur=500, pity_sss=200)
+    r = client.post('/pull/stream', json={'count': 3000})
+    assert r.status_code == 200
+    assert r.mimetype == 'application/x-ndjson'
+    lines = [json.loads(l) for l in r.get_data(as_text=True).splitlines()]
+
+    results, trailer = lines[:-1], lines[-1]
+    assert len(results) == 3000
+    assert trailer['done'] and trailer['ok']
+    assert trailer['coins'] == start['coins'] - 3000 * app_mod.PULL_COST
+    assert trailer['tickets'] == sum(x['tickets_awarded'] for x in results)
+    assert any(x['rarity'] == 'UR' and not x['duplicate'] for x in results)
+
+    saved = codec.loads(client.get_cookie('user_data').value)
+    assert saved['tickets'] == trailer['tickets']
+    assert saved['pity_ur'] == trailer['pity_ur']
+    assert set(saved['owned']) == {x['id'] for x in results}
+
+
+def test_iter_pull_replays_and_places_guarantees_like_the_loop():
+    catalog = get_catalog()
+    # rigged stream: no low rarities at all
+    only_sss = Banner({'id': 'only-sss', 'rates': {'SSS': 1}}, catalog, PITY_RULES)
+    user = {'tickets': 0, 'owned': OwnedCards()}
+    out = [c['rarity'] for c, _, _ in iter_pull(catalog, user, 5, ['UR', 'SS'], 42, only_sss)]
+    assert sorted(out) == ['SS', 'SSS', 'SSS', 'SSS', 'UR']
+
+    for seed in range(20):
+        rng = random.Random(seed)
+        expected = gacha.choose_rarity(40, rng)
+        random.seed(seed)
+        place_guarantees(expected, ['UR', 'SSS', 'SS'])
+        a = [c['id'] for c, _, _ in iter_pull(catalog, {'tickets': 0, 'owned': OwnedCards()}, 40, ['UR', 'SSS', 'SS'], seed)]
+        b = [c['id'] for c, _, _ in iter_pull(catalog, {'tickets': 0, 'owned': OwnedCards()}, 40, ['UR', 'SSS', 'SS'], seed)]
+        assert a == b
+        got = [catalog.by_id[i]['rarity'] for i in a]
+        for g in ('UR', 'SSS', 'SS'):
+            assert g in got
+
+
+def _peak(count):
+    client, _ = rich_client()
+    tracemalloc.start()
+    r = client.post('/pull/stream', json={'count': count}, buffered=False)
+    n = sum(chunk.count(b'\n') for chunk in r.response)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert n == count + 1
+    return peak
+
+
+def test_stream_memory_is_flat():
+    small, big = _peak(2000), _peak(40000)
+    assert big < small * 2
@@ -0,0 +1,106 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
+
+import pytest
+
+import app as app_mod
+from app import MAX_PULL_COUNT, app, codec, new_user
+from ratelimit import Limiter, MemoryBuckets, SqliteBuckets, parse_rate
+
+
+@pytest.mark.parametrize('make', [
+    lambda tmp: MemoryBuckets(),
+    lambda tmp: SqliteBuckets(str(tmp / 'rl.db')),
+])
+def test_bucket_refills_at_rate(tmp_path, make):
+    buckets = make(tmp_path)
+    now = 1000.0
+    for _ in range(5):
+        assert buckets.take('k', 2.0, 5, now=now) == 0
+    wait = buckets.take('k', 2.0, 5, now=now)
+    assert wait == pytest.approx(0.5)
+    assert buckets.take('k', 2.0, 5, now=now + 0.5) == 0
+    # other keys are independent
+    assert buckets.take('other', 2.0, 5, now=now) == 0
+    # never refills past the burst
+    for _ in range(5):
+        assert buckets.take('k', 2.0, 5, now=now + 100) == 0
+    assert buckets.take('k', 2.0, 5, now=now + 100) > 0
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    path = str(tmp_path / 'rl.db')
+    a, b = SqliteBuckets(path), SqliteBuckets(path)
+    allowed = []
+
+    def hammer(buckets):
+        for _ in range(20):
+            allowed.append(buckets.take('shared', 0.001, 10, now=50.0) == 0)
+
+    threads = [threading.Thread(target=hammer, args=(x,)) for x in (a, b, a, b)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(allowed) == 10
+
+
+def test_memory_buckets_are_bounded():
+    buckets = MemoryBuckets(max_buckets=3)
+    for key in 'abcd':
+        buckets.take(key, 1, 1, now=0)
+    assert len(buckets._buckets) == 3
+
+
+def test_route_rejects_before_loading_user(monkeypatch):
+    limiter = Limiter(MemoryBuckets(), {'uid': '0.01/2', 'ip': '100/100'})
+    monkeypatch.setattr(app_mod, 'limiter', limiter)
+    loads = []
+    real_get_user = app_mod.get_user
+    monkeypatch.setattr(app_mod, 'get_user', lambda: loads.append(1) or real_get_user())
+    user = new_user()
+    user['tickets'] = 1000
+    client = app.test_client()
+    uid = 'spammer'
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+    codes = [client.post('/pull', json={'count': 1}).status_code for _ in range(4)]
+    assert codes == [200, 200, 429, 429]
+    assert len(loads) == 2
+
+    r = client.post('/buy', json={'rarity': 'B'})
+    assert r.status_code == 429
+    assert int(r.headers['Retry-After']) >= 1
+    assert r.get_json()['retry_after'] == int(r.headers['Retry-After'])
+    assert limiter.rejected[('pull', 'uid')] == 2
+    assert limiter.rejected[('buy', 'uid')] == 1
+
+    # other uids and other routes are unaffected
+    other = app.test_client()
+    other.set_cookie('uid', 'someoneelse')
+    assert other.post('/pull', json={'count': 1}).status_code == 200
+    assert client.get('/deck').status_code == 200
+
+
+def test_pull_count_bounds():
+    client = app.test_client()
+    for count in (0, -5, MAX_PULL_COUNT + 1, 'lots', None, '5', 1.9, True):
+        r = client.post('/pull', json={'count': count})
+        assert r.status_code == 400, count
+    assert client.post('/pull', json={'count': MAX_PULL_COUNT}).status_code == 200
+    assert client.post('/pull/stream', json={'count': -1}).status_code == 400
+    assert client.post('/pull/stream', json={'count': 1.0}).status_code == 400
+
+    # valid JSON that isn't an object
+    for body in ([1, 2], 'str', 3):
+        for path in ('/pull', '/pull/stream'):
+            r = client.post(path, json=body)
+            assert r.status_code == 400 and not r.get_json()['ok'], (path, body)
+
+
+def test_parse_rate():
+    assert parse_rate('5/20') == (5.0, 20.0)
+    assert parse_rate('2') == (2.0, 2.0)
+    with pytest.raises(ValueError):
+        parse_rate('0/5')
@@ -0,0 +1,203 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
+import uuid
+
+import pytest
+
+import app as app_mod
+from app import app, codec, new_user
+from collection import OwnedCards
+from cookie_codec import UidMismatch, _put_varint, unpack_user
+from replay import MemoryRevisions, ResponseCache, SqliteRevisions
+
+
+def test_response_cache_ttl_lru_and_fingerprints():
+    cache = ResponseCache(max_entries=2, ttl=10)
+    assert cache.begin('a', 'x', now=0) == ('new', None)
+    cache.finish('a', 'A', now=0)
+    assert cache.begin('a', 'x', now=5) == ('hit', 'A')
+    assert cache.begin('a', 'y', now=5) == ('mismatch', None)
+    # expired entries run again
+    assert cache.begin('a', 'x', now=11) == ('new', None)
+    cache.abandon('a')
+    assert cache.begin('a', 'x', now=11) == ('new', None)
+
+    for key in 'bcd':
+        cache.begin(key, 'x', now=12)
+        cache.finish(key, key.upper(), now=12)
+    assert len(cache) == 2
+
+
+def test_response_cache_is_bounded_in_bytes():
+    cache = ResponseCache(max_bytes=800, max_size=400, ttl=10)
+    for key in 'abc':
+        cache.begin(key, 'x', now=0)
+        cache.finish(key, key, 300, now=0)
+    # the least recently used response went to make room
+    assert cache.size == 600 and cache.begin('a', 'x', now=1)[0] == 'new'
+    assert cache.begin('b', 'x', now=1) == ('hit', 'b')
+    # 'a' is running and holds nothing; finishing it pushes out 'c', not 'b'
+    cache.finish('a', 'A', 300, now=1)
+    assert cache.size == 600
+    assert cache.begin('b', 'x', now=1) == ('hit', 'b')
+    assert cache.begin('c', 'x', now=1)[0] == 'new'
+    cache.abandon('c')
+
+    # too big to keep: done once, refused afterwards, costs nothing
+    cache.begin('big', 'x', now=1)
+    cache.finish('big', 'B' * 500, 500, now=1)
+    assert cache.begin('big', 'x', now=2) == ('gone', None)
+    assert cache.size == 600
+    # expiry gives the bytes back
+    cache.begin('e', 'x', now=20)
+    assert cache.size == 0
+
+
+def test_oversized_response_is_not_run_twice(monkeypatch):
+    monkeypatch.setattr(app_mod, 'responses', ResponseCache(max_size=1000))
+    client = client_with(new_user())
+    headers = {'Idempotency-Key': 'big-pull'}
+    assert client.post('/pull', json={'count': 100}, headers=headers).status_code == 200
+    coins = codec.loads(client.get_cookie('user_data').value)['coins']
+    r = client.post('/pull', json={'count': 100}, headers=headers)
+    assert r.status_code == 409 and 'too large' in r.get_json()['error']
+    assert codec.loads(client.get_cookie('user_data').value)['coins'] == coins
+
+
+def test_response_cache_repeat_waits_for_the_original():
+    cache = ResponseCache()
+    assert cache.begin('k', 'x')[0] == 'new'
+    threading.Timer(0.05, cache.finish, ('k', 'done')).start()
+    assert cache.begin('k', 'x') == ('hit', 'done')
+
+
+@pytest.mark.parametrize('make', [lambda tmp: MemoryRevisions(),
+                                  lambda tmp: SqliteRevisions(str(tmp / 'rev.db'))])
+def test_revisions_compare_and_set(tmp_path, make):
+    revs = make(tmp_path)
+    assert revs.latest('u') is None
+    assert revs.claim('u', 0)
+    assert not revs.claim('u', 0)
+    assert revs.claim('u', 1) and revs.latest('u') == 2
+    revs.release('u', 1)
+    assert revs.claim('u', 1)
+
+
+def test_v1_cookies_decode_with_rev_zero():
+    buf = bytearray([1])
+    for n in (500, 7, 1, 2, 3):
+        _put_varint(buf, n)
+    buf += bytes([0]) + OwnedCards.from_ids([4]).to_bytes()
+    user = unpack_user(bytes(buf))
+    assert (user['coins'], user['pity_ur'], user['rev'], list(user['owned'])) == (500, 3, 0, [4])
+
+
+def client_with(user):
+    client = app.test_client()
+    uid = 'replay' + uuid.uuid4().hex
+    client.set_cookie('uid', uid)
+    client.set_cookie('user_data', codec.dumps(user, uid))
+    return client
+
+
+def test_idempotency_key_runs_a_pull_once():
+    client = client_with(new_user())
+    headers = {'Idempotency-Key': 'click-1'}
+    first = client.post('/pull', json={'count': 10}, headers=headers)
+    again = client.post('/pull', json={'count': 10}, headers=headers)
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert again.get_json() == first.get_json()
+    assert first.get_json()['coins'] == new_user()['coins'] - 1000
+
+    assert client.post('/pull', json={'count': 1}, headers=headers).status_code == 422
+    other = client.post('/pull', json={'count': 10}, headers={'Idempotency-Key': 'click-2'})
+    assert other.get_json()['coins'] == new_user()['coins'] - 2000
+
+
+def test_old_cookie_cannot_spend_again():
+    user = new_user()
+    user['tickets'] = 10 ** 6
+    client = client_with(user)
+    old = client.get_cookie('user_data').value
+    assert client.post('/buy', json={'rarity': 'B'}).get_json()['ok']
+    fresh = client.get_cookie('user_data').value
+    assert codec.loads(fresh)['rev'] == 1
+
+    client.set_cookie('user_data', old)
+    r = client.post('/pull', json={'count': 10})
+    assert r.status_code == 409 and r.get_json()['stale']
+    assert client.post('/buy', json={'rarity': 'B'}).status_code == 409
+
+    client.set_cookie('user_data', fresh)
+    assert client.post('/pull', json={'count': 10}).get_json()['ok']
+
+    # a reset outranks everything issued before it
+    assert client.post('/reset', json={'confirm': True}).get_json()['ok']
+    assert codec.loads(client.get_cookie('user_data').value)['rev'] == 3
+    client.set_cookie('user_data', fresh)
+    assert client.post('/pull', json={'count': 1}).status_code == 409
+
+
+def test_reset_on_a_worker_that_never_saw_the_uid(monkeypatch):
+    # two workers with their own memory revisions
+    a, b = MemoryRevisions(), MemoryRevisions()
+    user = new_user()
+    user['coins'] = 10 ** 6
+    client = client_with(user)
+    monkeypatch.setattr(app_mod, 'revisions', a)
+    for _ in range(3):
+        assert client.post('/pull', json={'count': 1}).status_code == 200
+
+    monkeypatch.setattr(app_mod, 'revisions', b)
+    assert client.post('/reset', json={'confirm': True}).get_json()['ok']
+    assert codec.loads(client.get_cookie('user_data').value)['rev'] == 4
+
+    monkeypatch.setattr(app_mod, 'revisions', a)
+    assert [client.post('/pull', json={'count': 1}).status_code for _ in range(3)] == [200] * 3
+
+
+def test_old_cookie_under_a_new_uid_is_still_stale():
+    user = new_user()
+    user['tickets'] = 10 ** 6
+    client = client_with(user)
+    old = client.get_cookie('user_data').value
+    assert client.post('/buy', json={'rarity': 'B'}).get_json()['ok']
+
+    # the uid cookie isn't signed, but the state is bound to the old one
+    other = app.test_client()
+    other.set_cookie('uid', 'bbb' + uuid.uuid4().hex)
+    other.set_cookie('user_data', old)
+    r = other.post('/buy', json={'rarity': 'B'})
+    assert r.status_code == 409 and r.get_json()['stale']
+    assert other.post('/pull', json={'count': 10}).status_code == 409
+    # readable, but never re-issued under the new uid
+    r = other.get('/deck')
+    assert r.status_code == 200 and 'user_data=' not in ', '.join(r.headers.getlist('Set-Cookie'))
+
+
+def test_unbound_cookie_is_honoured_once():
+    # cookies written before the uid tag carry no uid
+    user = new_user()
+    user['coins'] = 123457
+    old = codec.dumps(user)
+    clients = []
+    for _ in range(2):
+        client = app.test_client()
+        client.set_cookie('uid', 'pre' + uuid.uuid4().hex)
+        client.set_cookie('user_data', old)
+        clients.append(client)
+    assert [c.post('/pull', json={'count': 1}).status_code for c in clients] == [200, 409]
+    # the upgraded cookie is bound to the uid that spent it
+    first = clients[0]
+    assert codec.load_for(first.get_cookie('user_data').value, first.get_cookie('uid').value)[1]
+    assert clients[1].get_cookie('user_data').value == old
+
+
+def test_cookie_uid_tag():
+    user = new_user()
+    value = codec.dumps(user, 'aaa')
+    assert codec.load_for(value, 'aaa') == (user, True)
+    with pytest.raises(UidMismatch):
+        codec.loads(value, 'bbb')
+    assert codec.load_for(codec.dumps(user), 'bbb') == (user, False)
@@ -0,0 +1,72 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import http.client
+import signal
+import socket
+import subprocess
+import time
+
+import pytest
+
+from serve import parse_bind, read_memory
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_parse_bind():
+    assert parse_bind('127.0.0.1:8080') == ('127.0.0.1', 8080)
+    assert parse_bind(':9000') == ('0.0.0.0', 9000)
+    assert parse_bind('[::1]:8000') == ('::1', 8000)
+
+
+def test_read_memory_self():
+    mem = read_memory(os.getpid())
+    if mem is None:
+        pytest.skip('no /proc')
+    assert mem['rss'] > 0 and mem['pss'] > 0
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork()')
+def test_workers_serve_and_get_recycled(tmp_path):
+    port = _free_port()
+    log = open(tmp_path / 'out.txt', 'w+')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--bind', '127.0.0.1:%d' % port,
+         '--workers', '2', '--max-requests', '3'],
+        stdout=log, stderr=subprocess.DEVNULL,
+        env=dict(os.environ, NEXORIA_REPLAY='sqlite:' + str(tmp_path / 'revisions.db')),
+    )
+    try:
+        deadline = time.time() + 15
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                assert time.time() < deadline and proc.poll() is None
+                time.sleep(0.05)
+
+        for _ in range(20):
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            conn.request('GET', '/')
+            r = conn.getresponse()
+            r.read()
+            conn.close()
+            assert r.status == 200
+        time.sleep(0.5)
+        proc.send_signal(signal.SIGUSR1)
+        time.sleep(0.5)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=15)
+    log.seek(0)
+    out = log.read()
+    assert 'workers up' in out
+    recycled = [int(line.rsplit(':', 1)[1]) for line in out.splitlines() if 'recycled:' in line]
+    assert recycled and recycled[-1] >= 4
@@ -0,0 +1,63 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+
+import pytest
+
+np = pytest.importorskip('numpy')
+import simulate
+from catalog import get_catalog
+from gacha import PITY_RULES, get_banner
+
+
+def test_small_simulation_is_consistent():
+    merged, elapsed = simulate.run(300, workers=1, batch=150, seed=7, shop=True)
+    rules = simulate.Rules(get_catalog(), get_banner())
+    report = simulate.summarize(merged, elapsed, rules)
+
+    assert report['players'] == 300
+    assert report['total_pulls'] == merged['pulls'].sum()
+    for r, d in report['pulls_to_complete'].items():
+        assert d['completed'] == 1.0, r
+    # nobody can spend tickets they never earned
+    assert (merged['spent'] <= merged['earned']).all()
+    # UR pity hands out an unowned UR at least every 500 pulls
+    ur = rules.tracked.index('UR')
+    threshold = dict((r, t) for r, _, t in PITY_RULES)['UR']
+    assert merged['complete_at'][:, ur].max() <= (threshold + 10) * len(get_catalog().pool('UR'))
+
+
+def test_banner_rules_are_simulated(monkeypatch):
+    import banners
+    catalog = get_catalog()
+    spec = {'id': 'up', 'rates': {'UR': 1}, 'pity': {'SS': 3}, 'rate_up': {'UR': {'ids': [1], 'share': 0.9}}}
+    banner = banners.Banner(spec, catalog, PITY_RULES)
+    monkeypatch.setattr(simulate, 'get_banner', lambda banner_id=None, catalog=None: banner)
+
+    rules = simulate.Rules(catalog, banner)
+    assert rules.p[rules.labels.index('UR')] == 1
+    assert rules.p[rules.labels.index('B')] == 0
+    assert ('SS', 'pity_ss', 3) in [p[1:] for p in rules.pity]
+
+    merged, elapsed = simulate.run(2000, pull_size=1, max_pulls=2, workers=1, seed=5, banner='up')
+    report = simulate.summarize(merged, elapsed, rules)
+    assert report['banner'] == 'up'
+    # two UR pulls: a duplicate about 81% of the time with the rate-up card, 10% without
+    dup = (merged['earned'] > 0).mean()
+    assert 0.75 < dup < 0.87
+    # SS pity at 3 never fires in 2 pulls
+    assert report['pity_fired']['SS']['per_player_mean'] == 0
+
+
+def test_fallback_placement_keeps_earlier_guarantees():
+    catalog = get_catalog()
+    rules = simulate.Rules(catalog, get_banner())
+    # three slots, no low rarity to overwrite, all three pity rules firing
+    top = [rules.labels.index(r) for r in ('SSS', 'UR')]
+    rng = np.random.default_rng(0)
+    R = rng.choice(top, size=(2000, 3))
+    F = np.ones((2000, len(rules.pity)), dtype=bool)
+    G = simulate.place_guarantees(rules, R, F, rng)
+    for gl, r, _, _ in rules.pity:
+        assert (R == gl).any(axis=1).all(), r
+    assert (G.sum(axis=1) <= 3).all()
@@ -0,0 +1,67 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import pickle
+
+from catalog import CARDS_FILE, build_catalog, validate_cards, write_snapshot
+from coldstart import template_cache
+
+
+def _same(a, b):
+    assert [dict(c) for c in a.cards] == [dict(c) for c in b.cards]
+    assert a.content_hash == b.content_hash
+    assert dict(a.rarity_masks) == dict(b.rarity_masks)
+    assert [c['id'] for c in a.deck_order] == [c['id'] for c in b.deck_order]
+    # indexes point at the same card objects, not copies
+    for card_id, card in b.by_id.items():
+        assert any(c is card for c in b.by_rarity[card['rarity']])
+
+
+def test_snapshot_round_trip_and_staleness(tmp_path):
+    src = tmp_path / 'cards.json'
+    src.write_bytes(open(CARDS_FILE, 'rb').read())
+    snap = str(tmp_path / 'catalog.pickle')
+
+    fresh = build_catalog(str(src))
+    write_snapshot(fresh, src.read_bytes(), snap)
+    loaded = build_catalog(str(src), snap)
+    _same(fresh, loaded)
+    assert loaded.version == fresh.version
+
+    # any edit to cards.json makes the snapshot stale
+    cards = json.loads(src.read_text())
+    cards[0]['name'] = 'Edited'
+    src.write_text(json.dumps(cards))
+    assert build_catalog(str(src), snap).by_id[cards[0]['id']]['name'] == 'Edited'
+
+    # garbage is ignored too
+    with open(snap, 'wb') as f:
+        pickle.dump('nope', f)
+    assert build_catalog(str(src), snap).by_id[cards[0]['id']]['name'] == 'Edited'
+
+
+def test_validate_cards():
+    errors, warnings = validate_cards([
+        {'id': 1, 'name': 'a', 'rarity': 'B'},
+        {'id': 1, 'name': 'b', 'rarity': 'B'},
+        {'id': -2, 'name': 'c', 'rarity': 'B'},
+        {'id': 3, 'name': '', 'rarity': 'Z'},
+    ])
+    assert len(errors) == 3 and len(warnings) == 1
+
+
+def test_template_cache_ignores_paths_and_readonly_dirs(tmp_path):
+    cache = template_cache(str(tmp_path))
+    assert cache.get_cache_key('deck.html', '/a/deck.html') == cache.get_cache_key('deck.html', '/b/deck.html')
+
+    from jinja2 import DictLoader, Environment
+    env = Environment(loader=DictLoader({'t.html': 'hi {{ x }}'}), bytecode_cache=cache)
+    env.get_template('t.html')
+    assert os.listdir(str(tmp_path))
+
+    os.chmod(str(tmp_path), 0o500)
+    try:
+        readonly = Environment(loader=DictLoader({'u.html': 'yo'}), bytecode_cache=template_cache(str(tmp_path)))
+        assert readonly.get_template('u.html').render() == 'yo'
+    finally:
+        os.chmod(str(tmp_path), 0o700)
@@ -0,0 +1,119 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+import json
+
+import app as app_mod
+from app import app
+from catalog import get_catalog
+from collection import OwnedCards
+from stats import Stats, ownership_delta, rebuild
+import rebuild_stats
+
+
+def test_ownership_delta():
+    catalog = get_catalog()
+    ur = catalog.rarity_ids['UR']
+    full = OwnedCards.from_ids(ur).bits
+    owners, completed, players = ownership_delta(catalog, 0, full)
+    assert owners == dict.fromkeys(ur, 1)
+    assert completed == {'UR': 1} and players == 1
+    owners, completed, players = ownership_delta(catalog, full, 0)
+    assert set(owners.values()) == {-1} and completed == {'UR': -1} and players == -1
+    assert ownership_delta(catalog, full, full) == ({}, {}, 0)
+
+
+def test_routes_update_the_aggregate(tmp_path, monkeypatch):
+    st = Stats(str(tmp_path / 'stats.db'), flush_interval=60)
+    monkeypatch.setattr(app_mod, 'stats', st)
+    catalog = get_catalog()
+
+    a, b = app.test_client(), app.test_client()
+    ra = a.post('/pull', json={'count': 10}).get_json()['results']
+    rb = b.post('/pull', json={'count': 20}).get_json()['results']
+    b.get('/deck')  # no change, no delta
+    st.flush()
+
+    snap = st.snapshot(catalog)
+    assert snap['players'] == 2
+    assert snap['total_pulls'] == 30
+    expected = {}
+    for results in (ra, rb):
+        for card_id in {r['id'] for r in results}:
+            expected[card_id] = expected.get(card_id, 0) + 1
+    assert {int(k): v for k, v in snap['owners'].items() if v} == expected
+
+    # reset throws b's collection away
+    assert b.post('/reset', json={'confirm': True}).get_json()['ok']
+    st.flush()
+    snap = app.test_client().get('/api/stats').get_json()
+    assert snap['players'] == 1
+    assert sum(snap['owners'].values()) == len({r['id'] for r in ra})
+    assert snap['total_pulls'] == 30
+    st.close()
+
+
+def test_rebuild_from_user_files(tmp_path):
+    catalog = get_catalog()
+    users = tmp_path / 'user_data'
+    users.mkdir()
+    ur = list(catalog.rarity_ids['UR'])
+    for i, owned in enumerate([ur, ur[:3], [], [ur[0], 151]]):
+        (users / ('u%d.json' % i)).write_text(json.dumps({'coins': 0, 'owned': owned}))
+    (users / 'broken.json').write_text('{')
+
+    db = str(tmp_path / 'stats.db')
+    assert rebuild_stats.main([db, '--src', str(users)]) == 1  # one unreadable file
+
+    snap = Stats(db).snapshot(catalog)
+    assert snap['players'] == 3
+    assert snap['owners'][str(ur[0])] == 3
+    assert snap['owners']['151'] == 1
+    assert snap['rarities']['UR']['completed_players'] == 1
+
+    # rebuilding again replaces, it doesn't add up
+    rebuild(db, catalog, iter([OwnedCards.from_ids(ur).bits]))
+    snap = Stats(db).snapshot(catalog)
+    assert snap['players'] == 1 and snap['owners'][str(ur[0])] == 1
+
+
+def test_stats_disabled():
+    assert app.test_client().get('/api/stats').status_code == 404
+
+
+def test_reset_with_stats_resets_any_cookie(tmp_path, monkeypatch):
+    st = Stats(str(tmp_path / 'stats.db'), flush_interval=60)
+    monkeypatch.setattr(app_mod, 'stats', st)
+    client = app.test_client()
+    # state bound to another uid: get_user() would only show it
+    client.set_cookie('uid', 'resetme')
+    client.set_cookie('user_data', app_mod.codec.dumps(app_mod.new_user(), 'someoneelse'))
+    resp = client.post('/reset', json={'confirm': True})
+    assert resp.get_json()['ok']
+    cookies = {c.split('=', 1)[0] for c in resp.headers.getlist('Set-Cookie')}
+    assert cookies == {'uid', 'user_data'}
+    assert app_mod.codec.loads(client.get_cookie('user_data').value, 'resetme')['coins'] == app_mod.new_user()['coins']
+    st.close()
+
+
+def test_failed_flush_keeps_the_deltas(tmp_path, monkeypatch, capsys):
+    import time
+    import stats as stats_mod
+    catalog = get_catalog()
+    ur = catalog.rarity_ids['UR']
+    st = Stats(str(tmp_path / 'stats.db'), flush_interval=0.01)
+    good = stats_mod.ADD_OWNERS
+    monkeypatch.setattr(stats_mod, 'ADD_OWNERS', 'not sql')
+    st.record(catalog, 0, OwnedCards.from_ids(ur[:2]).bits, {'UR': 2})
+    time.sleep(0.1)
+    # the writer is still there and nothing was lost
+    assert st._thread.is_alive()
+    assert 'flush failed' in capsys.readouterr().err
+    assert st.snapshot(catalog)['players'] == 0
+
+    monkeypatch.setattr(stats_mod, 'ADD_OWNERS', good)
+    st.record(catalog, OwnedCards.from_ids(ur[:2]).bits, OwnedCards.from_ids(ur[:3]).bits, {'UR': 1})
+    st.close()
+    snap = st.snapshot(catalog)
+    assert snap['players'] == 1
+    assert {int(k): v for k, v in snap['owners'].items() if v} == dict.fromkeys(ur[:3], 1)
@@ -0,0 +1,86 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import threading
+
+import pytest
+
+import app as app_mod
+from collection import OwnedCards
+from storage import JsonFileStore, SqliteStore, normalize_user
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+import import_user_data
+
+
+def sample_user(**kw):
+    user = normalize_user({'coins': 1000, 'owned': [3, 9], 'tickets': 5})
+    user.update(kw)
+    return user
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        return JsonFileStore(str(tmp_path / 'users'))
+    return SqliteStore(str(tmp_path / 'users.db'))
+
+
+def test_roundtrip(store):
+    assert store.load('abc123') is None
+    store.save('abc123', sample_user(pity_ur=42))
+    user = store.load('abc123')
+    assert user == sample_user(pity_ur=42)
+    assert isinstance(user['owned'], OwnedCards)
+
+
+def test_atomic_read_modify_write(store):
+    store.save('abc123', sample_user(coins=0))
+
+    def spend():
+        for _ in range(25):
+            with store.atomic('abc123'):
+                user = store.load('abc123')
+                user['coins'] += 1
+                store.save('abc123', user)
+
+    threads = [threading.Thread(target=spend) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.load('abc123')['coins'] == 100
+
+
+def test_json_store_rejects_path_uids(tmp_path):
+    store = JsonFileStore(str(tmp_path))
+    assert store.load('../secret') is None
+    with pytest.raises(ValueError):
+        store.save('../secret', sample_user())
+
+
+def test_importer(tmp_path):
+    src = tmp_path / 'user_data'
+    src.mkdir()
+    (src / 'aaa.json').write_text(json.dumps({'coins': 99900, 'owned': [151], 'tickets': 0}))
+    (src / 'bbb.json').write_text(json.dumps({'coins': 100000, 'owned': [], 'tickets': 0}))
+
+    db = str(tmp_path / 'users.db')
+    assert import_user_data.main(['sqlite:' + db, '--src', str(src)]) == 0
+    store = SqliteStore(db)
+    assert list(store.load('aaa')['owned']) == [151]
+    assert store.load('bbb')['coins'] == 100000
+
+
+def test_app_with_sqlite_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_mod, 'store', SqliteStore(str(tmp_path / 'users.db')))
+    with app_mod.app.test_client() as client:
+        client.get('/')
+        uid = client.get_cookie('uid').value
+        assert client.get_cookie('user_data') is None
+
+        j = client.post('/pull', json={'count': 10}).get_json()
+        assert j['ok']
+        user = app_mod.store.load(uid)
+        assert user['coins'] == j['coins'] == 100000 - 1000
+        assert len(user['owned']) == len({r['id'] for r in j['results']})